@@ -1,5 +1,7 @@
 import pytest
+from pathlib import Path
 from .helpers import tdenv, touch
+from tradedangerous import TradeEnv
 from tradedangerous.tradedb import TradeDB
 
 
@@ -20,6 +22,29 @@ def touchdb():
     return touch(tdenv.dataDir, 'TradeDangerous.db')
 
 
+@pytest.fixture
+def empty_tdb(tmp_path):
+    """
+    Factory for an unloaded TradeDB in tmp_path with a fresh schema,
+    seeded by the rows_sql script; closed after the test.
+    """
+    made = []
+    
+    def make(rows_sql=""):
+        tdbEnv = TradeEnv(dataDir=str(tmp_path), csvDir=str(tmp_path), quiet=1)
+        tdb = TradeDB(tdenv=tdbEnv, load=False)
+        db = tdb.getDB()
+        db.executescript(Path(tdb.templatePath, "TradeDangerous.sql").read_text())
+        db.executescript(rows_sql)
+        db.commit()
+        made.append(tdb)
+        return tdb
+    
+    yield make
+    for tdb in made:
+        tdb.close()
+
+
 def pytest_addoption(parser):
     parser.addoption(
         "--runslow", action="store_true", default=False, help="run slow tests"
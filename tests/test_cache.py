@@ -1,10 +1,28 @@
+import os
 import pytest
+import re
+import sqlite3
 from collections import namedtuple
+from pathlib import Path
 
-from tradedangerous import cache
+from tradedangerous import cache, TradeEnv
 
 FakeFile = namedtuple('FakeFile', ['name'])
 
+@pytest.fixture
+def tdb(empty_tdb):
+    return empty_tdb("""
+        INSERT INTO Category (category_id, name) VALUES (1, 'Metals'), (15, 'Unknown');
+        INSERT INTO Item (item_id, name, pretty_name, category_id)
+            VALUES (1, 'GOLD', 'Gold', 1), (2, 'SILVER', 'Silver', 1);
+        INSERT INTO System (system_id, name, pretty_name, pos_x, pos_y, pos_z)
+            VALUES (1, 'SOL', 'Sol', 0, 0, 0);
+        INSERT INTO Station (station_id, name, pretty_name, system_id)
+            VALUES (1, 'DAEDALUS', 'Daedalus', 1), (2, 'RAMON', 'Ramon', 1),
+                   (3, 'WOLF', 'Wolf', 1);
+    """)
+
+
 class TestCache(object):
     def test_parseSupply(self):
         fil = FakeFile('faked-file.prices')
@@ -37,3 +55,238 @@ class TestCache(object):
                 10,
                 'demand',
                 reading)
+    
+    def test_splitSqlScript(self):
+        tables, indexes = cache.splitSqlScript(
+            "CREATE TABLE T (a, b, UNIQUE (a));\n"
+            "-- by b\n"
+            " CREATE INDEX t_b ON T (b);\n"
+            "CREATE UNIQUE INDEX t_ab ON T (a, b);\n"
+        )
+        assert "t_b" in indexes and "t_b" not in tables
+        assert "t_ab" in tables and "t_ab" not in indexes
+    
+    def test_processImportFile(self, tmp_path):
+        tdenv = TradeEnv(quiet=1)
+        db = sqlite3.connect(":memory:")
+        db.execute("PRAGMA foreign_keys=ON")
+        db.executescript("""
+            CREATE TABLE System (system_id INTEGER PRIMARY KEY, name VARCHAR(40) COLLATE nocase);
+            CREATE TABLE Station (
+                station_id INTEGER PRIMARY KEY, name VARCHAR(40) COLLATE nocase,
+                system_id INTEGER NOT NULL,
+                FOREIGN KEY (system_id) REFERENCES System(system_id)
+            );
+            CREATE TABLE Vendor (
+                station_id INTEGER NOT NULL, price INTEGER,
+                FOREIGN KEY (station_id) REFERENCES Station(station_id)
+            );
+            INSERT INTO System VALUES (1, 'SOL'), (2, 'LAVE');
+            INSERT INTO Station VALUES (10, 'ABRAHAM', 1), (20, 'ABRAHAM', 2);
+        """)
+        path = tmp_path / "Vendor.csv"
+        path.write_text(
+            "unq:!name@System.system_id,unq:name@Station.station_id,price\n"
+            "'Sol','Abraham',100\n"
+            "'Nowhere','Abraham',200\n"
+            "\n"
+            "'lave','abraham',300\n"
+        )
+        cache.processImportFile(tdenv, db, path, "Vendor")
+        # The unknown system's row fails the NOT NULL, and is skipped.
+        assert db.execute("SELECT * FROM Vendor ORDER BY price").fetchall() == [
+            (10, 100), (20, 300),
+        ]
+        
+        path.write_text(
+            "unq:!name@System.system_id,unq:name@Station.station_id,price\n"
+            "'Sol','Abraham',100\n"
+            "'SOL','ABRAHAM',200\n"
+        )
+        with pytest.raises(cache.DuplicateKeyError):
+            cache.processImportFile(tdenv, db, path, "Vendor")
+    
+    def test_readImportFiles(self, tmp_path, monkeypatch):
+        paths = []
+        for n in range(3):
+            path = tmp_path / "T{}.csv".format(n)
+            path.write_text("unq:name,value\n" + "'x',{}\n".format(n) * (n + 1))
+            paths.append(path)
+        paths.append(tmp_path / "missing.csv")
+        expected = [cache.readImportFile(path) for path in paths[:3]]
+        
+        # Read them with worker processes.
+        monkeypatch.setattr(cache, "parallelImportBytes", 0)
+        monkeypatch.setattr(cache.os, "cpu_count", lambda: 2)
+        readers = list(cache.readImportFiles(paths))
+        assert [reader() for reader in readers[:3]] == expected
+        with pytest.raises(FileNotFoundError):
+            readers[3]()
+    
+    def test_splitItemLine(self):
+        assert cache.splitItemLine("Hydrogen  Fuel 105 110 ? 6L 2024-01-02 03:04:05") == (
+            "Hydrogen Fuel", "105", "110", "?", "6L", "2024-01-02 03:04:05",
+        )
+        # Anything else is left to newItemPriceRe.
+        assert cache.splitItemLine("Gold 100 110 ? 6L now") is None
+        assert cache.splitItemLine("Gold 100 110") is None
+        assert cache.splitItemLine("Gold 100 110 7X 6L 2024-01-02 03:04:05") is None
+    
+    def test_processPricesFile(self, tdb, monkeypatch):
+        import gzip
+        
+        tdenv, db, tmp_path = tdb.tdenv, tdb.getDB(), Path(tdb.tdenv.dataDir)
+        monkeypatch.setattr(cache, "pricesBatchStations", 1)
+        
+        path = tmp_path / "import.prices.gz"
+        with gzip.open(str(path), 'wt') as fh:
+            fh.write(
+                "@ SOL/Daedalus\n"
+                "   Gold   100 110 ? 6L 2024-01-02 03:04:05\n"
+                "   Silver 50 0 10M - 2024-01-02 03:04:05\n"
+                "@ SOL/Ramon\n"
+                "   Gold   90 0 ? - now\n"
+                "   Painite 200 0 10H -\n"
+            )
+        cache.processPricesFile(tdenv, db, path)
+        rows = "SELECT station_id, item_id, demand_price, supply_price, demand_units FROM StationItem ORDER BY 1, 2"
+        painite = db.execute("SELECT item_id FROM Item WHERE name = 'PAINITE'").fetchone()[0]
+        assert db.execute(rows).fetchall() == [
+            (1, 1, 100, 110, -1), (1, 2, 50, 0, 10), (2, 1, 90, 0, -1), (2, painite, 200, 0, 10),
+        ]
+        
+        # Merging keeps newer prices, and a zero price removes the item.
+        tdenv.mergeImport = True
+        path = tmp_path / "merge.prices"
+        path.write_text(
+            "@ SOL/Daedalus\n"
+            "   Gold   120 130 ? 6L 2020-01-01 00:00:00\n"
+            "   Silver 0 0 - - 2025-01-01 00:00:00\n"
+            "@ SOL/Ramon\n"
+            "   Silver 60 0 ? - 2025-01-01 00:00:00\n"
+        )
+        cache.processPricesFile(tdenv, db, path)
+        assert db.execute(rows).fetchall() == [
+            (1, 1, 100, 110, -1), (2, 1, 90, 0, -1), (2, 2, 60, 0, -1), (2, painite, 200, 0, 10),
+        ]
+        
+        # A station listed twice keeps the items from both listings.
+        tdenv.mergeImport = False
+        path.write_text(
+            "@ SOL/Ramon\n"
+            "   Gold   95 0 ? - 2025-01-01 00:00:00\n"
+            "@ SOL/Daedalus\n"
+            "@ SOL/Ramon\n"
+            "   Silver 65 0 ? - 2025-01-01 00:00:00\n"
+        )
+        cache.processPricesFile(tdenv, db, path)
+        assert db.execute(rows).fetchall() == [
+            (2, 1, 95, 0, -1), (2, 2, 65, 0, -1),
+        ]
+    
+    def test_regeneratePricesFile(self, tdb, monkeypatch):
+        db = tdb.getDB()
+        db.executescript("""
+            INSERT INTO StationItem VALUES
+                (1, 1, 100, 10, 1, 110, 5, 1, '2024-01-01 00:00:00', 0),
+                (1, 2, 50, 10, 1, 0, 0, 0, '2024-01-01 00:00:00', 0),
+                (2, 1, 90, 10, 1, 0, 0, 0, '2024-01-01 00:00:00', 0),
+                (3, 2, 70, 10, 1, 0, 0, 0, '2024-01-01 00:00:00', 0);
+        """)
+        db.commit()
+        
+        def regenerate(full=False):
+            cache.regeneratePricesFile(tdb, tdb.tdenv, full=full)
+            return tdb.pricesPath.read_text()
+        
+        def update(script):
+            db.executescript(script)
+            db.commit()
+            dumped = regenerate()
+            assert dumped == regenerate(full=True)
+            return dumped
+        
+        first = regenerate()
+        assert "@ SOL / Ramon" in first
+        assert regenerate() == first
+        assert not db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger'"
+        ).fetchall()
+        
+        dumps = []
+        real = cache.dumpPrices
+        def dumpPrices(*args, **kwargs):
+            dumps.append(kwargs.get("stationIDs"))
+            return real(*args, **kwargs)
+        monkeypatch.setattr(cache, "dumpPrices", dumpPrices)
+        # Rewriting a station as it was changes nothing.
+        db.execute("UPDATE Station SET pretty_name = pretty_name WHERE station_id = 1")
+        db.commit()
+        assert regenerate() == first
+        assert dumps == []
+        # One station changed out of three: only its block is dumped.
+        dumped = update("UPDATE StationItem SET demand_price = 95 WHERE station_id = 2;")
+        assert dumps[0] == [2]
+        assert re.search(r"@ SOL / Ramon\n.*\n +Gold +95 ", dumped)
+        monkeypatch.undo()
+        
+        # Removed and renamed stations.
+        assert "Ramon" not in update("DELETE FROM StationItem WHERE station_id = 2;")
+        assert "@ SOL / Tereshkova" in update("UPDATE Station SET pretty_name = 'Tereshkova' WHERE station_id = 3;")
+        # A changed item name changes the whole file.
+        assert "Platinum" in update("UPDATE Item SET pretty_name = 'Platinum' WHERE item_id = 2;")
+    
+    def test_binaryPrices(self, tdb):
+        from tradedangerous.binprices import BinaryPrices
+        
+        db = tdb.getDB()
+        db.executescript("""
+            INSERT INTO StationItem VALUES
+                (3, 2, 70, 10, 1, 0, 0, 0, '2024-01-03 00:00:00', 1),
+                (1, 2, 50, 10, 1, 0, 0, 0, '2024-01-02 00:00:00', 0),
+                (1, 1, 100, 10, 1, 110, 5, 2, '2024-01-01 12:34:56', 0);
+        """)
+        db.commit()
+        rows = "SELECT * FROM StationItem ORDER BY station_id, item_id"
+        expected = db.execute(rows).fetchall()
+        
+        assert cache.pricesSource(tdb) is None
+        cache.exportBinaryPrices(tdb, tdb.tdenv)
+        assert cache.pricesSource(tdb) == tdb.binPricesPath
+        prices = BinaryPrices(tdb.binPricesPath)
+        assert len(prices) == 3
+        assert prices.station(1)['item_id'].tolist() == [1, 2]
+        assert prices.station(3)['from_live'].tolist() == [1]
+        assert len(prices.station(2)) == 0
+        
+        db.execute("DELETE FROM Station WHERE station_id = 3")
+        cache.importDataFromFile(tdb, tdb.tdenv, tdb.binPricesPath, reset=True)
+        assert db.execute(rows).fetchall() == expected[:2]
+        
+        # Without --reset, the listed stations' items are replaced, or
+        # with --merge-import, only updated by newer prices.
+        db.executescript("""
+            DELETE FROM StationItem WHERE item_id = 2;
+            INSERT INTO StationItem VALUES
+                (2, 1, 90, 10, 1, 0, 0, 0, '2024-01-05 00:00:00', 0);
+        """)
+        cache.exportBinaryPrices(tdb, tdb.tdenv)
+        prices = "SELECT station_id, item_id, demand_price FROM StationItem"
+        for merging, expectPrices in (
+                (False, [(1, 1, 100), (2, 1, 90)]),
+                (True, [(1, 1, 100), (1, 2, 50), (2, 1, 95)]),
+                ):
+            db.executescript("""
+                INSERT OR REPLACE INTO StationItem VALUES
+                    (1, 2, 50, 10, 1, 0, 0, 0, '2024-01-02 00:00:00', 0),
+                    (2, 1, 95, 10, 1, 0, 0, 0, '2025-01-01 00:00:00', 0);
+            """)
+            tdb.tdenv.mergeImport = merging
+            cache.importDataFromFile(tdb, tdb.tdenv, tdb.binPricesPath)
+            assert sorted(db.execute(prices)) == expectPrices
+        tdb.tdenv.mergeImport = False
+        
+        # A newer .prices file takes over.
+        tdb.pricesPath.write_text("@ SOL/Daedalus\n")
+        os.utime(str(tdb.binPricesPath), (0, 0))
+        assert cache.pricesSource(tdb) == tdb.pricesPath
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+import zmq
+import zmq.asyncio
+
+from tradedangerous.eddn_connector import (
+    CommodityMessage, IngestMetrics, MessageWriter, Subscriber,
+    decodeCommodity, decodeDocked,
+)
+from tradedangerous.misc.eddn_replay import replay
+from tradedangerous.tradedb import TradeDB
+
+
+def eddnTime(minutes):
+    when = datetime.utcnow() - timedelta(minutes=minutes)
+    return when.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def commodity(station, minutes, *prices):
+    return decodeCommodity({
+        'systemName': 'Sol', 'stationName': station,
+        'timestamp': eddnTime(minutes),
+        'commodities': [{
+            'name': name, 'sellPrice': sell, 'buyPrice': 0,
+            'demand': 100, 'demandBracket': 2,
+            'stock': 0, 'stockBracket': "",
+        } for name, sell in prices],
+    })
+
+
+@pytest.fixture
+def tdenv(empty_tdb):
+    tdb = empty_tdb("""
+        INSERT INTO Category (category_id, name) VALUES (1, 'Metals'), (15, 'Unknown');
+        INSERT INTO Item (item_id, name, pretty_name, category_id) VALUES (5, 'GOLD', 'Gold', 1);
+        INSERT INTO System (system_id, name, pretty_name, pos_x, pos_y, pos_z, modified)
+            VALUES (1, 'SOL', 'Sol', 0, 0, 0, '2020-01-01 00:00:00');
+        INSERT INTO Station (station_id, name, pretty_name, system_id)
+            VALUES (1, 'DAEDALUS', 'Daedalus', 1);
+    """)
+    tdb.close()
+    return tdb.tdenv
+
+
+def prices(tdenv):
+    tdb = TradeDB(tdenv=tdenv)
+    try:
+        return sorted(tdb.query("""
+            SELECT station_id, Item.name, demand_price
+              FROM StationItem JOIN Item USING (item_id)
+        """))
+    finally:
+        tdb.close()
+
+
+class TestDecode(object):
+    def test_commodity(self):
+        message = commodity('Daedalus', 0, ('Gold', 9000))
+        assert isinstance(message, CommodityMessage)
+        assert message.prices == [('Gold', 9000, 100, 2, 0, 0, -1)]
+        assert commodity('Daedalus', 0) is None
+    
+    def test_docked(self):
+        message = {
+            'StarSystem': 'Sol', 'StarPos': [0, 0, 0],
+            'StationName': 'Galileo', 'StationType': 'Orbis',
+            'DistFromStarLS': 100.6, 'timestamp': eddnTime(0),
+            'StationServices': ['dock', 'commodities', 'refuel'],
+        }
+        docked = decodeDocked(message)
+        assert docked.lsFromStar == 101
+        assert (docked.market, docked.refuel, docked.repair) == ('Y', 'Y', 'N')
+        message['StationType'] = 'FleetCarrier'
+        assert decodeDocked(message) is None
+
+
+class TestMessageWriter(object):
+    def test_coalesce(self, tdenv):
+        writer = MessageWriter(tdenv, 10, batchStations=10, batchSeconds=60, quiet=True)
+        writer.tdb = TradeDB(tdenv=tdenv)
+        try:
+            writer.apply(commodity('Daedalus', 5, ('Gold', 200)))
+            writer.apply(commodity('Daedalus', 10, ('Gold', 100)))
+            assert len(writer.pending) == 1
+            assert prices(tdenv) == []
+            writer.flush()
+            # The older message lost.
+            assert prices(tdenv) == [(1, 'GOLD', 200)]
+        finally:
+            writer.tdb.close()
+    
+    def test_thread(self, tdenv):
+        writer = MessageWriter(tdenv, 10, batchStations=10, batchSeconds=60, quiet=True)
+        writer.start()
+        writer.put(decodeDocked({
+            'StarSystem': 'Lave', 'StarPos': [75.75, 48.75, 70.75],
+            'StationName': 'Ramon', 'StationType': 'Coriolis',
+            'DistFromStarLS': 300, 'timestamp': eddnTime(2),
+            'StationServices': ['commodities'],
+        }))
+        writer.put(commodity('Daedalus', 1, ('Gold', 100), ('Painite', 50)))
+        msg = commodity('Ramon', 0, ('Gold', 300))
+        writer.put(msg._replace(systemName='Lave'))
+        writer.stop()
+        assert not writer.is_alive()
+        assert prices(tdenv) == [(1, 'GOLD', 100), (1, 'PAINITE', 50), (2, 'GOLD', 300)]
+
+
+def envelope(software, seconds, sellPrice):
+    return zlib.compress(json.dumps({
+        '$schemaRef': 'https://eddn.edcd.io/schemas/commodity/3',
+        'header': {'softwareName': software},
+        'message': {
+            'systemName': 'Sol', 'stationName': 'Daedalus', 'odyssey': True,
+            'timestamp': eddnTime(60 - seconds / 60),
+            'commodities': [{
+                'name': 'Gold', 'sellPrice': sellPrice, 'buyPrice': 0,
+                'demand': 100, 'demandBracket': 2,
+                'stock': 0, 'stockBracket': 0,
+            }],
+        },
+    }).encode())
+
+
+class TestSubscriber(object):
+    def test_replay(self, tdenv):
+        messages = [(None, envelope('Test', n, 1000 + n)) for n in range(200)]
+        messages.append((None, envelope('Unknown', 300, 1)))
+        messages.append((None, b'not zlib'))
+        metrics = IngestMetrics()
+        writer = MessageWriter(tdenv, 10, batchStations=50, batchSeconds=60, quiet=True, metrics=metrics)
+        writer.start()
+        
+        async def replayed():
+            context = zmq.asyncio.Context()
+            publisher = context.socket(zmq.PUB)
+            port = publisher.bind_to_random_port('tcp://127.0.0.1')
+            subscriber = Subscriber(
+                writer, 'tcp://127.0.0.1:{}'.format(port), ['Test'], [],
+                executor=ThreadPoolExecutor(2), queueSize=20, timeout=5,
+                metrics=metrics,
+            )
+            running = asyncio.ensure_future(subscriber.run())
+            # Let the subscriber connect before publishing.
+            await asyncio.sleep(0.3)
+            await replay(publisher, messages)
+            for _ in range(100):
+                if metrics.received == len(messages):
+                    break
+                await asyncio.sleep(0.05)
+            running.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await running
+            publisher.close(linger=0)
+            context.term()
+        
+        asyncio.run(replayed())
+        writer.stop()
+        snapshot = metrics.snapshot()
+        assert snapshot['received'] == len(messages)
+        assert (snapshot['decoded'], snapshot['ignored'], snapshot['errors']) == (200, 1, 1)
+        assert snapshot['committedStations'] >= 1
+        assert set(snapshot['queueDepth']) == {'decode', 'write'}
+        # Newest wins, whichever batch it landed in.
+        assert prices(tdenv) == [(1, 'GOLD', 1199)]
@@ -0,0 +1,44 @@
+import numpy
+
+from tradedangerous.jumpgraph import JumpGraph
+
+
+def brute_force(positions, index, ly):
+    found = []
+    x, y, z = positions[index].tolist()
+    for other, (ox, oy, oz) in enumerate(positions.tolist()):
+        px, py, pz = ox - x, oy - y, oz - z
+        dist = (px*px + py*py + pz*pz) ** 0.5
+        if other != index and dist <= ly:
+            found.append((dist, other))
+    found.sort()
+    return [other for _, other in found], [dist for dist, _ in found]
+
+
+class TestJumpGraph(object):
+    def make_graph(self, tmp_path, count=300, tiers=(10, 20)):
+        rng = numpy.random.default_rng(42)
+        positions = rng.uniform(-40, 40, size=(count, 3)).round(5)
+        systemIDs = numpy.arange(1, count + 1) * 3
+        path = tmp_path / "test.jumps"
+        JumpGraph.build(path, systemIDs, positions, tiers)
+        return JumpGraph(path), systemIDs, positions
+    
+    def test_neighbours(self, tmp_path):
+        graph, systemIDs, positions = self.make_graph(tmp_path)
+        assert len(graph) == len(systemIDs)
+        assert graph.tiers == [10.0, 20.0]
+        for index in (0, 17, 150, 299):
+            for ly in (10, 13.5, 20):
+                found = graph.neighboursOf(index, ly)
+                expected, expectedLy = brute_force(positions, index, ly)
+                assert [other for other, _ in found] == expected
+                assert [dist for _, dist in found] == expectedLy
+    
+    def test_matches(self, tmp_path):
+        graph, systemIDs, positions = self.make_graph(tmp_path)
+        assert graph.matches(systemIDs, positions)
+        moved = positions.copy()
+        moved[5, 1] += 0.5
+        assert not graph.matches(systemIDs, moved)
+        assert not graph.matches(systemIDs[:-1], positions[:-1])
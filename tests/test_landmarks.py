@@ -0,0 +1,80 @@
+from collections import namedtuple
+
+import numpy
+
+from tradedangerous.landmarks import LandmarkTable, _routeLengths
+
+MAX_LY = 12.0
+RNG = numpy.random.default_rng(11)
+# Two clusters too far apart to jump between.
+POSITIONS = numpy.concatenate([
+    RNG.uniform(0, 60, size=(150, 3)),
+    RNG.uniform(500, 530, size=(30, 3)),
+])
+SYSTEM_IDS = numpy.arange(len(POSITIONS)) + 100
+
+FakeSystem = namedtuple('FakeSystem', ('ID',))
+
+
+def neighbours(row):
+    delta = POSITIONS - POSITIONS[row]
+    dist = numpy.sqrt((delta * delta).sum(axis=1))
+    for other in numpy.flatnonzero(dist <= MAX_LY).tolist():
+        if other != row:
+            yield other, float(dist[other])
+
+
+class TestLandmarkTable(object):
+    def test_lower_bound(self):
+        table = LandmarkTable.build(
+            MAX_LY, SYSTEM_IDS, POSITIONS, neighbours, count=4
+        )
+        assert len(table.landmarks) == 4
+        for target in (0, 37, 149, 160):
+            truth = _routeLengths(target, len(POSITIONS), neighbours)
+            bound = table.lowerBound(FakeSystem(SYSTEM_IDS[target]))
+            for row in range(len(POSITIONS)):
+                lower = bound(int(SYSTEM_IDS[row]))
+                if numpy.isfinite(truth[row]):
+                    assert lower <= truth[row] + 1e-9
+                elif numpy.isfinite(table.distances[0, row]):
+                    # row can reach the landmarks but target can't
+                    assert lower == float('inf')
+    
+    def test_save_load(self, tmp_path):
+        table = LandmarkTable.build(
+            MAX_LY, SYSTEM_IDS, POSITIONS, neighbours, count=2
+        )
+        path = tmp_path / ("test" + LandmarkTable.suffix.format(MAX_LY))
+        table.save(path)
+        loaded = LandmarkTable.load(path)
+        assert loaded.maxLy == MAX_LY
+        assert loaded.matches(SYSTEM_IDS, POSITIONS)
+        assert numpy.array_equal(loaded.landmarks, table.landmarks)
+        assert numpy.array_equal(loaded.distances, table.distances)
+
+
+class TestTradeDBLandmarks(object):
+    def test_built_on_request(self, empty_tdb):
+        tdb = empty_tdb("""
+            INSERT INTO System (system_id, name, pretty_name, pos_x, pos_y, pos_z)
+                VALUES (1, 'A', 'A', 0, 0, 0), (2, 'B', 'B', 4, 1, 0),
+                       (3, 'C', 'C', 8, 0, 0), (4, 'D', 'D', 12, 1, 0),
+                       (5, 'E', 'E', 6, 5, 0), (6, 'F', 'F', 40, 0, 0);
+        """)
+        tdb.load()
+        a, d, f = (tdb.lookupSystem(name) for name in "ADF")
+        expected = tdb.getRoute(a, d, 5)
+        assert [s.ID for s, _ in expected] == [1, 2, 3, 4]
+        
+        assert tdb.getLandmarks(5) is None
+        assert not list(tdb.dataPath.glob("*.npz"))
+        assert tdb.getRoute(a, d, 5, engine='alt') == expected
+        
+        tdb.buildLandmarks(10)
+        # Landmarks for longer jumps still bound shorter-jump routes.
+        assert tdb.getLandmarks(5).maxLy == 10
+        assert tdb.getLandmarks(12) is None
+        for engine in ('alt', 'bidir'):
+            assert tdb.getRoute(a, d, 5, engine=engine) == expected
+            assert tdb.getRoute(a, f, 5, engine=engine) is None
@@ -0,0 +1,77 @@
+import pytest
+
+from tradedangerous.pricematrix import PriceMatrix
+
+NOW = 1000000
+
+# station_id, item_id, timestamp,
+# demand_price, demand_units, demand_level,
+# supply_price, supply_units, supply_level
+ROWS = [
+    (2, 10, NOW - 60, 0, 0, 0, 100, 500, 3),
+    (2, 11, NOW - 60, 0, 0, 0, 400, 0, 0),
+    (2, 12, NOW - 60, 0, 0, 0, 250, 50, 2),
+    (1, 10, NOW - 30, 180, -1, -1, 0, 0, 0),
+    (1, 12, NOW - 30, 300, 20, 1, 0, 0, 0),
+    (1, 11, NOW - 30, 900, 0, 0, 0, 0, 0),
+    (3, 12, NOW - 10, 240, 1000, 3, 0, 0, 0),
+]
+
+
+class TestPriceMatrix(object):
+    def test_layout(self):
+        matrix = PriceMatrix.fromRows(ROWS, NOW)
+        assert list(matrix.itemIDs) == [10, 11, 12]
+        # item 11 at station 2 has no supply, so is not selling.
+        assert list(matrix.selling.stationIDs) == [2]
+        assert list(matrix.buying.stationIDs) == [1, 3]
+        assert matrix.stationsSelling[2] == [
+            (10, 100, 500, 3, 60),
+            (12, 250, 50, 2, 60),
+        ]
+        assert 2 not in matrix.stationsBuying
+        assert len(matrix.stationsBuying) == 2
+    
+    def test_min_demand(self):
+        matrix = PriceMatrix.fromRows(ROWS, NOW, minDemand=10)
+        # unknown demand (-1) is always accepted
+        assert [row[0] for row in matrix.stationsBuying[1]] == [10, 12]
+    
+    def test_compare(self):
+        matrix = PriceMatrix.fromRows(ROWS, NOW)
+        srcPos, dstPos, gainCr = matrix.compare(2, 1)
+        assert list(gainCr) == [80, 50]
+        assert list(matrix.itemIDs[matrix.selling.items[srcPos]]) == [10, 12]
+        assert list(matrix.buying.price[dstPos]) == [180, 300]
+        
+        srcPos, dstPos, gainCr = matrix.compare(2, 1, minGainCr=60)
+        assert list(gainCr) == [80]
+        srcPos, dstPos, gainCr = matrix.compare(2, 1, maxCostCr=200)
+        assert list(gainCr) == [80]
+        assert matrix.compare(1, 2) is None
+    
+    def test_compare_many(self):
+        matrix = PriceMatrix.fromRows(ROWS, NOW)
+        group, srcPos, dstPos, gainCr = matrix.compareMany(2, [3, 9, 1])
+        # station 3 only buys at a loss and station 9 buys nothing.
+        assert list(group) == [2, 2]
+        assert list(gainCr) == [80, 50]
+        for grp, dstID in ((0, 3), (2, 1)):
+            single = matrix.compare(2, dstID)
+            sel = group == grp
+            assert list(gainCr[sel]) == list(single[2])
+            assert list(dstPos[sel]) == list(single[1])
+        assert matrix.compareMany(1, [2, 3]) is None
+    
+    def test_has_affordable(self):
+        matrix = PriceMatrix.fromRows(ROWS, NOW)
+        assert matrix.hasAffordable(2)
+        assert matrix.hasAffordable(2, 100)
+        assert not matrix.hasAffordable(2, 99)
+        assert not matrix.hasAffordable(1)
+    
+    def test_bad_timestamp(self):
+        rows = ROWS + [(4, 10, None, 0, 0, 0, 10, 10, 1)]
+        with pytest.raises(ValueError) as e:
+            PriceMatrix.fromRows(rows, NOW)
+        assert e.value.args[0] == (4, 10, None)
@@ -0,0 +1,89 @@
+import calendar
+import datetime
+import sqlite3
+
+import numpy
+
+from tradedangerous.pricematrix import PriceMatrix
+from tradedangerous.pricesnapshot import PriceSnapshot
+
+COLUMNS = """
+    station_id, item_id, CAST(strftime('%s', modified) AS INTEGER),
+    demand_price, demand_units, demand_level,
+    supply_price, supply_units, supply_level
+"""
+
+
+def make_db():
+    rng = numpy.random.default_rng(3)
+    conn = sqlite3.connect(":memory:")
+    conn.execute("""
+        CREATE TABLE StationItem (
+            station_id INTEGER, item_id INTEGER, modified DATETIME,
+            demand_price INT, demand_units INT, demand_level INT,
+            supply_price INT, supply_units INT, supply_level INT
+        )
+    """)
+    start = datetime.datetime(2020, 1, 1)
+    rows = []
+    for station in range(1, 40):
+        for item in rng.choice(30, size=12, replace=False).tolist():
+            modified = start + datetime.timedelta(seconds=int(rng.integers(0, 86400 * 20)))
+            modified = str(modified)
+            if item % 7 == 0:
+                modified += ".25"
+            rows.append((
+                station, item + 1, modified,
+                int(rng.choice([0, 500, 900])), int(rng.integers(-1, 100)), 2,
+                int(rng.choice([0, 400, 800])), int(rng.integers(0, 100)), 1,
+            ))
+    conn.executemany("INSERT INTO StationItem VALUES (?,?,?,?,?,?,?,?,?)", rows)
+    return conn
+
+
+class TestPriceSnapshot(object):
+    def test_select(self, tmp_path):
+        conn = make_db()
+        path = tmp_path / ("TradeDangerous" + PriceSnapshot.suffix)
+        snapshot = PriceSnapshot.build(
+            path, [[1, 2], None], conn.execute("SELECT " + COLUMNS + " FROM StationItem")
+        )
+        assert snapshot.matches([[1, 2], None])
+        assert not snapshot.matches([[1, 3], None])
+        
+        cutoff = datetime.datetime(2020, 1, 11, 6, 30)
+        items = {1, 2, 3, 5, 8, 13, 21}
+        columns = snapshot.select(calendar.timegm(cutoff.timetuple()), items)
+        expected = conn.execute(
+            "SELECT " + COLUMNS + " FROM StationItem"
+            " WHERE modified >= ? AND item_id IN ({})".format(
+                ",".join(map(str, items))
+            ), [str(cutoff)]
+        ).fetchall()
+        # Rows that can never be traded aren't kept.
+        expected = [
+            row for row in expected
+            if row[3] > 0 or (row[6] > 0 and row[7] > 0)
+        ]
+        assert list(zip(*(column.tolist() for column in columns))) == expected
+        
+        loaded = PriceSnapshot(path)
+        assert len(loaded) == len(snapshot)
+        for name, _ in PriceSnapshot.columns:
+            assert numpy.array_equal(loaded.arrays[name], snapshot.arrays[name])
+    
+    def test_price_matrix(self, tmp_path):
+        conn = make_db()
+        path = tmp_path / ("TradeDangerous" + PriceSnapshot.suffix)
+        stmt = "SELECT " + COLUMNS + " FROM StationItem"
+        snapshot = PriceSnapshot.build(path, [None, None], conn.execute(stmt))
+        fromRows = PriceMatrix.fromRows(conn.execute(stmt), 1600000000, 10, 5)
+        fromSnap = PriceMatrix.fromColumns(snapshot.select(), 1600000000, 10, 5)
+        for side in ('selling', 'buying'):
+            one, two = getattr(fromRows, side), getattr(fromSnap, side)
+            assert numpy.array_equal(one.stationIDs, two.stationIDs)
+            assert numpy.array_equal(
+                fromRows.itemIDs[one.items], fromSnap.itemIDs[two.items]
+            )
+            for column in ('price', 'units', 'level', 'modified'):
+                assert numpy.array_equal(getattr(one, column), getattr(two, column))
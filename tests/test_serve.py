@@ -0,0 +1,86 @@
+import json
+import threading
+import urllib.request
+
+import pytest
+
+from tradedangerous import commands
+from tradedangerous.commands.serve_cmd import QueryServer
+
+
+@pytest.fixture
+def server(empty_tdb):
+    tdb = empty_tdb("""
+        INSERT INTO System (system_id, name, pretty_name, pos_x, pos_y, pos_z, modified)
+            VALUES (1, 'SOL', 'Sol', 0, 0, 0, '2020-01-01 00:00:00'),
+                   (2, 'ALPHA CENTAURI', 'Alpha Centauri', 3, 0, 3, '2020-01-01 00:00:00');
+        INSERT INTO Station (station_id, name, pretty_name, system_id)
+            VALUES (1, 'ABRAHAM LINCOLN', 'Abraham Lincoln', 1);
+    """)
+    tdb.close()
+    tdb.load()
+    cmdenv = commands.CommandIndex().parse(["trade", "serve", "--port", "0"])
+    server = QueryServer(("127.0.0.1", 0), cmdenv, tdb)
+    yield server
+    server.server_close()
+
+
+class TestServe(object):
+    def test_query(self, server):
+        status, reply = server.query("local", ["sol", "--ly", "10"])
+        assert status == 200
+        assert "Alpha Centauri" in reply["output"]
+        status, reply = server.query("local", ["nowhere"])
+        assert status == 400
+        assert "Unrecognized" in reply["error"]
+        # Needs trade data, which there isn't any of.
+        status, reply = server.query("run", ["--cap", "1", "--cr", "1"])
+        assert status == 400
+        assert server.query("station", ["sol"])[0] == 404
+        assert server.status()["queries"] == 1
+        assert server.status()["errors"] == 3
+    
+    def test_reload(self, server):
+        conn = server.tdb.getDB()
+        conn.execute("""
+            INSERT INTO System (system_id, name, pretty_name, pos_x, pos_y, pos_z, modified)
+            VALUES (3, 'BARNARD''S STAR', 'Barnard''s Star', 0, 5, 0, '2020-01-01 00:00:00')
+        """)
+        conn.commit()
+        status, reply = server.query("local", ["sol", "--ly", "10"])
+        assert status == 200
+        assert "Barnard's Star" in reply["output"]
+        assert server.status()["refreshes"] == 1
+    
+    def test_http(self, server):
+        url = "http://127.0.0.1:{}/local".format(server.server_address[1])
+        request = urllib.request.Request(url, data=json.dumps(["sol"]).encode())
+        replies = []
+        client = threading.Thread(
+            target=lambda: replies.append(json.load(urllib.request.urlopen(request)))
+        )
+        client.start()
+        # Served from this thread, which owns the TradeDB.
+        server.handle_request()
+        client.join()
+        assert "Sol" in replies[0]["output"]
+    
+    def test_query_env(self, server):
+        conn = server.tdb.getDB()
+        conn.executescript("""
+            INSERT INTO System (system_id, name, pretty_name, pos_x, pos_y, pos_z, modified)
+                VALUES (10, 'SMALL', 'Small', 5, 0, 0, '2020-01-01 00:00:00'),
+                       (11, 'LARGE', 'Large', 5, 3, 0, '2020-01-01 00:00:00'),
+                       (12, 'FAR', 'Far', 10, 0, 0, '2020-01-01 00:00:00');
+            INSERT INTO Station (station_id, name, pretty_name, system_id, max_pad_size)
+                VALUES (10, 'SMALL PORT', 'Small Port', 10, 'S'),
+                       (11, 'LARGE PORT', 'Large Port', 11, 'L');
+            UPDATE Station SET max_pad_size = 'L' WHERE station_id = 1;
+        """)
+        conn.commit()
+        status, reply = server.query("nav", [
+            "sol", "far", "--ly", "6", "--refuel-jumps", "1", "--pad-size", "L",
+        ])
+        assert status == 200
+        assert "Large" in reply["output"] and "Small" not in reply["output"]
+        assert server.tdb.tdenv is server.cmdenv
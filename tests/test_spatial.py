@@ -0,0 +1,40 @@
+import numpy
+import pytest
+
+from tradedangerous.spatial import indexTypes
+
+RNG = numpy.random.default_rng(7)
+POSITIONS = numpy.concatenate([
+    RNG.normal(0, 40, size=(2000, 3)),
+    RNG.uniform(-500, 500, size=(1000, 3)),
+    # duplicate positions and points on cell boundaries
+    numpy.array([(32., 0., -32.), (32., 0., -32.), (-0.5, -0.5, -0.5)]),
+])
+
+
+def brute_force(center, radius):
+    delta = POSITIONS - center
+    distSq = delta[:, 0]*delta[:, 0] + delta[:, 1]*delta[:, 1] + delta[:, 2]*delta[:, 2]
+    return sorted(numpy.flatnonzero(distSq <= radius ** 2).tolist())
+
+
+@pytest.mark.parametrize("indexType", sorted(indexTypes))
+class TestSpatialIndex(object):
+    def test_query(self, indexType):
+        index = indexTypes[indexType](POSITIONS)
+        centers = [tuple(POSITIONS[row].tolist()) for row in (0, 10, 2500, 3000)]
+        centers += [(0., 0., 0.), (1000., 1000., 1000.)]
+        for center in centers:
+            for radius in (5, 31.9, 64, 300):
+                rows, distSq = index.query(center, radius)
+                assert sorted(rows.tolist()) == brute_force(center, radius)
+                delta = POSITIONS[rows] - center
+                assert numpy.array_equal(
+                    distSq,
+                    delta[:, 0]*delta[:, 0] + delta[:, 1]*delta[:, 1] + delta[:, 2]*delta[:, 2]
+                )
+    
+    def test_empty(self, indexType):
+        index = indexTypes[indexType](numpy.zeros((0, 3)))
+        rows, distSq = index.query((0., 0., 0.), 10)
+        assert len(rows) == 0 and len(distSq) == 0
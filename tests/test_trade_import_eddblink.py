@@ -1,3 +1,4 @@
+import json
 import os
 
 import pytest
@@ -56,3 +57,131 @@ class TestTradeImportEddblink(object):
             print(captured.out)
             print("to Here")
         assert "NOTE: Import completed." in captured.out
+
+
+@pytest.fixture
+def bulk(tmp_path, empty_tdb):
+    tdb = empty_tdb("""
+        INSERT INTO Ship (ship_id, name, cost) VALUES (1, 'Cobra Mk. III', 100);
+        INSERT INTO Upgrade (upgrade_id, name, weight, cost) VALUES (7, 'Widget', 1, 250);
+        INSERT INTO Category (category_id, name) VALUES (1, 'Stuff');
+        INSERT INTO Item (item_id, name, category_id) VALUES (5, 'Gold', 1), (6, 'Tea', 1);
+        INSERT INTO System (system_id, name, pretty_name, pos_x, pos_y, pos_z, modified)
+            VALUES (1, 'SOL', 'Sol', 0, 0, 0, '2020-01-01 00:00:00'),
+                   (2, 'LHS 3447', 'LHS 3447', 1, 2, 3, '2020-01-01 00:00:00');
+    """)
+    plug = module.ImportPlugin(tdb, tdb.tdenv)
+    plug.dataPath = tmp_path
+    plug.stageBatchSize = 2
+    plug.listingsChunkSize = 64
+    return tdb, plug
+
+
+def write_jsonl(path, rows):
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+
+
+def station_row(station_id, name, system_id, updated_at, **kwargs):
+    row = {
+        'id': station_id, 'name': name, 'system_id': system_id,
+        'distance_to_star': 100, 'has_blackmarket': False,
+        'max_landing_pad_size': 'L', 'has_market': True,
+        'has_shipyard': False, 'has_outfitting': False,
+        'has_rearm': True, 'has_refuel': True, 'has_repair': True,
+        'is_planetary': False, 'type_id': 3, 'updated_at': updated_at,
+        'shipyard_updated_at': None, 'outfitting_updated_at': None,
+        'selling_ships': [], 'selling_modules': [],
+    }
+    row.update(kwargs)
+    return row
+
+
+class TestEddblinkBulkImport(object):
+    def test_import_systems(self, bulk):
+        tdb, plug = bulk
+        write_jsonl(plug.dataPath / plug.sysPopPath, [
+            # Newer: updated. Older: ignored.
+            {'id': 1, 'name': 'Sol', 'x': 0, 'y': 0, 'z': 1, 'updated_at': 1600000000},
+            {'id': 2, 'name': 'LHS 3447', 'x': 9, 'y': 9, 'z': 9, 'updated_at': 1500000000},
+            # New, then a duplicate name under a different ID.
+            {'id': 3, 'name': 'Achenar', 'x': 5, 'y': 5, 'z': 5, 'updated_at': 1600000000},
+            {'id': 4, 'name': 'Achenar', 'x': 5, 'y': 5, 'z': 6, 'updated_at': 1700000000},
+            # Existing name under a new ID.
+            {'id': 5, 'name': 'Sol', 'x': 0, 'y': 0, 'z': 2, 'updated_at': 1700000000},
+        ])
+        plug.importSystems()
+        rows = tdb.query(
+            "SELECT system_id, name, pos_z FROM System ORDER BY system_id"
+        ).fetchall()
+        assert rows == [(1, 'SOL', 2), (2, 'LHS 3447', 3), (3, 'ACHENAR', 6)]
+        assert plug.mapSystemId(4) == 3 and plug.mapSystemId(5) == 1
+        assert plug.updated['System']
+    
+    def test_import_stations(self, bulk):
+        tdb, plug = bulk
+        plug.options.update(shipvend=True, upvend=True)
+        tdb.query("""
+            INSERT INTO Station (station_id, name, pretty_name, system_id, modified)
+            VALUES (10, 'ABRAHAM', 'Abraham', 1, '2020-01-01 00:00:00')
+        """)
+        write_jsonl(plug.dataPath / plug.stationsPath, [
+            station_row(10, 'Abraham Lincoln', 1, 1600000000,
+                        has_shipyard=True, selling_ships=['Cobra MK III', 'Nope']),
+            station_row(11, 'Daedalus', 1, 1600000000,
+                        has_outfitting=True, selling_modules=[7, 8]),
+            station_row(12, 'Lost', 99, 1600000000),
+            station_row(11, 'Daedalus Old', 1, 1500000000),
+        ])
+        plug.importStations()
+        rows = tdb.query(
+            "SELECT station_id, pretty_name, system_id FROM Station ORDER BY station_id"
+        ).fetchall()
+        assert rows == [(10, 'Abraham Lincoln', 1), (11, 'Daedalus', 1)]
+        assert tdb.query(
+            "SELECT ship_id, station_id FROM ShipVendor"
+        ).fetchall() == [(1, 10)]
+        assert tdb.query(
+            "SELECT upgrade_id, station_id, cost FROM UpgradeVendor"
+        ).fetchall() == [(7, 11, 250)]
+    
+    @pytest.mark.parametrize("workers", ["1", "2"])
+    def test_import_listings(self, bulk, workers):
+        tdb, plug = bulk
+        plug.options['workers'] = workers
+        tdb.query("""
+            INSERT INTO Station (station_id, name, pretty_name, system_id)
+            VALUES (10, 'A', 'A', 1), (11, 'B', 'B', 1), (12, 'C', 'C', 2)
+        """)
+        tdb.query("""
+            INSERT INTO StationItem VALUES
+            (10, 5, 1, 1, 1, 1, 1, 1, '2020-09-13 12:26:40', 1),
+            (11, 5, 1, 1, 1, 1, 1, 1, '2020-09-13 12:26:40', 0)
+        """)
+        header = "id,station_id,commodity_id,supply,supply_bracket,buy_price,sell_price,demand,demand_bracket,collected_at\n"
+        listings = [
+            # Same age as the DB: only marked as not live.
+            (1, 10, 5, 0, '', 0, 900, 50, 2, 1600000000),
+            # Newer: replaced.
+            (2, 11, 6, 20, 3, 400, 0, 0, '', 1600000100),
+            # New station, with a rare (unknown) item.
+            (3, 12, 5, 0, '', 0, 950, 30, 1, 1600000200),
+            (4, 12, 99, 1, 1, 1, 1, 1, 1, 1600000200),
+            (5, 12, 6, 5, 1, 410, 0, 0, '', 1600000200),
+            # Unknown station.
+            (6, 13, 5, 0, '', 0, 950, 30, 1, 1600000200),
+        ]
+        (plug.dataPath / plug.listingsPath).write_text(
+            header + "".join(",".join(map(str, row)) + "\n" for row in listings)
+        )
+        plug.importListings(plug.listingsPath)
+        rows = tdb.query("""
+            SELECT station_id, item_id, demand_price, demand_level,
+                   supply_price, supply_level, modified, from_live
+              FROM StationItem ORDER BY station_id, item_id
+        """).fetchall()
+        assert rows == [
+            (10, 5, 1, 1, 1, 1, '2020-09-13 12:26:40', 0),
+            (11, 6, 0, -1, 400, 3, '2020-09-13 12:28:20', 0),
+            (12, 5, 950, 1, 0, -1, '2020-09-13 12:30:00', 0),
+            (12, 6, 0, -1, 410, 1, '2020-09-13 12:30:00', 0),
+        ]
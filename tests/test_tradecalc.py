@@ -0,0 +1,197 @@
+import random
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+from tradedangerous import TradeEnv
+from tradedangerous.pricematrix import PriceMatrix
+from tradedangerous.tradecalc import TradeCalc
+from tradedangerous.tradedb import Destination, Trade
+
+
+@pytest.fixture
+def calc():
+    # The fit functions don't use the loaded prices.
+    calc = TradeCalc.__new__(TradeCalc)
+    calc.tdenv = TradeEnv(quiet=1)
+    return calc
+
+
+def trade(costCr, gainCr, supply):
+    return Trade(None, costCr, gainCr, supply, 2, 100, 2, 0, 0)
+
+
+def check(items, load, credits, capacity, maxUnits):
+    assert load.units == sum(qty for _, qty in load.items) <= capacity
+    assert load.costCr == sum(item.costCr * qty for item, qty in load.items) <= credits
+    assert load.gainCr == sum(item.gainCr * qty for item, qty in load.items)
+    for item, qty in load.items:
+        assert item in items and 0 < qty <= min(maxUnits, item.supply)
+
+
+class TestFit(object):
+    def test_low_credits(self, calc):
+        # The best margin is too dear to fill the hold with.
+        items = [trade(1000, 500, 100), trade(100, 60, 100)]
+        simple = calc.simpleFit(items, 2000, 20, 20)
+        exact = calc.exactFit(items, 2000, 20, 20)
+        check(items, exact, 2000, 20, 20)
+        assert simple.gainCr == 1000
+        assert exact.gainCr == 1200
+    
+    def test_against_brute(self, calc):
+        rng = random.Random(42)
+        for _ in range(200):
+            items = sorted((
+                trade(rng.randint(10, 500), rng.randint(1, 200), rng.randint(1, 12))
+                for _ in range(rng.randint(1, 5))
+            ), key=lambda item: (-item.gainCr, item.costCr))
+            credits, capacity = rng.randint(0, 3000), rng.randint(0, 16)
+            maxUnits = rng.randint(1, capacity or 1)
+            exact = calc.exactFit(items, credits, capacity, maxUnits)
+            brute = calc.bruteForceFit(items, credits, capacity, maxUnits)
+            check(items, exact, credits, capacity, maxUnits)
+            assert exact.gainCr == brute.gainCr
+    
+    def test_budget(self, calc, monkeypatch):
+        rng = random.Random(7)
+        items = [
+            trade(rng.randint(1000, 5000), rng.randint(100, 900), 500)
+            for _ in range(30)
+        ]
+        simple = calc.simpleFit(items, 100000, 400, 400)
+        monkeypatch.setattr(TradeCalc, "exactFitNodes", 10)
+        load = calc.exactFit(items, 100000, 400, 400)
+        check(items, load, 100000, 400, 400)
+        assert load.gainCr >= simple.gainCr
+
+
+class TestFitCache(object):
+    @pytest.fixture
+    def cache(self, calc):
+        calc.fitCache = OrderedDict()
+        calc.fitCacheHits = calc.fitCacheMisses = 0
+        return calc
+    
+    def test_recall(self, cache):
+        items = [trade(1000, 500, 100), trade(100, 60, 100)]
+        load = cache.simpleFit(items, 2000, 20, 20)
+        cache.rememberFit((1, 2, 20, 20), load, load.costCr, 2000)
+        cache.rememberFit((1, 3, 20, 20), None, 0, 2000)
+        missing = object()
+        assert cache.recallFit((1, 2, 20, 20), 2000, missing) == load
+        assert cache.recallFit((1, 2, 20, 20), load.costCr, missing) == load
+        assert cache.recallFit((1, 2, 20, 20), load.costCr - 1, missing) is missing
+        assert cache.recallFit((1, 2, 20, 20), 2001, missing) is missing
+        assert cache.recallFit((1, 3, 20, 20), 10, missing) is None
+        assert cache.recallFit((1, 2, 10, 10), 2000, missing) is missing
+        # Callers score what they get back.
+        assert cache.recallFit((1, 2, 20, 20), 2000, missing) is not load
+        assert (cache.fitCacheHits, cache.fitCacheMisses) == (4, 3)
+    
+    def test_lru(self, cache, monkeypatch):
+        monkeypatch.setattr(TradeCalc, "fitCacheSize", 2)
+        missing = object()
+        cache.rememberFit(1, None, 0, 100)
+        cache.rememberFit(2, None, 0, 100)
+        assert cache.recallFit(1, 50, missing) is None
+        cache.rememberFit(3, None, 0, 100)
+        assert list(cache.fitCache) == [1, 3]
+        assert cache.recallFit(2, 50, missing) is missing
+    
+    def test_holdGain(self):
+        items = [trade(100, 60, 100), trade(1000, 500, 5), trade(10, 1, 100)]
+        assert TradeCalc.holdGain(items, 20, 20) == 5 * 500 + 15 * 60
+        assert TradeCalc.holdGain(items, 20, 3) == 3 * 500 + 3 * 60 + 3 * 1
+
+
+class TestBounds(object):
+    # station_id, item_id, timestamp,
+    # demand_price, demand_units, demand_level,
+    # supply_price, supply_units, supply_level
+    ROWS = [
+        (1, 10, 0, 0, 0, 0, 100, 50, 2),
+        (1, 11, 0, 0, 0, 0, 500, 50, 2),
+        (2, 10, 0, 180, 10, 2, 150, 50, 2),
+        (3, 10, 0, 130, 10, 2, 0, 0, 0),
+        (3, 11, 0, 450, 10, 2, 0, 0, 0),
+        (4, 11, 0, 0, 0, 0, 600, 50, 2),
+    ]
+    
+    # Which stations each can reach, both ways.
+    REACH = {1: [2, 3], 2: [1], 3: [1, 4], 4: [3]}
+    
+    class FakeTDB(object):
+        maxSystemLinkLy = 30
+        
+        def __init__(self, reach):
+            self.reach = reach
+            self.stationByID = {ID: SimpleNamespace(ID=ID) for ID in reach}
+            self.outboundTables = {}
+        
+        def getDestinations(self, origin, maxJumps=None, maxLyPer=None):
+            for ID in self.reach[origin.ID]:
+                yield Destination(None, self.stationByID[ID], None, 0)
+    
+    @staticmethod
+    def setPrices(calc, rows, kind):
+        matrix = PriceMatrix.fromRows(rows, 0)
+        if kind == "matrix":
+            calc.priceMatrix = matrix
+        else:
+            calc.priceMatrix = None
+            calc.stationsSelling = dict(matrix.stationsSelling)
+            calc.stationsBuying = dict(matrix.stationsBuying)
+        calc._bestGainPerTon = None
+    
+    @pytest.fixture(params=["lists", "matrix"])
+    def bounds(self, calc, request):
+        self.setPrices(calc, self.ROWS, request.param)
+        calc.tdb = self.FakeTDB(self.REACH)
+        calc.outboundTables, calc.pricesKey = {}, (1, 0, None)
+        return calc
+    
+    def test_bestGainPerTon(self, bounds):
+        # Nothing at 4 sells at a profit.
+        assert bounds.getBestGainPerTon() == {1: 80, 2: 30}
+    
+    def test_hopScoreBound(self, bounds):
+        bounds.tdenv = TradeEnv(quiet=1, capacity=10)
+        assert bounds.hopScoreBound(1) == 800
+        assert bounds.hopScoreBound(4) == 0
+        bounds.tdenv.maxGainPerTon = 50
+        assert bounds.hopScoreBound(1) == 500
+        bounds.tdenv.lsPenalty = 100
+        travelTime = TradeCalc.travelTime
+        assert bounds.hopScoreBound(1) == 500 * travelTime(300, 2) / travelTime(0, 0)
+    
+    def test_bestOutbound(self, bounds):
+        # 2's best buyer is itself, which doesn't count.
+        assert [bounds.bestOutbound(ID, 2) for ID in (1, 2, 3, 4)] == [
+            (80, 2), (0, None), (0, None), (0, None),
+        ]
+        bounds.tdenv = TradeEnv(quiet=1, capacity=10, maxJumpsPer=2)
+        assert bounds.hopScoreBound(1) == 800
+        assert bounds.hopScoreBound(2) == 0
+    
+    def test_pricesChanged(self, bounds):
+        kind = "matrix" if bounds.priceMatrix is not None else "lists"
+        table = bounds.outboundTable(2)
+        assert bounds.tdb.outboundTables == {(2, 30, 1, 0, None): table}
+        assert bounds.bestOutbound(1, 2) == (80, 2)
+        
+        # 3 buying for more beats 2.
+        rows = list(self.ROWS)
+        rows[3] = (3, 10, 0, 200, 10, 2, 0, 0, 0)
+        self.setPrices(bounds, rows, kind)
+        table.pricesChanged([3])
+        assert bounds.bestOutbound(1, 2) == (100, 3)
+        assert len(table) == 1
+        
+        # 3 buying for less again, so 1 has to be worked out again.
+        self.setPrices(bounds, self.ROWS, kind)
+        table.pricesChanged([3])
+        assert bounds.outboundTable(2) is table
+        assert len(table) == 0
+        assert bounds.bestOutbound(1, 2) == (80, 2)
@@ -0,0 +1,173 @@
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def tdb(empty_tdb):
+    tdb = empty_tdb("""
+        INSERT INTO Category (category_id, name) VALUES (1, 'Metals');
+        INSERT INTO Item (item_id, name, pretty_name, category_id) VALUES (5, 'GOLD', 'Gold', 1);
+        INSERT INTO System (system_id, name, pretty_name, pos_x, pos_y, pos_z, modified)
+            VALUES (1, 'SOL', 'Sol', 0, 0, 0, '2020-01-01 00:00:00'),
+                   (2, 'ALPHA CENTAURI', 'Alpha Centauri', 3, 0, 3, '2020-01-01 00:00:00'),
+                   (3, 'BARNARD''S STAR', 'Barnard''s Star', 0, 5, 0, '2020-01-01 00:00:00');
+        INSERT INTO Station (station_id, name, pretty_name, system_id, modified)
+            VALUES (1, 'ABRAHAM LINCOLN', 'Abraham Lincoln', 1, '2020-01-01 00:00:00'),
+                   (2, 'HUTTON ORBITAL', 'Hutton Orbital', 2, '2020-01-01 00:00:00');
+        INSERT INTO StationItem VALUES (1, 5, 100, 10, 1, 0, 0, 0, '2020-01-01 00:00:00', 0);
+    """)
+    tdb.close()
+    tdb.load()
+    return tdb
+
+
+def change(tdb, script):
+    # Through another connection, as a separate process would.
+    with sqlite3.connect(tdb.dbFilename) as conn:
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript(script)
+
+
+class TestRefresh(object):
+    def test_unchanged(self, tdb):
+        assert tdb.refresh() is False
+        assert tdb.refresh() is False
+    
+    def test_in_place(self, tdb):
+        tdb.refresh()
+        sol, lincoln, gold = tdb.systemByID[1], tdb.stationByID[1], tdb.itemByID[5]
+        alpha = tdb.systemByID[2]
+        assert [s for s, _ in tdb.genSystemsInRange(sol, 4.5)] == [alpha]
+        change(tdb, """
+            UPDATE System SET pos_y = 3, modified = '2021-01-01 00:00:00'
+             WHERE system_id = 3;
+            UPDATE Station SET ls_from_star = 50, modified = '2021-01-01 00:00:00'
+             WHERE station_id = 1;
+            DELETE FROM System WHERE system_id = 2;
+            INSERT INTO Station (station_id, name, pretty_name, system_id)
+                VALUES (3, 'NEW', 'New', 1);
+            INSERT INTO StationItem VALUES (3, 5, 90, 10, 1, 0, 0, 0, '2021-01-01 00:00:00', 0);
+            UPDATE Item SET pretty_name = 'Shiny' WHERE item_id = 5;
+        """)
+        assert tdb.refresh() is True
+        assert tdb.systemByID[1] is sol and tdb.stationByID[1] is lincoln
+        assert tdb.itemByID[5] is gold and gold.name() == 'Shiny'
+        assert lincoln.lsFromStar == 50
+        assert 2 not in tdb.systemByID and 2 not in tdb.stationByID
+        assert sorted(stn.ID for stn in sol.stations) == [1, 3]
+        assert tdb.stationByID[3].itemCount == 1
+        assert tdb.tradingStationCount == 2
+        # Barnard's Star moved into range, and Alpha Centauri is gone.
+        assert [s.ID for s, _ in tdb.genSystemsInRange(sol, 4.5)] == [3]
+        assert tdb.refresh() is False
+    
+    def test_stale_jump_graph(self, tdb):
+        tdb.refresh()
+        sol = tdb.systemByID[1]
+        tdb.buildJumpGraph([10])
+        built = tdb.jumpGraphPath.stat().st_mtime_ns
+        assert [s.ID for s, _ in tdb.genSystemsInRange(sol, 4.5)] == [2]
+        change(tdb, """
+            UPDATE System SET pos_y = 3, modified = '2021-01-01 00:00:00'
+             WHERE system_id = 3;
+        """)
+        assert tdb.refresh() is True
+        # Ignored rather than rebuilt: the stellar grid answers instead.
+        assert [s.ID for s, _ in tdb.genSystemsInRange(sol, 4.5)] == [3, 2]
+        assert tdb.jumpGraph is None
+        assert tdb.jumpGraphPath.stat().st_mtime_ns == built
+    
+    def test_own_changes(self, tdb):
+        tdb.refresh()
+        tdb.getDB().execute("DELETE FROM StationItem")
+        tdb.getDB().commit()
+        assert tdb.refresh() is True
+        assert tdb.stationByID[1].itemCount == 0
+        assert tdb.tradingStationCount == 0
+    
+    def test_reload_before_tracking(self, tdb):
+        sol = tdb.systemByID[1]
+        change(tdb, "UPDATE System SET pretty_name = 'Sun' WHERE system_id = 1;")
+        assert tdb.refresh() is True
+        assert tdb.systemByID[1] is not sol
+        assert tdb.systemByID[1].name() == 'Sun'
+    
+    def test_wal(self, tdb):
+        tdb.close()
+        tdb.tdenv.walMode = True
+        tdb.refresh()
+        assert tdb.getDB().execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        with tdb.readDB() as db:
+            db.execute("BEGIN")
+            db.execute("SELECT COUNT(*) FROM StationItem").fetchone()
+            # A writer doesn't wait for an open read transaction.
+            with sqlite3.connect(tdb.dbFilename, timeout=0) as conn:
+                conn.execute(
+                    "UPDATE System SET pretty_name = 'Sun', modified = '2021-01-01 00:00:00'"
+                    " WHERE system_id = 1"
+                )
+            assert db.execute("SELECT pretty_name FROM System WHERE system_id = 1").fetchone() == ('Sol',)
+        assert tdb.refresh() is True
+        assert tdb.systemByID[1].name() == 'Sun'
+
+
+class TestReadDB(object):
+    def test_read_only(self, tdb):
+        with tdb.readDB() as db:
+            assert db.execute("SELECT COUNT(*) FROM Station").fetchone() == (2,)
+            with pytest.raises(sqlite3.OperationalError):
+                db.execute("DELETE FROM Station")
+        with tdb.readDB() as again:
+            assert again is db
+            with tdb.readDB() as other:
+                assert other is not db
+        assert len(tdb.readPool) == 2
+        tdb.close()
+        assert tdb.readPool == []
+
+
+class TestLazyLoad(object):
+    def test_on_first_use(self, tdb):
+        tdb.lazyLoad = True
+        tdb.load()
+        assert 'stationByID' not in tdb.__dict__
+        lincoln = tdb.lookupStation("Abraham Lincoln")
+        assert lincoln in lincoln.system.stations
+        assert 'tradingStationCount' not in tdb.__dict__
+        assert lincoln.itemCount == 1
+        assert tdb.stationByID[2].itemCount == 0
+        assert 'tradingStationCount' not in tdb.__dict__
+        assert tdb.tradingStationCount == 1
+        assert tdb.lookupItem("Gold") in tdb.categoryByID[1].items
+    
+    def test_batched(self, tdb, monkeypatch):
+        tdb.lazyLoad = True
+        tdb.load()
+        batches = []
+        real = tdb._loadStationTrading
+        def loadStationTrading(stationIDs=None):
+            batches.append(sorted(stationIDs))
+            real(stationIDs)
+        monkeypatch.setattr(tdb, "_loadStationTrading", loadStationTrading)
+        stations = list(tdb.stationByID.values())
+        for station in stations:
+            station._loadTrading = loadStationTrading
+        tdb.loadTrading(stations)
+        assert batches == [[1, 2]]
+        assert [stn.itemCount for stn in stations] == [1, 0]
+        tdb.loadTrading(stations)
+        assert batches == [[1, 2]]
+    
+    def test_refresh(self, tdb):
+        tdb.lazyLoad = True
+        tdb.load()
+        change(tdb, """
+            INSERT INTO StationItem VALUES (2, 5, 90, 10, 1, 0, 0, 0, '2021-01-01 00:00:00', 0);
+        """)
+        tdb.refresh()
+        assert tdb.tradingStationCount == 2
+        change(tdb, "DELETE FROM StationItem WHERE station_id = 1;")
+        assert tdb.refresh() is True
+        assert tdb.stationByID[1].itemCount == 0
+        assert tdb.tradingStationCount == 1
@@ -0,0 +1,84 @@
+import numpy
+
+from tradedangerous.pricematrix import PriceMatrix
+from tradedangerous.pricesnapshot import PriceSnapshot
+from tradedangerous.tradeindex import TradeIndex
+
+NOW = 1000000
+
+
+def make_matrix(stations=30, items=8):
+    rng = numpy.random.default_rng(7)
+    rows = []
+    for stnID in range(1, stations + 1):
+        for itemID in range(100, 100 + items):
+            roll = rng.integers(0, 3)
+            if roll == 1:
+                rows.append((stnID, itemID, NOW, 0, 0, 0,
+                        int(rng.integers(50, 500)), 100, 2))
+            elif roll == 2:
+                rows.append((stnID, itemID, NOW,
+                        int(rng.integers(50, 500)), 100, 2, 0, 0, 0))
+    return PriceMatrix.fromRows(rows, NOW), rows
+
+
+def brute_force(rows, srcID, dstIDs):
+    selling = {row[1]: row[6] for row in rows if row[0] == srcID and row[6]}
+    best = []
+    for order, dstID in enumerate(dstIDs):
+        trades = [
+            (row[3] - selling[row[1]], -selling[row[1]], row[1])
+            for row in rows
+            if row[0] == dstID and row[3] and row[1] in selling
+            and row[3] > selling[row[1]]
+        ]
+        if trades:
+            gain, cost, item = max(trades)
+            best.append((-gain, order, dstID, item, gain, -cost))
+    best.sort()
+    return [entry[2:] for entry in best]
+
+
+class TestTradeIndex(object):
+    def test_find_pairs(self):
+        matrix, rows = make_matrix()
+        dstIDs = list(range(1, 31))
+        distances = [float(n) / 2 for n in dstIDs]
+        for srcID in (1, 5, 17, 30):
+            others = [dstID for dstID in dstIDs if dstID != srcID]
+            dists = [distances[dstID - 1] for dstID in others]
+            pairs = TradeIndex.findPairs(matrix, srcID, others, dists, 4)
+            expected = brute_force(rows, srcID, others)[:4]
+            assert [
+                (int(p['dst']), int(p['item']), int(p['gain']), int(p['cost']))
+                for p in pairs
+            ] == expected
+            assert list(pairs['dist']) == [
+                distances[dstID - 1] for dstID, *_ in expected
+            ]
+    
+    def test_round_trip(self, tmp_path):
+        matrix, _ = make_matrix()
+        dstIDs = list(range(1, 31))
+        stationPairs = [
+            (srcID, TradeIndex.findPairs(
+                matrix, srcID, dstIDs, [1.0] * len(dstIDs), 3
+            ))
+            for srcID in dstIDs
+        ]
+        path = tmp_path / "test.trades"
+        state = PriceSnapshot.dbState(str(tmp_path / "missing.db"))
+        index = TradeIndex.write(path, state, 25, 3, stationPairs)
+        
+        reread = TradeIndex(path)
+        assert reread.matches(state)
+        assert not reread.matches(None)
+        assert (reread.radiusLy, reread.topK) == (25, 3)
+        assert len(reread) == sum(1 for _, pairs in stationPairs if len(pairs))
+        for srcID, pairs in stationPairs:
+            assert reread.pairsFrom(srcID).tolist() == pairs.tolist()
+            assert reread.bestGain(srcID) == (
+                int(pairs['gain'][0]) if len(pairs) else 0
+            )
+        assert reread.bestGain(999) == 0
+        assert len(reread.sources()) == len(index.pairs)
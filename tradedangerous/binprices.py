@@ -0,0 +1,180 @@
+# --------------------------------------------------------------------
+# Copyright (C) Oliver 'kfsone' Smith 2014 <oliver@kfs.org>:
+# Copyright (C) Bernd 'Gazelle' Gollesch 2016, 2017
+# Copyright (C) Jonathan 'eyeonus' Jones 2018, 2019
+#
+# You are free to use, redistribute, or even print and eat a copy of
+# this software so long as you include this copyright notice.
+# I guarantee there is at least one bug neither of us knew about.
+# --------------------------------------------------------------------
+# TradeDangerous :: Modules :: Binary prices
+
+"""
+BinaryPrices is the binary export of the StationItem table that lives
+beside the .prices file (TradeDangerous.prices.bin). After an import
+it is written in place of the text .prices file, and buildCache loads
+prices from it when it is newer than the .prices file.
+
+It holds one fixed-width record per (station, item), sorted by
+station then item, with the "modified" times as unix timestamps, and
+an index of where each station's records start.
+
+File layout (all little-endian, each array 8-byte aligned):
+    magic               b'TDPRBIN\\0'
+    headerLen           uint32, length of the JSON header
+    header              {"version", "rows", "stations"}
+    stationIDs          int64[stations], ascending
+    firstRows           int64[stations + 1], stationIDs[n]'s records
+                        are records[firstRows[n]:firstRows[n + 1]]
+    records             recordType[rows]
+"""
+
+######################################################################
+# Imports
+
+import json
+import os
+import struct
+
+import numpy
+
+######################################################################
+# Classes
+
+
+class BinaryPrices(object):
+    """
+    Memory-mapped binary export of StationItem.
+    
+    Attributes:
+        path
+            Path of the file,
+        stationIDs
+            Array of the station IDs with prices, ascending,
+        firstRows
+            Array of the first record of each station, and the end,
+        records
+            Array of recordType, sorted by station and item.
+    """
+    
+    magic = b'TDPRBIN\0'
+    version = 1
+    
+    # Suffix added to the name of the .prices file
+    suffix = '.bin'
+    
+    # Fields in the order of StationItem's columns.
+    recordType = numpy.dtype([
+        ('station_id', '<u4'),
+        ('item_id', '<u4'),
+        ('demand_price', '<i4'),
+        ('demand_units', '<i4'),
+        ('demand_level', '<i1'),
+        ('supply_price', '<i4'),
+        ('supply_units', '<i4'),
+        ('supply_level', '<i1'),
+        ('modified', '<i8'),
+        ('from_live', '<u1'),
+    ])
+    
+    # Number of rows to pull from the cursor at a time when writing.
+    fetchSize = 65536
+    
+    def __init__(self, path):
+        self.path = path
+        with open(str(path), 'rb') as fh:
+            magic = fh.read(len(self.magic))
+            if magic != self.magic:
+                raise ValueError("{}: not a binary prices file".format(path))
+            headerLen, = struct.unpack('<I', fh.read(4))
+            header = json.loads(fh.read(headerLen).decode())
+        if header.get('version') != self.version:
+            raise ValueError("{}: unsupported version".format(path))
+        
+        numRows, numStations = header['rows'], header['stations']
+        offset = _align(len(self.magic) + 4 + headerLen)
+        self.stationIDs = self._map(path, '<i8', offset, numStations)
+        offset = _align(offset + numStations * 8)
+        self.firstRows = self._map(path, '<i8', offset, numStations + 1)
+        offset = _align(offset + (numStations + 1) * 8)
+        self.records = self._map(path, self.recordType, offset, numRows)
+    
+    @staticmethod
+    def _map(path, dtype, offset, count):
+        if not count:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(
+            str(path), dtype=dtype, mode='r', offset=offset, shape=(count,),
+        )
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def station(self, stationID):
+        """ Returns the records for the station, by item. """
+        n = numpy.searchsorted(self.stationIDs, stationID)
+        if n == len(self.stationIDs) or self.stationIDs[n] != stationID:
+            return self.records[0:0]
+        return self.records[self.firstRows[n]:self.firstRows[n + 1]]
+    
+    @classmethod
+    def write(cls, path, rows):
+        """
+        Writes rows, a cursor over the StationItem columns in order
+        with unix timestamps for modified, sorted by station_id and
+        item_id, to path.
+        
+        Raises ValueError if a timestamp is missing.
+        """
+        chunks = []
+        while True:
+            block = rows.fetchmany(cls.fetchSize)
+            if not block:
+                break
+            try:
+                chunks.append(numpy.array(block, dtype=cls.recordType))
+            except TypeError:
+                raise ValueError("missing timestamp")
+        if chunks:
+            records = numpy.concatenate(chunks)
+        else:
+            records = numpy.zeros(0, dtype=cls.recordType)
+        
+        stationIDs, firstRows = numpy.unique(records['station_id'], return_index=True)
+        firstRows = numpy.append(firstRows, len(records))
+        
+        header = json.dumps({
+            'version': cls.version,
+            'rows': len(records),
+            'stations': len(stationIDs),
+        }).encode()
+        
+        # Write to a temporary file so readers never see a partial file.
+        tmpPath = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with open(tmpPath, 'wb') as fh:
+                fh.write(cls.magic)
+                fh.write(struct.pack('<I', len(header)))
+                fh.write(header)
+                for array in (
+                        stationIDs.astype('<i8'),
+                        firstRows.astype('<i8'),
+                        records,
+                        ):
+                    fh.write(b'\0' * (_align(fh.tell()) - fh.tell()))
+                    fh.write(array.tobytes())
+            os.replace(tmpPath, str(path))
+        except OSError:
+            if os.path.exists(tmpPath):
+                os.unlink(tmpPath)
+            raise
+        
+        return cls(path)
+
+
+######################################################################
+# Helpers
+
+
+def _align(offset):
+    return (offset + 7) & ~7
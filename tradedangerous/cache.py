@@ -21,18 +21,42 @@
 #  we can tell how old data for a specific system is.
 
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from operator import itemgetter
 from pathlib import Path
 from tradedangerous.tradeexcept import TradeException
 from tradedangerous.utils import normalizedStr
 from tradedangerous.prices import dumpPrices, Element
+from tradedangerous.binprices import BinaryPrices
 
 import csv
+import gzip
+import hashlib
+import io
+import json
 import math
+import numpy
 import os
 import re
 import sqlite3
 import sys
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Stations whose prices are written per batch when importing .prices,
+# at most 999 so that a batch's station IDs fit in one query.
+pricesBatchStations = 500
+
+# Import files totalling this many bytes are read by worker processes.
+parallelImportBytes = 1 << 20
+
+# Rows inserted per executemany when importing.
+importBatchSize = 10000
+
 ######################################################################
 # Regular expression patterns. Here be draegons.
 # If you add new patterns:
@@ -95,6 +119,10 @@ $
 """.format(base_f = itemPriceFrag, qtylvl_f = qtyLevelFrag, time_f = timeFrag),
             re.IGNORECASE + re.VERBOSE)
 
+# Fast path pieces for the common form of price line, see splitItemLine
+qtyLevelRe = re.compile(qtyLevelFrag, re.IGNORECASE + re.VERBOSE)
+fastTimeRe = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+
 ######################################################################
 # Exception classes
 
@@ -313,10 +341,33 @@ def getItemByNameIndex(cur):
     return { name: itemID for (itemID, name) in cur }
 
 
+def splitItemLine(text):
+    """
+        Fast path for the usual "<item> <sell> <buy> <demand> <supply>
+        <date> <time>" price line: returns (item, sell, buy, demand,
+        supply, time), or None to leave the line to newItemPriceRe.
+    """
+    tokens = text.split()
+    if len(tokens) < 7:
+        return None
+    sell, buy, demand, supply, date, time = tokens[-6:]
+    if not (sell.isdecimal() and buy.isdecimal()):
+        return None
+    time = date + ' ' + time
+    if not fastTimeRe.fullmatch(time):
+        return None
+    if not (qtyLevelRe.fullmatch(demand) and qtyLevelRe.fullmatch(supply)):
+        return None
+    return ' '.join(tokens[:-6]), sell, buy, demand, supply, time
+
+
 def processPrices(tdenv, priceFile, db, defaultZero):
     """
-        Yields SQL for populating the database with prices
-        by reading the file handle for price lines.
+        Reads price lines from the file handle and writes them to the
+        database, pricesBatchStations stations at a time.
+        
+        Returns (stations, systems, newItems, updtItems, ignItems,
+        removedItems, updatedItems) counts.
     """
     
     DEBUG0, DEBUG1 = tdenv.DEBUG0, tdenv.DEBUG1
@@ -332,6 +383,9 @@ def processPrices(tdenv, priceFile, db, defaultZero):
     
     itemByName = getItemByNameIndex(cur)
     
+    # Without any existing prices there are no dates to look up.
+    hasPrices = db.execute("SELECT 1 FROM StationItem LIMIT 1").fetchone()
+    
     defaultUnits = -1 if not defaultZero else 0
     defaultLevel = -1 if not defaultZero else 0
     
@@ -339,9 +393,10 @@ def processPrices(tdenv, priceFile, db, defaultZero):
     facility = None
     processedStations = {}
     processedSystems = set()
-    processedItems = {}
-    stationItemDates = {}
-    items, zeros, buys, sells = [], [], [], []
+    clearedStations = set()
+    # (stationID, facility, [item line fields]) for the current batch,
+    # item lines are processed when the batch is written.
+    blocks, lines = [], None
     
     lineNo, localAdd = 0, 0
     if not ignoreUnknown:
@@ -353,14 +408,9 @@ def processPrices(tdenv, priceFile, db, defaultZero):
         ignoreOrWarn = tdenv.WARN
     
     def changeStation(matches):
-        nonlocal facility, stationID
-        nonlocal processedStations, processedItems, localAdd
-        nonlocal stationItemDates
+        nonlocal facility, stationID, lines, localAdd
         
         # ## Change current station
-        stationItemDates = {}
-        processedItems = {} # Items that were processed within one station
-
         systemNameIn, stationNameIn = matches.group(1, 2)
         systemNameIn, stationNameIn = systemNameIn.strip(), stationNameIn.strip()
         systemName, stationName = normalizedStr(systemNameIn), normalizedStr(stationNameIn)
@@ -402,35 +452,49 @@ def processPrices(tdenv, priceFile, db, defaultZero):
             )
             localAdd += 1
         
+        if len(blocks) >= pricesBatchStations:
+            writeBatch()
+        
         stationID = newID
         processedSystems.add(systemName)
         processedStations[stationID] = lineNo
-        
-        cur = db.execute("""
-            SELECT item_id, modified
-              FROM StationItem
-             WHERE station_id = ?
-        """, [stationID])
-        stationItemDates = {ID: modified for ID, modified in cur}
+        lines = []
+        blocks.append((stationID, facility, lines))
     
-    addItem, addZero = items.append, zeros.append
     getItemID = itemByName.get
     newItems, updtItems, ignItems = 0, 0, 0
+    removedItems, updatedItems = 0, 0
+    
+    def loadItemDates(stationIDs):
+        """ Returns {stationID: {itemID: modified}} for the stations. """
+        stationItemDates = {}
+        if not hasPrices:
+            return stationItemDates
+        cur.execute("""
+            SELECT station_id, item_id, modified
+              FROM StationItem
+             WHERE station_id IN ({})
+        """.format(','.join('?' * len(stationIDs))), stationIDs)
+        for stnID, itemID, modified in cur:
+            try:
+                stationItemDates[stnID][itemID] = modified
+            except KeyError:
+                stationItemDates[stnID] = {itemID: modified}
+        return stationItemDates
     
-    def processItemLine(matches, db):
+    def processItemLine(stationID, facility, stationItemDates, processedItems,
+                        lineNo, fields, addItem, addZero):
         nonlocal newItems, updtItems, ignItems
-        prettyName, modified = matches.group('item', 'time')
+        prettyName, demandCr, supplyCr, demandString, supplyString, modified = fields
         itemName = normalizedStr(prettyName)
         
         # Look up the item ID.
         itemID = getItemID(itemName, -1)
         if itemID < 0:
-            cur = db.cursor()
             cur.execute(
                 "INSERT INTO Item (name, pretty_name, category_id) VALUES(?, ?, ?)",
                 [itemName, prettyName, 15] # 15 is category "Unknown"
                 )
-            db.commit()
             itemID = cur.lastrowid
             itemByName[itemName]=itemID
             
@@ -456,9 +520,7 @@ def processPrices(tdenv, priceFile, db, defaultZero):
             ))
             return
         
-        demandCr, supplyCr = matches.group('sell', 'buy')
         demandCr, supplyCr = int(demandCr), int(supplyCr)
-        demandString, supplyString = matches.group('demand', 'supply')
         
         if demandCr == 0 and supplyCr == 0:
             if lastModified:
@@ -503,6 +565,57 @@ def processPrices(tdenv, priceFile, db, defaultZero):
         
         processedItems[itemID] = lineNo
     
+    def writeBatch():
+        nonlocal removedItems, updatedItems
+        
+        # One lookup of the existing dates for the whole batch.
+        itemDates = loadItemDates(list({stnID for stnID, _, _ in blocks}))
+        items, zeros = [], []
+        addItem, addZero = items.append, zeros.append
+        for stnID, stnFacility, stnLines in blocks:
+            stationItemDates = itemDates.get(stnID, {})
+            processedItems = {} # Items that were processed within one station
+            for itemLineNo, fields in stnLines:
+                processItemLine(
+                    stnID, stnFacility, stationItemDates, processedItems,
+                    itemLineNo, fields, addItem, addZero,
+                )
+        
+        if not merging:
+            # A station listed again later must keep its earlier items.
+            stations = [
+                (stnID,) for stnID, _, _ in blocks
+                if stnID not in clearedStations
+            ]
+            clearedStations.update(stnID for stnID, _, _ in blocks)
+            db.executemany("""
+                DELETE FROM StationItem
+                 WHERE station_id = ?
+            """, stations)
+        if zeros:
+            db.executemany("""
+                DELETE FROM StationItem
+                 WHERE station_id = ?
+                   AND item_id = ?
+            """, zeros)
+        removedItems += len(zeros)
+        
+        if items:
+            db.executemany("""
+                INSERT OR REPLACE INTO StationItem (
+                    station_id, item_id, modified,
+                    demand_price, demand_units, demand_level,
+                    supply_price, supply_units, supply_level
+                ) VALUES (
+                    ?, ?, IFNULL(?, CURRENT_TIMESTAMP),
+                    ?, ?, ?,
+                    ?, ?, ?
+                )
+            """, items)
+        updatedItems += len(items)
+        
+        blocks.clear()
+    
     for line in priceFile:
         lineNo += 1
         text, _, comment = line.partition('#')
@@ -510,14 +623,11 @@ def processPrices(tdenv, priceFile, db, defaultZero):
         if not text:
             continue
         
-        # replace whitespace with single spaces
-        if text.find("  "):
-            # http://stackoverflow.com/questions/2077897
-            text = ' '.join(text.split())
-        
         ########################################
         # ## "@ STAR/Station" lines.
         if text.startswith('@'):
+            # replace whitespace with single spaces
+            text = ' '.join(text.split())
             matches = systemStationRe.match(text)
             if not matches:
                 raise SyntaxError("Unrecognized '@' line: {}".format(text))
@@ -535,11 +645,19 @@ def processPrices(tdenv, priceFile, db, defaultZero):
         
         ########################################
         # ## "Item sell buy ..." lines.
-        matches = newItemPriceRe.match(text)
-        if not matches:
-            raise SyntaxError(priceFile, lineNo,"Unrecognized line/syntax", text)
+        fields = splitItemLine(text)
+        if not fields:
+            # http://stackoverflow.com/questions/2077897
+            text = ' '.join(text.split())
+            matches = newItemPriceRe.match(text)
+            if not matches:
+                raise SyntaxError(priceFile, lineNo,"Unrecognized line/syntax", text)
+            fields = matches.group('item', 'sell', 'buy', 'demand', 'supply', 'time')
         
-        processItemLine(matches, db)
+        lines.append((lineNo, fields))
+    
+    if blocks:
+        writeBatch()
     
     numSys = len(processedSystems)
     
@@ -551,46 +669,43 @@ def processPrices(tdenv, priceFile, db, defaultZero):
             "if you /need/ to persist them."
         )
     
-    stations = tuple((ID,) for ID in processedStations.keys())
-    return stations, items, zeros, newItems, updtItems, ignItems, numSys
+    return (
+        len(processedStations), numSys,
+        newItems, updtItems, ignItems, removedItems, updatedItems,
+    )
 
 ######################################################################
 
 
+def openPricesFile(pricesPath):
+    """
+        Opens a .prices file for reading, decompressing it as it is
+        read if it is a .gz or .zst file.
+    """
+    suffix = pricesPath.suffix.lower()
+    if suffix == '.gz':
+        return gzip.open(str(pricesPath), 'rt', encoding = 'utf-8')
+    if suffix in ('.zst', '.zstd'):
+        if not zstandard:
+            raise TradeException(
+                "{}: reading .zst files needs the 'zstandard' package: "
+                "'pip install zstandard'".format(pricesPath)
+            )
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            pricesPath.open('rb'), closefd = True
+        )
+        return io.TextIOWrapper(reader, encoding = 'utf-8')
+    return pricesPath.open('r', encoding = 'utf-8')
+
+
 def processPricesFile(tdenv, db, pricesPath, pricesFh = None, defaultZero = False):
     tdenv.DEBUG0("Processing Prices file '{}'", pricesPath)
     
-    with pricesFh or pricesPath.open('r', encoding = 'utf-8') as pricesFh:
-        stations, items, zeros, newItems, updtItems, ignItems, numSys = processPrices(
-            tdenv, pricesFh, db, defaultZero
-        )
-    
-    if not tdenv.mergeImport:
-        db.executemany("""
-            DELETE FROM StationItem
-             WHERE station_id = ?
-        """, stations)
-    if zeros:
-        db.executemany("""
-            DELETE FROM StationItem
-             WHERE station_id = ?
-               AND item_id = ?
-        """, zeros)
-    removedItems = len(zeros)
-    
-    if items:
-        db.executemany("""
-            INSERT OR REPLACE INTO StationItem (
-                station_id, item_id, modified,
-                demand_price, demand_units, demand_level,
-                supply_price, supply_units, supply_level
-            ) VALUES (
-                ?, ?, IFNULL(?, CURRENT_TIMESTAMP),
-                ?, ?, ?,
-                ?, ?, ?
-            )
-        """, items)
-    updatedItems = len(items)
+    with pricesFh or openPricesFile(pricesPath) as pricesFh:
+        (
+            stations, numSys,
+            newItems, updtItems, ignItems, removedItems, updatedItems,
+        ) = processPrices(tdenv, pricesFh, db, defaultZero)
     
     tdenv.DEBUG0("Marking populated stations as having a market")
     db.execute(
@@ -615,7 +730,7 @@ def processPricesFile(tdenv, db, pricesPath, pricesFh = None, defaultZero = Fals
             "over {:n} stations "
             "in {:n} systems",
                 changes,
-                len(stations),
+                stations,
                 numSys,
     )
     
@@ -624,161 +739,417 @@ def processPricesFile(tdenv, db, pricesPath, pricesFh = None, defaultZero = Fals
 
 ######################################################################
 
-def processImportFile(tdenv, db, importPath, tableName):
-    tdenv.DEBUG0(
-        "Processing import file '{}' for table '{}'",
-        str(importPath), tableName
+
+def processBinaryPricesFile(tdenv, db, pricesPath):
+    tdenv.DEBUG0("Processing binary prices file '{}'", pricesPath)
+    
+    try:
+        prices = BinaryPrices(pricesPath)
+    except ValueError as e:
+        raise TradeException(str(e))
+    
+    # Prices of stations or items that have since been removed.
+    stationIDs = [ID for (ID,) in db.execute("SELECT station_id FROM Station")]
+    itemIDs = [ID for (ID,) in db.execute("SELECT item_id FROM Item")]
+    records = prices.records
+    known = numpy.isin(records['station_id'], stationIDs)
+    known &= numpy.isin(records['item_id'], itemIDs)
+    if not known.all():
+        tdenv.WARN(
+            "{}: ignoring {:n} prices for unknown stations or items",
+            pricesPath, len(known) - numpy.count_nonzero(known),
+        )
+        records = records[known]
+    
+    # As with .prices files: the listed stations' items are replaced,
+    # or when merging, only updated by newer prices.
+    merging = tdenv.mergeImport
+    if not merging:
+        db.executemany(
+            "DELETE FROM StationItem WHERE station_id = ?",
+            ((ID,) for ID in numpy.unique(records['station_id']).tolist())
+        )
+    insertSql = """
+        INSERT INTO StationItem (
+            station_id, item_id,
+            demand_price, demand_units, demand_level,
+            supply_price, supply_units, supply_level,
+            modified, from_live
+        ) VALUES (
+            ?, ?, ?, ?, ?, ?, ?, ?,
+            DATETIME(?, 'unixepoch'), ?
+        )
+        ON CONFLICT (station_id, item_id) DO UPDATE
+           SET  demand_price = excluded.demand_price,
+                demand_units = excluded.demand_units,
+                demand_level = excluded.demand_level,
+                supply_price = excluded.supply_price,
+                supply_units = excluded.supply_units,
+                supply_level = excluded.supply_level,
+                modified = excluded.modified,
+                from_live = excluded.from_live
+         {}
+    """.format(
+        "WHERE excluded.modified > StationItem.modified" if merging else ""
     )
+    changesBefore = db.total_changes
+    for start in range(0, len(records), importBatchSize):
+        db.executemany(insertSql, records[start:start + importBatchSize].tolist())
+    ignItems = len(records) - (db.total_changes - changesBefore)
     
-    fkeySelectStr = ("("
-            "SELECT {newValue}"
-            " FROM {table}"
-            " WHERE {stmt}"
-            ")"
+    tdenv.DEBUG0("Marking populated stations as having a market")
+    db.execute(
+        "UPDATE Station SET market = 'Y'"
+        " WHERE EXISTS"
+            " (SELECT station_id FROM StationItem"
+              " WHERE StationItem.station_id = Station.station_id"
+             ")"
     )
-    uniquePfx = "unq:"
-    uniqueLen = len(uniquePfx)
-    ignorePfx = "!"
     
-    with importPath.open('r', encoding = 'utf-8') as importFile:
+    db.commit()
+    
+    tdenv.NOTE(
+        "Import complete: "
+            "{:n} items "
+            "over {:n} stations",
+                len(records) - ignItems,
+                len(numpy.unique(records['station_id'])),
+    )
+    if ignItems:
+        tdenv.NOTE("Ignored {} items with old data", ignItems)
+
+######################################################################
+
+def readImportFile(importPath):
+    """
+    Reads a CSV import file, returning (columnDefs, rows) where rows
+    is a list of (lineNo, values) for each non-blank line.
+    
+    Raises StopIteration if the file is empty. Doesn't touch the
+    database, so it can run in a worker process.
+    """
+    with Path(importPath).open('r', encoding = 'utf-8') as importFile:
         csvin = csv.reader(
             importFile, delimiter = ',', quotechar = "'", doublequote = True
         )
         # first line must be the column names
         columnDefs = next(csvin)
-        columnCount = len(columnDefs)
+        rows = [(csvin.line_num, linein) for linein in csvin if linein]
+    return columnDefs, rows
+
+
+# A foreign key column, resolved by looking the values of the CSV
+# columns at keyIndexes up in the (keyColumns...) -> valueColumn map
+# of the joined tables.
+ForeignKey = namedtuple('ForeignKey', (
+    'keyIndexes', 'keyColumns', 'valueColumn', 'tables',
+))
+
+
+def parseImportColumns(columnDefs):
+    """
+    Works out how to import rows with the given CSV column names,
+    returning (bindColumns, sources, uniqueIndexes) where sources has,
+    for each of the bindColumns, either the index of the CSV value to
+    insert or the ForeignKey that resolves it.
+    
+    Column names are "[unq:][!]name[@Table.column]": unq: columns form
+    the unique key of the file, "name@Table.column" inserts the
+    Table.column of the row whose Table.name is the value, and
+    "!name@Table.column" only narrows down the next foreign key by
+    joining Table on column.
+    """
+    uniquePfx = "unq:"
+    uniqueLen = len(uniquePfx)
+    ignorePfx = "!"
+    
+    bindColumns = []
+    sources = []
+    joinHelper = []
+    uniqueIndexes = []
+    for (cIndex, cName) in enumerate(columnDefs):
+        colName, _, srcKey = cName.partition('@')
+        # is this a unique index?
+        if colName.startswith(uniquePfx):
+            uniqueIndexes.append(cIndex)
+            colName = colName[uniqueLen:]
+        if not srcKey:
+            # no foreign key, straight insert
+            bindColumns.append(colName)
+            sources.append(cIndex)
+            continue
         
-        # split up columns and values
-        # this is necessqary because the insert might use a foreign key
-        bindColumns = []
-        bindValues = []
-        joinHelper = []
-        uniqueIndexes = []
-        for (cIndex, cName) in enumerate(columnDefs):
-            colName, _, srcKey = cName.partition('@')
-            # is this a unique index?
-            if colName.startswith(uniquePfx):
-                uniqueIndexes.append(cIndex)
-                colName = colName[uniqueLen:]
-            if not srcKey:
-                # no foreign key, straight insert
-                bindColumns.append(colName)
-                bindValues.append('?')
-                continue
-            
-            queryTab, _, queryCol = srcKey.partition('.')
-            if colName.startswith(ignorePfx):
-                # this column is only used to resolve an FK
-                assert srcKey
-                colName = colName[len(ignorePfx):]
-                joinHelper.append((colName, queryTab, queryCol))
-                continue
-            
-            # foreign key, we need to make a select
-            joinTable = [ queryTab ]
-            joinStmt = []
-            for nextCol, nextTab, nextJoin in joinHelper:
-                joinTable.append(
-                    "INNER JOIN {} USING({})".format(nextTab, nextJoin)
-                )
-                joinStmt.append(
-                    "{}.{} = ?".format(nextTab, nextCol)
-                )
-            joinHelper = []
-            joinStmt.append("{}.{} = ?".format(queryTab, colName))
-            bindColumns.append(queryCol)
-            bindValues.append(
-                fkeySelectStr.format(
-                    newValue = srcKey,
-                    table = " ".join(joinTable),
-                    stmt = " AND ".join(joinStmt),
-                )
+        queryTab, _, queryCol = srcKey.partition('.')
+        if colName.startswith(ignorePfx):
+            # this column is only used to resolve an FK
+            colName = colName[len(ignorePfx):]
+            joinHelper.append((cIndex, colName, queryTab, queryCol))
+            continue
+        
+        # foreign key, we need to look it up
+        tables = [ queryTab ]
+        keyIndexes, keyColumns = [], []
+        for nextIndex, nextCol, nextTab, nextJoin in joinHelper:
+            tables.append(
+                "INNER JOIN {} USING({})".format(nextTab, nextJoin)
             )
-        # now we can make the sql statement
-        sql_stmt = """
-            INSERT OR REPLACE INTO {table} ({columns}) VALUES({values})
-        """.format(
-                table = tableName,
-                columns = ','.join(bindColumns),
-                values = ','.join(bindValues)
+            keyIndexes.append(nextIndex)
+            keyColumns.append((nextTab, nextCol))
+        joinHelper = []
+        keyIndexes.append(cIndex)
+        keyColumns.append((queryTab, colName))
+        bindColumns.append(queryCol)
+        sources.append(ForeignKey(
+            tuple(keyIndexes), tuple(keyColumns), srcKey, " ".join(tables),
+        ))
+    
+    return bindColumns, sources, uniqueIndexes
+
+
+# SQLite's NOCASE collation only folds ASCII letters.
+_asciiUpper = str.maketrans(
+    'abcdefghijklmnopqrstuvwxyz', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+)
+
+
+def _isNocase(db, table, column):
+    """ True if table.column is declared COLLATE NOCASE. """
+    sql = db.execute(
+        "SELECT sql FROM sqlite_master"
+        " WHERE type = 'table' AND name = ? COLLATE NOCASE",
+        [table]
+    ).fetchone()
+    if not sql or not sql[0]:
+        return False
+    return re.search(
+        r'(?im)(^|[(,])\s*"?{}"?\s[^,]*?\bCOLLATE\s+NOCASE\b'.format(re.escape(column)),
+        sql[0]
+    ) is not None
+
+
+def loadForeignKey(db, fkey):
+    """
+    Returns a function that resolves the key values of a ForeignKey
+    to its value, or None, as a correlated sub-select would: keys are
+    compared as text, case-insensitively for NOCASE columns.
+    """
+    folds = [_isNocase(db, table, column) for table, column in fkey.keyColumns]
+    
+    def makeKey(values):
+        return tuple(
+            value.translate(_asciiUpper) if fold else value
+            for value, fold in zip(values, folds)
+        )
+    
+    lookup = {}
+    columns = ",".join("{}.{}".format(*col) for col in fkey.keyColumns)
+    cur = db.execute("SELECT {}, {} FROM {}".format(
+        columns, fkey.valueColumn, fkey.tables
+    ))
+    numKeys = len(folds)
+    for row in cur:
+        keys = row[:numKeys]
+        if None in keys:
+            continue
+        key = makeKey(str(value) for value in keys)
+        # The first match, as a sub-select would find.
+        lookup.setdefault(key, row[numKeys])
+    
+    getValue, keyIndexes = lookup.get, fkey.keyIndexes
+    
+    def resolve(linein):
+        return getValue(makeKey(linein[i] for i in keyIndexes))
+    
+    return resolve
+
+
+def insertImportRows(tdenv, db, importPath, sql_stmt, rows):
+    """
+    Inserts the (lineNo, params) rows with sql_stmt, in batches.
+    A row that fails is reported and skipped. Returns the number of
+    rows inserted.
+    """
+    inserted, start = 0, 0
+    while start < len(rows):
+        batch = rows[start:start + importBatchSize]
+        before = db.total_changes
+        try:
+            db.executemany(sql_stmt, [params for _, params in batch])
+            inserted += len(batch)
+            start += len(batch)
+            continue
+        except Exception as e:
+            # Every INSERT before the one that failed made one change.
+            done = db.total_changes - before
+            error = e
+        lineNo, params = batch[done]
+        tdenv.WARN(
+            "*** INTERNAL ERROR: {err}\n"
+            "CSV File: {file}:{line}\n"
+            "SQL Query: {query}\n"
+            "Params: {params}\n"
+            .format(
+                err = str(error),
+                file = str(importPath),
+                line = lineNo,
+                query = sql_stmt.strip(),
+                params = params
             )
-        tdenv.DEBUG0("SQL-Statement: {}", sql_stmt)
-        
-        # Check if there is a deprecation check for this table.
-        deprecationFn = getattr(
-            sys.modules[__name__],
-            "deprecationCheck" + tableName,
-            None
         )
-        
-        # import the data
-        importCount = 0
-        uniqueIndex = dict()
-        
-        for linein in csvin:
-            if not linein:
-                continue
-            lineNo = csvin.line_num
-            if len(linein) == columnCount:
-                tdenv.DEBUG1("       Values: {}", ', '.join(linein))
-                if deprecationFn:
-                    try:
-                        deprecationFn(importPath, lineNo, linein)
-                    except (DeprecatedKeyError, DeletedKeyError) as e:
-                        if not tdenv.ignoreUnknown:
-                            raise e
-                        e.category = "WARNING"
-                        tdenv.NOTE("{}", e)
-                        continue
-                if uniqueIndexes:
-                    # Need to construct the actual unique index key as
-                    # something less likely to collide with manmade
-                    # values when it's a compound.
-                    keyValues = [
-                        str(linein[col]).upper()
-                        for col in uniqueIndexes
-                    ]
-                    key = ":!:".join(keyValues)
-                    prevLineNo = uniqueIndex.get(key, 0)
-                    if prevLineNo:
-                        # Make a human-readable key
-                        key = "/".join(keyValues)
-                        raise DuplicateKeyError(
-                            importPath, lineNo,
-                            "entry", key,
-                            prevLineNo
-                        )
-                    uniqueIndex[key] = lineNo
-                
+        inserted += done
+        start += done + 1
+    return inserted
+
+
+def processImportFile(tdenv, db, importPath, tableName, csvData = None):
+    """
+    Imports a CSV file into tableName. csvData is what
+    readImportFile(importPath) returned, if it has already been read.
+    
+    Foreign keys are resolved from maps of the referenced tables
+    loaded up front, rather than a sub-select per row, and the rows
+    are inserted in batches.
+    """
+    tdenv.DEBUG0(
+        "Processing import file '{}' for table '{}'",
+        str(importPath), tableName
+    )
+    
+    columnDefs, csvRows = csvData or readImportFile(importPath)
+    columnCount = len(columnDefs)
+    bindColumns, sources, uniqueIndexes = parseImportColumns(columnDefs)
+    
+    # now we can make the sql statement
+    sql_stmt = """
+        INSERT OR REPLACE INTO {table} ({columns}) VALUES({values})
+    """.format(
+            table = tableName,
+            columns = ','.join(bindColumns),
+            values = ','.join('?' * len(bindColumns))
+        )
+    tdenv.DEBUG0("SQL-Statement: {}", sql_stmt)
+    
+    if not csvRows:
+        tdenv.DEBUG0("0 {table}s imported", table = tableName)
+        return
+    try:
+        getters = [
+            loadForeignKey(db, source) if isinstance(source, ForeignKey)
+            else itemgetter(source)
+            for source in sources
+        ]
+    except sqlite3.Error as e:
+        tdenv.WARN(
+            "*** INTERNAL ERROR: {err}\n"
+            "CSV File: {file}\n"
+            "Can't resolve the foreign keys of {table}\n"
+            .format(err = str(e), file = str(importPath), table = tableName)
+        )
+        return
+    
+    # Check if there is a deprecation check for this table.
+    deprecationFn = getattr(
+        sys.modules[__name__],
+        "deprecationCheck" + tableName,
+        None
+    )
+    
+    # import the data
+    rows = []
+    uniqueIndex = dict()
+    
+    for lineNo, linein in csvRows:
+        if len(linein) == columnCount:
+            tdenv.DEBUG1("       Values: {}", ', '.join(linein))
+            if deprecationFn:
                 try:
-                    db.execute(sql_stmt, linein)
-                    importCount += 1
-                except Exception as e:
-                    tdenv.WARN(
-                        "*** INTERNAL ERROR: {err}\n"
-                        "CSV File: {file}:{line}\n"
-                        "SQL Query: {query}\n"
-                        "Params: {params}\n"
-                        .format(
-                            err = str(e),
-                            file = str(importPath),
-                            line = lineNo,
-                            query = sql_stmt.strip(),
-                            params = linein
-                        )
+                    deprecationFn(importPath, lineNo, linein)
+                except (DeprecatedKeyError, DeletedKeyError) as e:
+                    if not tdenv.ignoreUnknown:
+                        raise e
+                    e.category = "WARNING"
+                    tdenv.NOTE("{}", e)
+                    continue
+            if uniqueIndexes:
+                # Need to construct the actual unique index key as
+                # something less likely to collide with manmade
+                # values when it's a compound.
+                keyValues = [
+                    str(linein[col]).upper()
+                    for col in uniqueIndexes
+                ]
+                key = ":!:".join(keyValues)
+                prevLineNo = uniqueIndex.get(key, 0)
+                if prevLineNo:
+                    # Make a human-readable key
+                    key = "/".join(keyValues)
+                    raise DuplicateKeyError(
+                        importPath, lineNo,
+                        "entry", key,
+                        prevLineNo
                     )
-                    pass
-            else:
-                tdenv.NOTE(
-                        "Wrong number of columns ({}:{}): {}",
-                            importPath,
-                            lineNo,
-                            ', '.join(linein)
-                )
-        db.commit()
-        tdenv.DEBUG0("{count} {table}s imported",
-                            count = importCount,
-                            table = tableName)
+                uniqueIndex[key] = lineNo
+            
+            rows.append((lineNo, [getter(linein) for getter in getters]))
+        else:
+            tdenv.NOTE(
+                    "Wrong number of columns ({}:{}): {}",
+                        importPath,
+                        lineNo,
+                        ', '.join(linein)
+            )
+    
+    importCount = insertImportRows(tdenv, db, importPath, sql_stmt, rows)
+    db.commit()
+    tdenv.DEBUG0("{count} {table}s imported",
+                        count = importCount,
+                        table = tableName)
+
+
+# A CREATE INDEX statement, possibly after some comments.
+createIndexRe = re.compile(r'(\s*--[^\n]*\n)*\s*CREATE\s+INDEX\b', re.IGNORECASE)
+
+
+def splitSqlScript(script):
+    """
+    Splits an SQL script into (tables, indexes): the script minus its
+    plain CREATE INDEX statements, and those statements. Loading the
+    tables before building their indexes is quicker than maintaining
+    the indexes row by row. UNIQUE indexes stay with the tables, as
+    INSERT OR REPLACE relies on them.
+    """
+    tables, indexes, statement = [], [], ""
+    for line in script.splitlines(keepends = True):
+        statement += line
+        if not sqlite3.complete_statement(statement):
+            continue
+        if createIndexRe.match(statement):
+            indexes.append(statement)
+        else:
+            tables.append(statement)
+        statement = ""
+    tables.append(statement)
+    return "".join(tables), "".join(indexes)
+
+
+def readImportFiles(importPaths):
+    """
+    Yields a function per path that returns readImportFile(path), or
+    raises what it raised. When there's enough to read and more than
+    one CPU, the files are read ahead by worker processes, so that
+    later files are parsed while earlier ones are being imported.
+    """
+    workers = min(os.cpu_count() or 1, len(importPaths))
+    totalBytes = sum(path.stat().st_size for path in importPaths if path.exists())
+    if workers < 2 or totalBytes < parallelImportBytes:
+        for path in importPaths:
+            yield partial(readImportFile, path)
+        return
+    
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(readImportFile, path) for path in importPaths]
+        for future in futures:
+            yield future.result
 
 ######################################################################
 
@@ -816,42 +1187,66 @@ def buildCache(tdb, tdenv):
     
     tempDB = sqlite3.connect(str(tempPath))
     tempDB.execute("PRAGMA foreign_keys=ON")
+    # A failed rebuild is thrown away, so there's no need to sync.
+    tempDB.execute("PRAGMA synchronous=OFF")
+    tempDB.execute("PRAGMA journal_mode=MEMORY")
     # Read the SQL script so we are ready to populate structure, etc.
     tdenv.DEBUG0("Executing SQL Script '{}' from '{}'", sqlPath, os.getcwd())
     with sqlPath.open('r', encoding = 'utf-8') as sqlFile:
-        sqlScript = sqlFile.read()
+        sqlScript, indexScript = splitSqlScript(sqlFile.read())
         tempDB.executescript(sqlScript)
     
     # import standard tables
-    for (importName, importTable) in tdb.importTables:
-        try:
-            processImportFile(tdenv, tempDB, Path(importName), importTable)
-        except FileNotFoundError:
-            tdenv.DEBUG0(
-                "WARNING: processImportFile found no {} file", importName
-            )
-        except StopIteration:
-            tdenv.NOTE(
-                "{} exists but is empty. "
-                "Remove it or add the column definition line.",
-                importName
-            )
+    importPaths = [Path(importName) for importName, _ in tdb.importTables]
+    readers = readImportFiles(importPaths)
+    try:
+        for (importName, importTable), reader in zip(tdb.importTables, readers):
+            try:
+                processImportFile(
+                    tdenv, tempDB, Path(importName), importTable, reader()
+                )
+            except FileNotFoundError:
+                tdenv.DEBUG0(
+                    "WARNING: processImportFile found no {} file", importName
+                )
+            except StopIteration:
+                tdenv.NOTE(
+                    "{} exists but is empty. "
+                    "Remove it or add the column definition line.",
+                    importName
+                )
+    finally:
+        readers.close()
     
-    # Parse the prices file
-    if pricesPath.exists():
+    # Load the prices from whichever file is newer
+    pricesPath = pricesSource(tdb)
+    if pricesPath == tdb.binPricesPath:
+        processBinaryPricesFile(tdenv, tempDB, pricesPath)
+    elif pricesPath:
         processPricesFile(tdenv, tempDB, pricesPath)
     else:
         tdenv.NOTE(
-                "Missing \"{}\" file - no price data.",
-                    pricesPath,
+                "Missing \"{}\" and \"{}\" files - no price data.",
+                    tdb.pricesPath, tdb.binPricesPath,
                     file = sys.stderr,
         )
     
+    tdenv.DEBUG0("Creating indexes")
+    tempDB.executescript(indexScript)
+    
     tempDB.commit()
     tempDB.close()
     
     tdenv.DEBUG0("Swapping out db files")
     
+    # A write-ahead log of the old db mustn't be left for the new one:
+    # the last connection to close checkpoints it into the old db.
+    tdb.close()
+    if Path(str(dbPath) + "-wal").exists():
+        oldDB = sqlite3.connect(str(dbPath))
+        oldDB.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        oldDB.close()
+    
     if dbPath.exists():
         if backupPath.exists():
             backupPath.unlink()
@@ -863,15 +1258,239 @@ def buildCache(tdb, tdenv):
 ######################################################################
 
 
-def regeneratePricesFile(tdb, tdenv):
+# Fingerprints of each station's .prices block, for regeneratePricesFile
+# to tell which blocks are out of date. Prices written without a new
+# timestamp still change the sum.
+pricesFingerprintSql = """
+    SELECT  si.station_id, COUNT(*), MAX(si.modified),
+            TOTAL(si.demand_price + si.supply_price
+                  + si.demand_units + si.supply_units),
+            stn.pretty_name, sys.name
+      FROM  StationItem AS si
+            INNER JOIN Station AS stn USING (station_id)
+            INNER JOIN System AS sys USING (system_id)
+     GROUP  BY si.station_id
+"""
+
+
+def pricesFingerprints(db):
+    """
+        Returns ({stationID: fingerprint}, itemsKey), where itemsKey
+        changes with anything about items that affects every block.
+    """
+    stations = {
+        stationID: list(fingerprint)
+        for stationID, *fingerprint in db.execute(pricesFingerprintSql)
+    }
+    items = db.execute("""
+        SELECT  item_id, itm.pretty_name, ui_order, cat.name
+          FROM  Item AS itm INNER JOIN Category AS cat USING (category_id)
+         ORDER  BY item_id
+    """).fetchall()
+    itemsKey = hashlib.sha1(json.dumps(items).encode()).hexdigest()
+    return stations, itemsKey
+
+
+def readPricesIndex(pricesPath, indexPath):
+    """
+        Returns the index of the .prices file, or None if there isn't
+        one or the file has changed since it was written. Its stations
+        are [(stationID, offset, size, fingerprint)] of the blocks.
+    """
+    try:
+        with indexPath.open('r', encoding = 'utf-8') as indexFile:
+            index = json.load(indexFile)
+        stat = pricesPath.stat()
+    except (OSError, ValueError):
+        return None
+    if index.get('size') != stat.st_size or index.get('mtime') != stat.st_mtime_ns:
+        return None
+    return index
+
+
+def writePricesIndex(
+        pricesPath, indexPath, headerSize, blocks, fingerprints, itemsKey
+        ):
+    stations, offset = [], headerSize
+    for stationID, size in blocks:
+        stations.append((stationID, offset, size, fingerprints.get(stationID)))
+        offset += size
+    stat = pricesPath.stat()
+    with indexPath.open('w', encoding = 'utf-8') as indexFile:
+        json.dump({
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'items': itemsKey,
+            'stations': stations,
+        }, indexFile)
+
+
+def updatePricesFile(tdb, tdenv, stations, changed, tmpPath):
+    """
+        Writes tmpPath as the .prices file with the blocks of the changed
+        stations dumped from the DB, copying all the others from the
+        current file. Returns (headerSize, blocks), or None if the header
+        has changed, so that everything needs dumping again.
+    """
+    dump, dumped = io.StringIO(), []
+    dumpPrices(
+            tdb.dbFilename,
+            Element.full,
+            file = dump,
+            debug = tdenv.debug,
+            stationIDs = sorted(changed),
+            index = dumped,
+    )
+    text = dump.getvalue().encode()
+    headerSize = dumped[0][1]
+    newBlocks, offset = {}, headerSize
+    for stationID, size in dumped[1:]:
+        newBlocks[stationID] = text[offset:offset + size]
+        offset += size
+    
+    # Old blocks in file order, which is station order, and new ones.
+    blocks = [
+        (stationID, offset, size) for stationID, offset, size, _ in stations
+        if stationID not in changed
+    ]
+    blocks.extend((stationID, None, len(block)) for stationID, block in newBlocks.items())
+    blocks.sort()
+    
+    with tdb.pricesPath.open('rb') as oldFile, tmpPath.open('wb') as newFile:
+        if oldFile.read(stations[0][1]) != text[:headerSize]:
+            return None
+        newFile.write(text[:headerSize])
+        # Copy runs of unchanged blocks in one go.
+        copyFrom, copyEnd = None, None
+        for stationID, offset, size in blocks:
+            if offset is not None and offset == copyEnd:
+                copyEnd += size
+                continue
+            if copyFrom is not None:
+                copyFileRange(oldFile, newFile, copyFrom, copyEnd)
+                copyFrom = None
+            if offset is None:
+                newFile.write(newBlocks[stationID])
+            else:
+                copyFrom, copyEnd = offset, offset + size
+        if copyFrom is not None:
+            copyFileRange(oldFile, newFile, copyFrom, copyEnd)
+    
+    return headerSize, [(stationID, size) for stationID, _, size in blocks]
+
+
+def copyFileRange(fromFile, toFile, start, end, chunkSize = 1 << 20):
+    fromFile.seek(start)
+    while start < end:
+        chunk = fromFile.read(min(chunkSize, end - start))
+        if not chunk:
+            raise EOFError("{}: ends before {}".format(fromFile.name, end))
+        toFile.write(chunk)
+        start += len(chunk)
+
+
+def pricesSource(tdb):
+    """
+        Returns the path of the file to load prices from: the binary
+        prices file unless the .prices file is newer, or None if there
+        is neither.
+    """
+    try:
+        binStamp = tdb.binPricesPath.stat().st_mtime
+    except FileNotFoundError:
+        binStamp = None
+    try:
+        textStamp = tdb.pricesPath.stat().st_mtime
+    except FileNotFoundError:
+        textStamp = None
+    if binStamp is not None and (textStamp is None or binStamp >= textStamp):
+        return tdb.binPricesPath
+    if textStamp is not None:
+        return tdb.pricesPath
+    return None
+
+
+def exportBinaryPrices(tdb, tdenv):
+    """
+        Writes the DB's prices to the binary prices file, which stands
+        in for the .prices file once prices have been imported; the
+        .prices file itself is only regenerated by "trade export".
+    """
+    tdenv.DEBUG0("Exporting binary prices to '{}'", tdb.binPricesPath)
+    
+    rows = tdb.getDB().execute("""
+        SELECT  station_id, item_id,
+                demand_price, demand_units, demand_level,
+                supply_price, supply_units, supply_level,
+                CAST(STRFTIME('%s', modified) AS INTEGER), from_live
+          FROM  StationItem
+         ORDER  BY station_id, item_id
+    """)
+    try:
+        BinaryPrices.write(tdb.binPricesPath, rows)
+    except ValueError as e:
+        raise TradeException("Can't export prices: {}".format(e))
+    
+    # Update the DB file so we don't re-import it.
+    os.utime(tdb.dbFilename)
+
+
+def regeneratePricesFile(tdb, tdenv, full = False):
+    """
+        Brings the .prices file up to date with the DB.
+        
+        The index kept beside the file records each block's offset and
+        a fingerprint of the station's prices (see pricesFingerprints).
+        Only the blocks of stations whose fingerprint has changed are
+        dumped, the rest are copied from the current file. Everything
+        is dumped again if full is set, or when that can't be done,
+        e.g. without an index, or after changes to items or categories.
+    """
     tdenv.DEBUG0("Regenerating .prices file")
     
-    with tdb.pricesPath.open("w", encoding = 'utf-8') as pricesFile:
-        dumpPrices(
-                tdb.dbFilename,
-                Element.full,
-                file = pricesFile,
-                debug = tdenv.debug)
+    pricesPath = tdb.pricesPath
+    indexPath = pricesPath.with_name(pricesPath.name + ".idx")
+    tmpPath = pricesPath.with_name(pricesPath.name + ".tmp")
+    db = tdb.getDB()
+    
+    # Taken before dumping: a block written after a later change only
+    # gets dumped again next time.
+    fingerprints, itemsKey = pricesFingerprints(db)
+    index = None if full else readPricesIndex(pricesPath, indexPath)
+    stations, changed = None, set()
+    if index and index.get('items') == itemsKey:
+        stations = index['stations']
+        indexed = {
+            stationID: fingerprint for stationID, _, _, fingerprint in stations
+        }
+        changed = {
+            stationID for stationID, fingerprint in fingerprints.items()
+            if indexed.pop(stationID, None) != fingerprint
+        }
+        # Stations that no longer have prices.
+        changed.update(indexed)
+    
+    if stations is not None and not changed:
+        tdenv.DEBUG0("No prices have changed")
+        os.utime(tdb.dbFilename)
+        return
+    
+    update = None
+    if stations and len(changed) <= len(stations) // 2:
+        tdenv.DEBUG0("Updating prices for {:n} stations", len(changed))
+        update = updatePricesFile(tdb, tdenv, stations, changed, tmpPath)
+    if not update:
+        blocks = []
+        with tmpPath.open("w", encoding = 'utf-8', newline = '\n') as pricesFile:
+            dumpPrices(
+                    tdb.dbFilename,
+                    Element.full,
+                    file = pricesFile,
+                    debug = tdenv.debug,
+                    index = blocks)
+        update = blocks[0][1], blocks[1:]
+    os.replace(str(tmpPath), str(pricesPath))
+    writePricesIndex(pricesPath, indexPath, *update, fingerprints, itemsKey)
     
     # Update the DB file so we don't regenerate it.
     os.utime(tdb.dbFilename)
@@ -898,12 +1517,15 @@ def importDataFromFile(tdb, tdenv, path, pricesFh = None, reset = False):
             db.commit()
     
     tdenv.DEBUG0("Importing data from {}".format(str(path)))
-    processPricesFile(tdenv,
-            db = tdb.getDB(),
-            pricesPath = path,
-            pricesFh = pricesFh,
-            )
+    if not pricesFh and path.name.endswith(BinaryPrices.suffix):
+        processBinaryPricesFile(tdenv, tdb.getDB(), path)
+    else:
+        processPricesFile(tdenv,
+                db = tdb.getDB(),
+                pricesPath = path,
+                pricesFh = pricesFh,
+                )
     
-    # If everything worked, we may need to re-build the prices file.
-    if path != tdb.pricesPath:
-        regeneratePricesFile(tdb, tdenv)
+    # If everything worked, we may need to re-export the prices.
+    if path not in (tdb.pricesPath, tdb.binPricesPath):
+        exportBinaryPrices(tdb, tdenv)
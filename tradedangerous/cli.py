@@ -40,7 +40,6 @@ import os
 import traceback
 
 from . import commands
-from .commands import exceptions
 from .plugins import PluginException
 
 
@@ -97,29 +96,10 @@ def trade(argv):
     cmdIndex = commands.CommandIndex()
     cmdenv = cmdIndex.parse(argv)
     
-    tdb = tradedb.TradeDB(cmdenv, load=cmdenv.wantsTradeDB)
+    # Commands only pay for loading the data they use.
+    tdb = tradedb.TradeDB(cmdenv, load=cmdenv.wantsTradeDB, lazy=True)
     if cmdenv.usesTradeData:
-        tsc = tdb.tradingStationCount
-        if tsc == 0:
-            raise exceptions.NoDataError(
-                "There is no trading data for ANY station in "
-                "the local database. Please enter or import "
-                "price data."
-            )
-        if tsc == 1:
-            raise exceptions.NoDataError(
-                "The local database only contains trading data "
-                "for one station. Please enter or import data "
-                "for additional stations."
-            )
-        if tsc < 8:
-            cmdenv.NOTE(
-                "The local database only contains trading data "
-                "for {} stations. Please enter or import data "
-                "for additional stations.".format(
-                    tsc
-                )
-            )
+        cmdenv.checkTradeData(tdb)
     
     try:
         results = cmdenv.run(tdb)
@@ -12,6 +12,7 @@ thismodule = sys.modules[__name__]
 from . import exceptions
 from . import parsing
 
+from . import best_cmd
 from . import buildcache_cmd
 from . import buy_cmd
 from . import export_cmd
@@ -20,9 +21,11 @@ from . import local_cmd
 from . import market_cmd
 from . import nav_cmd
 from . import olddata_cmd
+from . import pairs_cmd
 from . import rares_cmd
 from . import run_cmd
 from . import sell_cmd
+from . import serve_cmd
 from . import shipvendor_cmd
 from . import station_cmd
 from . import trade_cmd
@@ -231,6 +234,13 @@ class CommandIndex(object):
                     help = 'Specify location of the SQLite database.',
                     default = None, dest = 'dbFilename', type = str,
                 )
+        stdArgs.add_argument('--wal',
+                    help = 'Switch the database to write-ahead logging, so that '
+                            'imports and queries can run at the same time '
+                            '(also enabled by setting TD_WAL).',
+                    action = 'store_true', dest = 'walMode',
+                    default = argparse.SUPPRESS,
+                )
         stdArgs.add_argument('--cwd', '-C',
                     help = 'Change the working directory file accesses are made from.',
                     type = str, required = False,
@@ -0,0 +1,95 @@
+from __future__ import absolute_import, with_statement, print_function, division, unicode_literals
+from .exceptions import *
+from .parsing import *
+from ..tradecalc import TradeCalc
+
+######################################################################
+# Parser config
+
+help='Find the most profitable trade from a station to anywhere nearby.'
+name='best'
+epilog=(
+        'Lists what to carry to the station within reach that buys '
+        'something for the most over what the origin sells it for, '
+        'without working out a whole route as "run" does.'
+)
+wantsTradeDB=True
+arguments = [
+    ParseArgument(
+        'origin',
+        help='Station you are purchasing from.',
+        type=str,
+    ),
+]
+switches = [
+    ParseArgument('--jumps-per',
+        help='Maximum number of jumps (system-to-system) to the destination.',
+        default=2,
+        dest='maxJumpsPer',
+        metavar='N',
+        type=int,
+    ),
+    ParseArgument('--ly-per',
+        help='Maximum light years per jump.',
+        dest='maxLyPer',
+        metavar='N.NN',
+        type=float,
+    ),
+    ParseArgument('--price-matrix',
+        help='Hold prices in a compact columnar matrix, which uses '
+                'less memory and is faster with large databases.',
+        action='store_true',
+        dest='priceMatrix',
+    ),
+]
+
+######################################################################
+# Perform query and populate result set
+
+def run(results, cmdenv, tdb):
+    from .commandenv import ResultRow
+    
+    if cmdenv.maxJumpsPer < 0:
+        raise CommandLineError("--jumps-per can't be negative.")
+    
+    calc = TradeCalc(tdb, cmdenv)
+    
+    lhs = cmdenv.startStation
+    gainCr, dstID = calc.bestOutbound(lhs.ID)
+    if dstID is None:
+        raise CommandLineError("No profitable trades from {} within {} jumps".format(
+            lhs.fullName(), cmdenv.maxJumpsPer
+        ))
+    rhs = tdb.stationByID[dstID]
+    
+    results.summary = ResultRow()
+    results.summary.fromStation = lhs
+    results.summary.toStation = rhs
+    results.summary.gainCr = gainCr
+    
+    trades = calc.getTrades(lhs, rhs)
+    if cmdenv.detail > 1:
+        tdb.getAverageSelling()
+        tdb.getAverageBuying()
+    
+    for item in trades or ():
+        results.rows.append(item)
+    
+    return results
+
+#######################################################################
+## Transform result set into output
+
+def render(results, cmdenv, tdb):
+    from .trade_cmd import render as renderTrades
+    
+    summary = results.summary
+    if not cmdenv.quiet:
+        print("{} -> {} ({:.2f}ly): up to {:n}cr/ton".format(
+            summary.fromStation.fullName(), summary.toStation.fullName(),
+            summary.fromStation.system.distanceTo(summary.toStation.system),
+            summary.gainCr,
+        ))
+    
+    if results.rows:
+        renderTrades(results, cmdenv, tdb)
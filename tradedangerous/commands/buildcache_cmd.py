@@ -4,7 +4,11 @@ import sys
 from .exceptions import CommandLineError
 from .parsing import *
 from ..cache import buildCache
+from ..jumpgraph import JumpGraph
+from ..tradecalc import TradeCalc
 from ..tradedb import TradeDB
+from ..tradeenv import TradeEnv
+from ..tradeindex import TradeIndex
 
 ######################################################################
 # Parser config
@@ -45,16 +49,109 @@ switches = [
             "recognized is reported as warning but skipped."
         ),
     ),
+    ParseArgument(
+        '--jump-tiers',
+        default = None, nargs = '?', const = '',
+        dest = 'jumpTiers', metavar = 'LY[,LY...]',
+        help = (
+            "(Re)build the precomputed jump graph for these jump "
+            "ranges (default: {}). Without --force, only the jump "
+            "graph is built."
+            .format(",".join(str(ly) for ly in JumpGraph.defaultTiers))
+        ),
+    ),
+    ParseArgument(
+        '--landmarks',
+        default = None,
+        dest = 'landmarks', metavar = 'LY[,LY...]',
+        help = (
+            "(Re)build the route landmarks \"nav --engine alt|bidir\" "
+            "uses, for these jump ranges. Landmarks for one range also "
+            "serve any shorter range, less precisely. Without --force, "
+            "only the landmarks are built."
+        ),
+    ),
+    ParseArgument(
+        '--trade-index',
+        default = None, nargs = '?', const = '',
+        dest = 'tradeIndex', metavar = 'LY[,TOP]',
+        help = (
+            "(Re)build the precomputed index of the TOP most profitable "
+            "stations within LY of each station (default: {},{}). "
+            "Without --force, only the trade index is built."
+            .format(TradeIndex.defaultRadiusLy, TradeIndex.defaultTopK)
+        ),
+    ),
 ]
 
 ######################################################################
 # Helpers
 
+
+def parseLyList(text, option):
+    """ Parses a comma-separated list of jump ranges for option. """
+    if not text:
+        return None
+    try:
+        lys = [float(ly) for ly in text.split(',')]
+    except ValueError:
+        raise CommandLineError(
+            "Invalid {} '{}', expected e.g. 10,15,20".format(option, text)
+        )
+    if min(lys) <= 0:
+        raise CommandLineError("{} must be positive".format(option))
+    return lys
+
+
+def parseTradeIndex(text):
+    """ Returns (radiusLy, topK), either of which can be None. """
+    if not text:
+        return None, None
+    try:
+        values = text.split(',')
+        radiusLy = float(values[0]) if values[0] else None
+        topK = int(values[1]) if len(values) > 1 else None
+        if len(values) > 2:
+            raise ValueError
+    except ValueError:
+        raise CommandLineError(
+            "Invalid --trade-index '{}', expected e.g. 40,10".format(text)
+        )
+    if (radiusLy is not None and radiusLy <= 0) or (topK is not None and topK < 1):
+        raise CommandLineError("--trade-index values must be positive")
+    return radiusLy, topK
+
+
+def buildSidecars(tdb, cmdenv, tiers, landmarkLys, indexArgs):
+    """ (Re)builds the jump graph, landmarks and trade index as asked. """
+    tdb.load()
+    if cmdenv.jumpTiers is not None:
+        tdb.buildJumpGraph(tiers)
+    for ly in landmarkLys or ():
+        tdb.buildLandmarks(ly)
+    if cmdenv.tradeIndex is not None:
+        calc = TradeCalc(tdb, TradeEnv(
+            priceMatrix = True, workers = 0,
+            debug = cmdenv.debug, quiet = cmdenv.quiet,
+        ))
+        calc.buildTradeIndex(*indexArgs)
+
 ######################################################################
 # Perform query and populate result set
 
 
 def run(results, cmdenv, tdb):
+    tiers = parseLyList(cmdenv.jumpTiers, '--jump-tiers')
+    landmarkLys = parseLyList(cmdenv.landmarks, '--landmarks')
+    indexArgs = parseTradeIndex(cmdenv.tradeIndex)
+    sidecars = (
+        cmdenv.jumpTiers is not None or cmdenv.landmarks is not None or
+        cmdenv.tradeIndex is not None
+    )
+    if sidecars and not cmdenv.force and tdb.dbPath.exists():
+        buildSidecars(tdb, cmdenv, tiers, landmarkLys, indexArgs)
+        return None
+    
     # Check that the file doesn't already exist.
     if not cmdenv.force:
         if tdb.dbPath.exists():
@@ -70,4 +167,7 @@ def run(results, cmdenv, tdb):
     
     buildCache(tdb, cmdenv)
     
+    if sidecars:
+        buildSidecars(tdb, cmdenv, tiers, landmarkLys, indexArgs)
+    
     return None
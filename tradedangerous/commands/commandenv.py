@@ -1,6 +1,6 @@
 from __future__ import absolute_import, with_statement, print_function, division, unicode_literals
 
-from .exceptions import CommandLineError, PadSizeError, PlanetaryError, FleetCarrierError
+from .exceptions import CommandLineError, NoDataError, PadSizeError, PlanetaryError, FleetCarrierError
 from ..tradedb import AmbiguityError, System, Station
 from ..tradeenv import TradeEnv
 from tradedangerous.utils import normalizedStr
@@ -86,6 +86,33 @@ class CommandEnv(TradeEnv):
     def render(self, results):
         self._cmd.render(self, results, self, self.tdb)
     
+    def checkTradeData(self, tdb):
+        """
+            Commands that use trade data need at least two stations
+            with prices.
+        """
+        tsc = tdb.tradingStationCount
+        if tsc == 0:
+            raise NoDataError(
+                "There is no trading data for ANY station in "
+                "the local database. Please enter or import "
+                "price data."
+            )
+        if tsc == 1:
+            raise NoDataError(
+                "The local database only contains trading data "
+                "for one station. Please enter or import data "
+                "for additional stations."
+            )
+        if tsc < 8:
+            self.NOTE(
+                "The local database only contains trading data "
+                "for {} stations. Please enter or import data "
+                "for additional stations.".format(
+                    tsc
+                )
+            )
+    
     def checkMFD(self):
         self.mfd = None
         try:
@@ -172,7 +172,7 @@ def run(results, cmdenv, tdb):
     
     if cmdenv.plug:
         if not plugin.finish():
-            cache.regeneratePricesFile()
+            cache.exportBinaryPrices(tdb, cmdenv)
             return None
     
     cache.importDataFromFile(tdb, cmdenv, filePath, pricesFh = fh, reset = cmdenv.reset)
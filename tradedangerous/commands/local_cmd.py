@@ -121,6 +121,11 @@ def run(results, cmdenv, tdb):
                 continue
             yield station
     
+    if showStations or wantStations:
+        tdb.loadTrading(chain.from_iterable(
+            system.stations for system in distances
+        ))
+    
     for (system, dist) in sorted(distances.items(), key=lambda x: x[1]):
         if showStations or wantStations:
             stations = []
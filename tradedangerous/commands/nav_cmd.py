@@ -44,6 +44,13 @@ switches = [
     ),
     FleetCarrierArgument(),
     OdysseyArgument(),
+    ParseArgument('--engine',
+        help='Route search: "astar" (default), "alt" (landmark heuristic) '
+            'or "bidir" (bidirectional landmark search). The landmarks '
+            'are built by "trade buildcache --landmarks".',
+        choices=TradeDB.routeEngines,
+        default='astar',
+    ),
 ]
 
 ######################################################################
@@ -93,6 +100,7 @@ def run(results, cmdenv, tdb):
                 maxLyPer,
                 avoiding,
                 stationInterval=stationInterval,
+                engine=cmdenv.engine,
                 ))
         except TypeError:
             raise NoRouteError(
@@ -115,6 +123,10 @@ def run(results, cmdenv, tdb):
     fleet = cmdenv.fleet
     odyssey = cmdenv.odyssey
     noPlanet = cmdenv.noPlanet
+    if cmdenv.stations:
+        tdb.loadTrading(
+            station for jumpSys, _ in route for station in jumpSys.stations
+        )
     
     for (jumpSys, dist) in route:
         jumpLy = lastSys.distanceTo(jumpSys)
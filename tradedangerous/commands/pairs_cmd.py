@@ -0,0 +1,130 @@
+from __future__ import absolute_import, with_statement, print_function, division, unicode_literals
+from .exceptions import *
+from .parsing import *
+from ..pricesnapshot import PriceSnapshot
+from ..tradeexcept import TradeException
+
+import numpy
+
+######################################################################
+# Parser config
+
+help='List the most profitable station pairs from the trade index.'
+name='pairs'
+epilog=(
+        'Looks the pairs up in the index built by '
+        '"buildcache --trade-index", which lists the most profitable '
+        'destinations within its radius of each station, with the '
+        'item that makes the most per ton.'
+)
+wantsTradeDB=True
+arguments = [
+]
+switches = [
+    ParseArgument('--limit',
+            help='Maximum number of results to show',
+            default=20,
+            type=int,
+    ),
+    ParseArgument('--near',
+            help='Only trade from stations within range of this system.',
+            type=str
+    ),
+    ParseArgument('--ly',
+            help='[Requires --near] Systems within this range of --near.',
+            default=None,
+            dest='maxLyPer',
+            metavar='N.NN',
+            type=float,
+    ),
+]
+
+######################################################################
+# Perform query and populate result set
+
+def run(results, cmdenv, tdb):
+    from .commandenv import ResultRow
+    
+    index = tdb.getTradeIndex()
+    if index is None:
+        raise CommandLineError(
+            "No trade index, build one with: trade.py buildcache --trade-index"
+        )
+    if not index.matches(PriceSnapshot.dbState(tdb.dbPath)):
+        cmdenv.NOTE(
+            "The trade index is of older prices, "
+            "rebuild it with: trade.py buildcache --trade-index"
+        )
+    
+    sources, pairs = index.sources(), index.pairs
+    nearSys = cmdenv.nearSystem
+    if nearSys:
+        maxLy = cmdenv.maxLyPer or tdb.maxSystemLinkLy
+        stationIDs = [
+            station.ID
+            for system, _ in tdb.genSystemsInRange(nearSys, maxLy, True)
+            for station in system.stations
+        ]
+        mask = numpy.isin(sources, stationIDs)
+        sources, pairs = sources[mask], pairs[mask]
+    
+    results.summary = ResultRow()
+    results.summary.radiusLy = index.radiusLy
+    
+    stationByID, itemByID = tdb.stationByID, tdb.itemByID
+    # Most profitable first, then the shortest.
+    for row in numpy.lexsort((pairs['dist'], -pairs['gain'])).tolist():
+        src = stationByID.get(int(sources[row]), None)
+        dst = stationByID.get(int(pairs['dst'][row]), None)
+        item = itemByID.get(int(pairs['item'][row]), None)
+        if not (src and dst and item):
+            continue
+        results.rows.append(ResultRow(
+            src = src, dst = dst, item = item,
+            gainCr = int(pairs['gain'][row]),
+            costCr = int(pairs['cost'][row]),
+            dist = float(pairs['dist'][row]),
+        ))
+        if cmdenv.limit and len(results.rows) >= cmdenv.limit:
+            break
+    
+    return results
+
+######################################################################
+# Transform result set into output
+
+def render(results, cmdenv, tdb):
+    from ..formatting import RowFormat, max_len
+    
+    if not results or not results.rows:
+        raise TradeException(
+            "No profitable pairs within {}ly".format(results.summary.radiusLy)
+        )
+    
+    srcLen = max_len(results.rows, key=lambda row: row.src.fullName())
+    dstLen = max_len(results.rows, key=lambda row: row.dst.fullName())
+    itemLen = max_len(results.rows, key=lambda row: row.item.name(cmdenv.detail))
+    
+    rowFmt = RowFormat()
+    rowFmt.addColumn('From', '<', srcLen,
+            key=lambda row: row.src.fullName())
+    rowFmt.addColumn('To', '<', dstLen,
+            key=lambda row: row.dst.fullName())
+    rowFmt.addColumn('Item', '<', itemLen,
+            key=lambda row: row.item.name(cmdenv.detail))
+    rowFmt.addColumn('Profit', '>', 10, 'n',
+            key=lambda row: row.gainCr)
+    rowFmt.addColumn('Cost', '>', 10, 'n',
+            key=lambda row: row.costCr)
+    rowFmt.addColumn('DistLy', '>', 6, '.2f',
+            key=lambda row: row.dist)
+    if cmdenv.nearSystem:
+        rowFmt.addColumn('NearLy', '>', 6, '.2f',
+                key=lambda row: row.src.system.distanceTo(cmdenv.nearSystem))
+    
+    if not cmdenv.quiet:
+        heading, underline = rowFmt.heading()
+        print(heading, underline, sep='\n')
+    
+    for row in results.rows:
+        print(rowFmt.format(row))
@@ -2,10 +2,12 @@ from .commandenv import ResultRow
 from .exceptions import *
 from .parsing import *
 from itertools import chain
+from operator import itemgetter
 from ..formatting import RowFormat, ColumnFormat
 from ..tradedb import TradeDB, System, Station, describeAge
 from ..tradecalc import TradeCalc, Route, NoHopsError
 
+import heapq
 import math
 
 ######################################################################
@@ -232,6 +234,15 @@ switches = [
         type = int,
         dest = 'pruneHops',
     ),
+    ParseArgument('--beam',
+        help = 'Beam search: before each hop, keep only the N routes with '
+                'the best score plus the most their next hop could add. '
+                'Faster, but may miss routes the full search would find.',
+        default = None,
+        metavar = 'N',
+        type = int,
+        dest = 'beamWidth',
+    ),
     ParseArgument('--progress', '-P',
         help = 'Show hop progress',
         default = False,
@@ -251,6 +262,27 @@ switches = [
         help = 'Summary layout of route instructions.',
         action = 'store_true',
     ),
+    ParseArgument('--price-matrix',
+        help = 'Hold prices in a compact columnar matrix, which uses '
+                'less memory and is faster with large databases.',
+        action = 'store_true',
+        dest = 'priceMatrix',
+    ),
+    ParseArgument('--workers',
+        help = 'Number of processes to use when calculating hops '
+                '(0 = one per CPU).',
+        type = int,
+        default = None,
+        metavar = 'N',
+    ),
+    ParseArgument('--fit',
+        help = 'How to choose the load for each hop: "simple" buys the '
+                'most profitable items first, "exact" finds the most '
+                'profitable load that fits your credits, "fast" and '
+                '"brute" are slower searches (default: simple).',
+        choices = ('simple', 'fast', 'brute', 'exact'),
+        default = None,
+    ),
     ParseArgument('--shorten',
         help = '(Requires --to) Find the shortest route with the best gpt.',
         action = 'store_true',
@@ -716,6 +748,18 @@ def checkOrigins(tdb, cmdenv, calc):
             for station in tdb.stationByID.values()
             if checkStationSuitability(cmdenv, calc, station)
         )
+        # Stations that the trade index has no profitable trades within
+        # reach of can't start a route.
+        index = calc.tradeIndex()
+        if index is not None:
+            preCrop = len(cmdenv.origins)
+            cmdenv.origins = tuple(
+                station for station in cmdenv.origins
+                if index.bestGain(station.ID) > 0
+            )
+            cmdenv.DEBUG0(
+                "Trade index ruled out {} origins", preCrop - len(cmdenv.origins)
+            )
     
     if not cmdenv.startJumps and isinstance(cmdenv.origPlace, System):
         cmdenv.origins = filterStationSet(
@@ -807,6 +851,11 @@ def validateRunArguments(tdb, cmdenv, calc):
     if cmdenv.hops > 32:
         raise CommandLineError("Too many hops without more optimization")
     
+    if cmdenv.workers is not None and cmdenv.workers < 0:
+        raise CommandLineError("Invalid (negative) value for --workers")
+    if cmdenv.beamWidth is not None and cmdenv.beamWidth < 1:
+        raise CommandLineError("--beam has to be 1 or higher.")
+    
     if cmdenv.maxJumpsPer < 0:
         raise CommandLineError("Negative jumps: you're already there?")
     if cmdenv.direct:
@@ -876,6 +925,9 @@ def validateRunArguments(tdb, cmdenv, calc):
     
     if cmdenv.goalSystem and not cmdenv.origPlace:
         raise CommandLineError("--towards requires --from")
+    if cmdenv.goalSystem and cmdenv.beamWidth:
+        # --towards scores routes by distance, not by credits.
+        raise CommandLineError("Cannot use --beam and --towards together")
     
     checkOrigins(tdb, cmdenv, calc)
     checkDestinations(tdb, cmdenv, calc)
@@ -1128,6 +1180,27 @@ def extraRouteProgress(routes):
     
     return ".. {}, {}".format(gainText, gptText)
 
+
+def beamRoutes(cmdenv, calc, routes):
+    """
+    Beam search step: ranks routes by their score plus the most their
+    next hop could add, and keeps the best cmdenv.beamWidth of them.
+    
+    This is a heuristic crop: the routes kept aren't guaranteed to
+    include the best, as getBestHops keeps one route per destination
+    and a route may have no profitable next hop.
+    """
+    hopBound = calc.hopScoreBound
+    ranked = [
+        (route.score + hopBound(route.lastStation.ID), route)
+        for route in routes
+    ]
+    
+    if len(ranked) > cmdenv.beamWidth:
+        ranked = heapq.nlargest(cmdenv.beamWidth, ranked, key = itemgetter(0))
+    
+    return [route for _, route in ranked]
+
 ######################################################################
 # Perform query and populate result set
 
@@ -1244,6 +1317,12 @@ def run(results, cmdenv, tdb):
             if cmdenv.maxRoutes and len(routes) > cmdenv.maxRoutes:
                 routes = routes[:cmdenv.maxRoutes]
         
+        if cmdenv.beamWidth:
+            preCrop = len(routes)
+            routes = beamRoutes(cmdenv, calc, routes)
+            if len(routes) < preCrop:
+                cmdenv.DEBUG0("Beam dropped {} origins", preCrop - len(routes))
+        
         if cmdenv.progress:
             extra = ""
             if hopNo > 0 and cmdenv.detail > 1:
@@ -1329,6 +1408,18 @@ def run(results, cmdenv, tdb):
         if routePickPred:
             pickedRoutes.extend(route for route in routes if routePickPred(route))
     
+    if cmdenv.detail > 1:
+        cmdenv.NOTE(
+            "Destination cache: {:n} hits, {:n} misses",
+            tdb.destinationCacheHits, tdb.destinationCacheMisses,
+        )
+        fitLookups = calc.fitCacheHits + calc.fitCacheMisses
+        cmdenv.NOTE(
+            "Fit cache: {:n} hits, {:n} misses ({:.1%} hit rate)",
+            calc.fitCacheHits, calc.fitCacheMisses,
+            calc.fitCacheHits / fitLookups if fitLookups else 0,
+        )
+    
     if cmdenv.loop or cmdenv.shorten:
         cmdenv.DEBUG0("Using {} picked routes", len(pickedRoutes))
         routes = pickedRoutes
@@ -0,0 +1,229 @@
+from __future__ import absolute_import, with_statement, print_function, division, unicode_literals
+from .exceptions import CommandLineError
+from .parsing import *
+from ..tradeexcept import TradeException
+
+import contextlib
+import http.server
+import io
+import json
+import os
+import socket
+import socketserver
+import stat
+import traceback
+
+######################################################################
+# Parser config
+
+help = 'Answer queries from a resident database over a local HTTP/JSON API.'
+name = 'serve'
+epilog = (
+        'Loads the database once and keeps it loaded, so that tools '
+        'making frequent queries don\'t pay the start-up cost each time.\n'
+        'POST /<command> with a JSON list of arguments, e.g.\n'
+        '  curl -d \'["--from", "sol/abr", "--cap", "10"]\' '
+        'localhost:8066/run\n'
+        'replies with {"output": "<what trade.py would print>"}, or '
+        '{"error": "..."} on failure. GET /status reports on the server.\n'
+        'Only commands that read the database are served: '
+        'best, buy, local, market, nav, olddata, pairs, rares, run, sell, '
+        'trade.\n'
+        'The loaded data is refreshed when the database changes.'
+)
+wantsTradeDB = True
+arguments = [
+]
+switches = [
+    ParseArgument(
+        '--host', default = '127.0.0.1',
+        help = 'Address to listen on (default: 127.0.0.1).',
+    ),
+    MutuallyExclusiveGroup(
+        ParseArgument(
+            '--port', default = 8066, type = int,
+            help = 'Port to listen on (default: 8066).',
+        ),
+        ParseArgument(
+            '--socket', default = None, dest = 'socketPath', metavar = 'PATH',
+            help = 'Listen on this Unix-domain socket instead of a port.',
+        ),
+    ),
+]
+
+# Commands that only read the database, as listed in the epilog.
+servedCommands = (
+    'best', 'buy', 'local', 'market', 'nav', 'olddata', 'pairs',
+    'rares', 'run', 'sell', 'trade',
+)
+
+######################################################################
+# Server
+
+
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+    server_version = 'TradeDangerous'
+    
+    def do_GET(self):
+        if self.path.strip('/') == 'status':
+            self.reply(200, self.server.status())
+        else:
+            self.reply(404, {'error': 'Unknown path: {}'.format(self.path)})
+    
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            args = json.loads(self.rfile.read(length).decode() or '[]')
+        except (ValueError, UnicodeDecodeError) as e:
+            self.reply(400, {'error': 'Invalid request: {}'.format(e)})
+            return
+        if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+            self.reply(400, {'error': 'Expected a JSON list of arguments'})
+            return
+        status, reply = self.server.query(self.path.strip('/'), args)
+        self.reply(status, reply)
+    
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, fmt, *args):
+        # Unix-socket clients have no address to report.
+        self.server.cmdenv.DEBUG0("serve: {}", fmt % args)
+
+
+class QueryServer(http.server.HTTPServer):
+    """
+        Answers queries against one resident TradeDB.
+        
+        Queries are handled one at a time in the thread that calls
+        serve_forever(), which must be the thread that owns the
+        TradeDB's connection. Before each query, the TradeDB is
+        refreshed if the .db has changed.
+    """
+    
+    def __init__(self, address, cmdenv, tdb):
+        super().__init__(address, QueryHandler)
+        self.cmdenv, self.tdb = cmdenv, tdb
+        self.queries = self.errors = self.refreshes = 0
+    
+    def refresh(self):
+        if self.tdb.refresh():
+            self.cmdenv.NOTE("Database changed, refreshed")
+            self.refreshes += 1
+    
+    def query(self, cmdName, args):
+        """
+            Runs "trade <cmdName> <args...>" on the resident TradeDB,
+            returning (HTTP status, reply) where the reply holds what
+            the command printed, and the error if it failed.
+        """
+        from . import CommandIndex
+        
+        if cmdName not in servedCommands:
+            self.errors += 1
+            return 404, {'error': "Unknown or unsupported command: '{}'".format(cmdName)}
+        
+        self.refresh()
+        tdb, output = self.tdb, io.StringIO()
+        argv = [self.cmdenv.argv[0], cmdName] + args
+        try:
+            with contextlib.redirect_stdout(output):
+                cmdenv = CommandIndex().parse(argv)
+                # TradeDB reads options such as padSize from its tdenv,
+                # so it has to be the query's for the query to see them.
+                tdb.tdenv = cmdenv
+                try:
+                    if cmdenv.usesTradeData:
+                        cmdenv.checkTradeData(tdb)
+                    results = cmdenv.run(tdb)
+                    if results:
+                        results.render()
+                finally:
+                    tdb.tdenv = self.cmdenv
+        except TradeException as e:
+            self.errors += 1
+            return 400, {'error': str(e), 'output': output.getvalue()}
+        except Exception as e:
+            # Report it, but keep serving.
+            self.errors += 1
+            traceback.print_exc()
+            return 500, {'error': repr(e), 'output': output.getvalue()}
+        
+        self.queries += 1
+        return 200, {'output': output.getvalue()}
+    
+    def status(self):
+        tdb = self.tdb
+        return {
+            'db': str(tdb.dbPath),
+            'systems': len(tdb.systemByID),
+            'stations': len(tdb.stationByID),
+            'tradingStations': tdb.tradingStationCount,
+            'queries': self.queries,
+            'errors': self.errors,
+            'refreshes': self.refreshes,
+        }
+
+
+class UnixQueryServer(QueryServer):
+    address_family = getattr(socket, 'AF_UNIX', None)
+    
+    def server_bind(self):
+        # HTTPServer.server_bind expects a (host, port) address.
+        socketserver.TCPServer.server_bind(self)
+        self.server_name, self.server_port = 'localhost', 0
+
+
+def createServer(cmdenv, tdb):
+    if not cmdenv.socketPath:
+        return QueryServer((cmdenv.host, cmdenv.port), cmdenv, tdb)
+    
+    if not hasattr(socket, 'AF_UNIX'):
+        raise CommandLineError("--socket is not supported on this platform")
+    # Remove the socket left behind by a previous server.
+    try:
+        if stat.S_ISSOCK(os.stat(cmdenv.socketPath).st_mode):
+            os.unlink(cmdenv.socketPath)
+    except FileNotFoundError:
+        pass
+    return UnixQueryServer(cmdenv.socketPath, cmdenv, tdb)
+
+######################################################################
+# Perform query and populate result set
+
+
+def run(results, cmdenv, tdb):
+    try:
+        server = createServer(cmdenv, tdb)
+    except OSError as e:
+        raise CommandLineError("Can't listen on {}: {}".format(
+            cmdenv.socketPath or "{}:{}".format(cmdenv.host, cmdenv.port), e
+        ))
+    
+    cmdenv.NOTE(
+        "Serving {} on {}, Ctrl-C to stop",
+        tdb.dbPath if cmdenv.detail else "local db",
+        cmdenv.socketPath or "http://{}:{}/".format(*server.server_address[:2]),
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if cmdenv.socketPath:
+            os.unlink(cmdenv.socketPath)
+    
+    return None
+
+######################################################################
+# Transform result set into output
+
+
+def render(results, cmdenv, tdb):
+    pass
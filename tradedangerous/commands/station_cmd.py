@@ -331,8 +331,8 @@ def checkResultAndExportStations(tdb, cmdenv, result):
     
     if cmdenv.remove:
         if cmdenv.stationItemCount:
-            cmdenv.NOTE("Station had items, regenerating .prices file")
-            cache.regeneratePricesFile(tdb, cmdenv)
+            cmdenv.NOTE("Station had items, exporting prices")
+            cache.exportBinaryPrices(tdb, cmdenv)
     
     return None
 
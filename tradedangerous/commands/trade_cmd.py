@@ -26,6 +26,12 @@ arguments = [
     ),
 ]
 switches = [
+    ParseArgument('--price-matrix',
+        help='Hold prices in a compact columnar matrix, which uses '
+                'less memory and is faster with large databases.',
+        action='store_true',
+        dest='priceMatrix',
+    ),
 ]
 
 ######################################################################
@@ -3,10 +3,16 @@
 
 import zlib
 import zmq
+import zmq.asyncio
 import simplejson
 import sys, os, time
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
+import queue
 import signal
+import threading
 from tradedangerous.tradeenv import TradeEnv
 from tradedangerous.tradedb import TradeDB, AmbiguityError
 
@@ -14,7 +20,7 @@ from tradedangerous.tradedb import TradeDB, AmbiguityError
  "  Configuration
 """
 __reportDir             = '/tmp/eddnReports'
-__relayEDDN             = 'tcp://eddn.edcd.io:9500'
+__relayEDDN             = os.environ.get('EDDN_RELAY') or 'tcp://eddn.edcd.io:9500'
 __timeoutEDDN           = 600000
 
 # Set False to listen to production stream
@@ -27,6 +33,22 @@ __logVerboseFile        = False
 # Error log file
 __errorLogFile          = __reportDir + "/error.log"
 
+# Decoded messages waiting to be written; receiving blocks when it's full
+__queueSize             = 1000
+
+# Commit once this many stations have changed, or this many seconds
+# after the first uncommitted change, whichever comes first
+__batchStations         = 100
+__batchSeconds          = 5
+
+# Messages are inflated and parsed by this many worker threads, or
+# processes if __decodeProcesses is True
+__decodeWorkers         = 2
+__decodeProcesses       = False
+
+# Log the ingestion metrics this often (seconds), False to never
+__metricsSeconds        = 60
+
 # Check https://eddn.edcd.io/ for statistics
 # A sample list of authorised softwares
 __authorisedSoftwares   = [
@@ -46,19 +68,9 @@ __excludedSoftwares     = [
     'GameGlass',
 ]
 
-"""
- " Global variables
-"""
-exitGracefully = False
-
 """
  "  Start
 """
-def signal_handler(sig, frame):
-    print('SIGINT/SIGTERM capturede, exiting gracefully.')
-    global exitGracefully
-    exitGracefully = True
-
 def date(__format):
     d = datetime.utcnow()
     return d.strftime(__format)
@@ -110,12 +122,15 @@ def echoFile(filename, __str):
     f.close()
 
 __lastCleanup = None
-def cleanupDb(tdb: TradeDB):
+def cleanupDb(tdb: TradeDB, flush=None):
     global __lastCleanup
     # Only cleanup once a day
     if __lastCleanup and __lastCleanup == date("%Y-%m-%d"):
         return
     __lastCleanup = date("%Y-%m-%d")
+    if flush:
+        # Don't leave a batch open across the VACUUM
+        flush()
     echoLog("Cleanup DB.")
     stdFormat = '%Y-%m-%dT%H:%M:%S%z' # ISO 8601
     timestamp = datetime.utcnow() - timedelta(days = 14)
@@ -124,255 +139,659 @@ def cleanupDb(tdb: TradeDB):
     tdb.getDB().commit()
     tdb.query("VACUUM")
     tdb.getDB().commit()
-    tdb.close() # Close to cleanup everything
-    tdb.load() # Reload database
+    tdb.refresh() # Catch up with the deleted prices
 
-def main():
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    eddnConnectorQuiet=os.environ.get('EDDN_CONNECTOR_QUIET') or False
-    echoLog('Starting EDDN Subscriber')
-    echoLog('')
-
-    # From td.py in EDMC git
-    # These are specific to Trade Dangerous, so don't move to edmc_data.py
-    demandbracketmap = {0: '?',
-                        1: 'L',
-                        2: 'M',
-                        3: 'H'}
-    stockbracketmap = {0: '-',
+# From td.py in EDMC git
+# These are specific to Trade Dangerous, so don't move to edmc_data.py
+demandbracketmap = {0: '?',
                     1: 'L',
                     2: 'M',
                     3: 'H'}
+stockbracketmap = {0: '-',
+                1: 'L',
+                2: 'M',
+                3: 'H'}
+
+def exportCommodityToPricesFile(message):
+    os.makedirs(__reportDir, exist_ok = True)
+    filename = __reportDir + "/eddnReport_" + date('%Y-%m-%d-{:05d}.prices')
+    cnt = 1
+    while os.path.isfile(filename.format(cnt)):
+        cnt = cnt + 1
+    filename = filename.format(cnt)
+    timestamp = getTimeStamp(message['timestamp'])
     
-    # Get the TradeDB object only once per runtime
-    tdenv = TradeEnv(quiet=1)
-    tdb = TradeDB(tdenv)
-
-    context     = zmq.Context()
-    subscriber  = context.socket(zmq.SUB)
-
-    subscriber.setsockopt(zmq.SUBSCRIBE, b"")
-    subscriber.setsockopt(zmq.RCVTIMEO, __timeoutEDDN)
-
-    def parseMessageCommodity(message):
-        if len(message['commodities']) <= 0:
-            return
+    echoFile(filename, "#! trade import -")
+    echoFile(filename, "# Created by EDDN client")
+    echoFile(filename, "# Received on  " + timestamp)
+    echoFile(filename, "")
+    echoFile(filename, "#    <item name>             <sellCR> <buyCR>   <demand>   <stock>  <timestamp>")
+    echoFile(filename, "@ " + message['systemName'] + " / " + message['stationName'])
+    
+    for commodity in message['commodities']:
+        name = ''.join(e.lower() for e in commodity['name'] if e.isalnum()).lower()
+        demandBracket=commodity['demandBracket']
+        stockBracket=commodity['stockBracket']
+        if demandBracket == '':
+            demandBracket=0
+        if stockBracket == '':
+            stockBracket=0
+        echoFile(filename, 
+            f"      {name:<23}"
+            f" {int(commodity['sellPrice']):7d}"
+            f" {int(commodity['buyPrice']):7d}"
+            f" {int(commodity['demand']) if demandBracket else '' :9}"
+            f"{demandbracketmap[demandBracket]:1}"
+            f" {int(commodity['stock']) if stockBracket else '':8}"
+            f"{stockbracketmap[stockBracket]:1}"
+            f"  {timestamp}"
+            )
+    echoFile(filename, '')
 
-        def exportCommodityToPricesFile(message):
-            os.makedirs(__reportDir, exist_ok = True)
-            filename = __reportDir + "/eddnReport_" + date('%Y-%m-%d-{:05d}.prices')
-            cnt = 1
-            while os.path.isfile(filename.format(cnt)):
-                cnt = cnt + 1
-            filename = filename.format(cnt)
-            timestamp = getTimeStamp(message['timestamp'])
-            
-            echoFile(filename, "#! trade import -")
-            echoFile(filename, "# Created by EDDN client")
-            echoFile(filename, "# Received on  " + timestamp)
-            echoFile(filename, "")
-            echoFile(filename, "#    <item name>             <sellCR> <buyCR>   <demand>   <stock>  <timestamp>")
-            echoFile(filename, "@ " + message['systemName'] + " / " + message['stationName'])
-            
-            for commodity in message['commodities']:
-                name = ''.join(e.lower() for e in commodity['name'] if e.isalnum()).lower()
-                demandBracket=commodity['demandBracket']
-                stockBracket=commodity['stockBracket']
-                if demandBracket == '':
-                    demandBracket=0
-                if stockBracket == '':
-                    stockBracket=0
-                echoFile(filename, 
-                    f"      {name:<23}"
-                    f" {int(commodity['sellPrice']):7d}"
-                    f" {int(commodity['buyPrice']):7d}"
-                    f" {int(commodity['demand']) if demandBracket else '' :9}"
-                    f"{demandbracketmap[demandBracket]:1}"
-                    f" {int(commodity['stock']) if stockBracket else '':8}"
-                    f"{stockbracketmap[stockBracket]:1}"
-                    f"  {timestamp}"
-                    )
-            echoFile(filename, '')
+"""
+ "  Decoding, done on the receiving thread
+"""
+# prices are (itemName,
+#             demandPrice, demandUnits, demandLevel,
+#             supplyPrice, supplyUnits, supplyLevel)
+CommodityMessage = namedtuple('CommodityMessage', (
+    'systemName', 'stationName', 'timestamp', 'prices',
+))
+DockedMessage = namedtuple('DockedMessage', (
+    'systemName', 'systemPos', 'stationName', 'lsFromStar',
+    'market', 'blackMarket', 'shipyard', 'maxPadSize', 'outfitting',
+    'rearm', 'refuel', 'repair', 'planetary', 'fleet', 'odyssey',
+    'timestamp',
+))
+
+def decodeCommodity(message):
+    """
+    Returns the CommodityMessage for a commodity/3 message, or None if
+    it has no prices. Raises KeyError, TypeError or ValueError if the
+    message is malformed.
+    """
+    if len(message['commodities']) <= 0:
+        return None
+    
+    prices = []
+    for commodity in message['commodities']:
+        if commodity['demandBracket'] == "": demandBracket = -1
+        else: demandBracket = commodity['demandBracket']
+        if commodity['stockBracket'] == "": stockBracket = -1
+        else: stockBracket = commodity['stockBracket']
+        prices.append((
+            commodity['name'],
+            int(commodity['sellPrice']), int(commodity['demand']), int(demandBracket),
+            int(commodity['buyPrice']), int(commodity['stock']), int(stockBracket),
+        ))
+    
+    return CommodityMessage(
+        message['systemName'], message['stationName'],
+        getTimeStamp(message['timestamp']), prices,
+    )
+
+def decodeDocked(message):
+    """
+    Returns the DockedMessage for a journal/1 Docked event at a station
+    with a market, otherwise None. Raises KeyError, TypeError or
+    ValueError if the message is malformed.
+    """
+    # Docked message, containing information about the station
+    # Report system and station if the station contains a market
+    if not message.get('StationServices', None):
+        return None
+    if not "commodities" in message['StationServices']:
+        return None
+    
+    stationType = message["StationType"].lower()
+    if stationType == "fleetcarrier":
+        # Do not parse fleet carrier messages.
+        return None
+    planetary = "Y" if stationType in ("surfacestation","craterport","crateroutpost",) else "N"
+    maxPadSize = "M" if stationType.startswith("outpost") else "L"
+    fleet = "Y" if stationType == "fleetcarrier" else "N"
+    odyssey = "Y" if stationType == "onfootsettlement" else "N"
+    
+    stnServices = [x.lower() for x in message['StationServices']]
+    def getYNfromService(obj, key):
+        return "Y" if key in obj else "N"
+    
+    systemPos = message['StarPos']
+    return DockedMessage(
+        systemName=message['StarSystem'],
+        systemPos=(systemPos[0], systemPos[1], systemPos[2]),
+        stationName=message['StationName'],
+        lsFromStar=int(message["DistFromStarLS"] + 0.5),
+        market=getYNfromService(stnServices, 'commodities'),
+        blackMarket=getYNfromService(stnServices, 'blackmarket'),
+        shipyard=getYNfromService(stnServices, 'shipyard'),
+        maxPadSize=maxPadSize,
+        outfitting=getYNfromService(stnServices, 'outfitting'),
+        rearm=getYNfromService(stnServices, 'rearm'),
+        refuel=getYNfromService(stnServices, 'refuel'),
+        repair=getYNfromService(stnServices, 'repair'),
+        planetary=planetary,
+        fleet=fleet,
+        odyssey=odyssey,
+        timestamp=getTimeStamp(message['timestamp']),
+    )
+
+def decodeRaw(raw, authorisedSoftwares, excludedSoftwares, debug=False):
+    """
+    Inflates and parses a message as received from EDDN, returning
+    (decoded, seconds) where decoded is the CommodityMessage or
+    DockedMessage, or None if the message is ignored, and seconds is
+    how long that took. Runs on the decoding executor.
+    """
+    started = time.perf_counter()
+    data = simplejson.loads(zlib.decompress(raw))
+    
+    decoded = None
+    software = data['header']['softwareName']
+    # Check authorisation and exclusion, and only process messages
+    # from the Odyssey version of the game. Ignore legacay information
+    if software in authorisedSoftwares and software not in excludedSoftwares \
+            and data['message'].get('odyssey', False):
+        suffix = '/test' if debug else ''
+        # Handle commodity v3
+        if data['$schemaRef'] == 'https://eddn.edcd.io/schemas/commodity/3' + suffix:
+            decoded = decodeCommodity(data['message'])
+        
+        # Handle journal entries ("docked" contain required system and station information)
+        if data['$schemaRef'] == 'https://eddn.edcd.io/schemas/journal/1' + suffix:
+            if data['message']['event'] == 'Docked':
+                decoded = decodeDocked(data['message'])
+    
+    return decoded, time.perf_counter() - started
 
-        def importCommodityToTradeDB(message, station):
-            items=[]
-            timestamp = getTimeStamp(message['timestamp'])
+"""
+ "  Metrics
+"""
+class IngestMetrics(object):
+    """
+    Counters for the ingestion pipeline. Each counter is only updated
+    from one thread, the receiving loop or the writer.
+    
+    Attributes:
+        received, decoded, ignored, errors
+            Messages received, decoded into something to write,
+            ignored (not a market or filtered out) or that failed,
+        parseSeconds, parseMax
+            Total and longest time spent inflating and parsing,
+        commits, committedStations, commitSeconds, commitMax
+            Batches committed, stations whose prices they wrote, and
+            the total and longest time spent writing them,
+        queues
+            Dictionary of name -> queue whose depth is reported.
+    """
+    
+    def __init__(self):
+        self.received = self.decoded = self.ignored = self.errors = 0
+        self.parseSeconds = self.parseMax = 0.
+        self.commits = self.committedStations = 0
+        self.commitSeconds = self.commitMax = 0.
+        self.queues = {}
+        self.lastTime, self.lastReceived = time.monotonic(), 0
+    
+    def parsed(self, decoded, seconds):
+        self.parseSeconds += seconds
+        self.parseMax = max(self.parseMax, seconds)
+        if decoded:
+            self.decoded += 1
+        else:
+            self.ignored += 1
+    
+    def committed(self, stations, seconds):
+        self.commits += 1
+        self.committedStations += stations
+        self.commitSeconds += seconds
+        self.commitMax = max(self.commitMax, seconds)
+    
+    def snapshot(self):
+        """
+        Returns a dictionary of the counters, plus the rate messages
+        were received at since the previous snapshot, the depth of each
+        queue and average/longest latencies in milliseconds.
+        """
+        now = time.monotonic()
+        elapsed = now - self.lastTime
+        rate = (self.received - self.lastReceived) / elapsed if elapsed > 0 else 0.
+        self.lastTime, self.lastReceived = now, self.received
+        parsed = self.decoded + self.ignored
+        return {
+            'received': self.received,
+            'decoded': self.decoded,
+            'ignored': self.ignored,
+            'errors': self.errors,
+            'messagesPerSecond': rate,
+            'queueDepth': {name: q.qsize() for name, q in self.queues.items()},
+            'parseLatencyMs': self.parseSeconds * 1000 / parsed if parsed else 0.,
+            'parseMaxMs': self.parseMax * 1000,
+            'commits': self.commits,
+            'committedStations': self.committedStations,
+            'commitLatencyMs': self.commitSeconds * 1000 / self.commits if self.commits else 0.,
+            'commitMaxMs': self.commitMax * 1000,
+        }
+    
+    def summary(self):
+        """ One line version of snapshot() for the log. """
+        snap = self.snapshot()
+        return (
+            "{messagesPerSecond:.1f} msg/s, {received} received, {decoded} decoded, "
+            "{errors} errors, queues {queues}, "
+            "parse {parseLatencyMs:.2f}ms (max {parseMaxMs:.1f}ms), "
+            "{commits} commits of {committedStations} stations, "
+            "commit {commitLatencyMs:.1f}ms (max {commitMaxMs:.1f}ms)"
+        ).format(
+            queues='/'.join(str(depth) for depth in snap['queueDepth'].values()) or '-',
+            **snap
+        )
 
-            for commodity in message['commodities']:
-                itemName = commodity['name']
+"""
+ "  Writing, done on the writer's thread
+"""
+class MessageWriter(threading.Thread):
+    """
+    Applies decoded messages to the database on its own thread, so the
+    receiving thread never waits on SQLite.
+    
+    Prices are coalesced per station, newest message wins, and written
+    along with any system/station changes in a single transaction once
+    batchStations stations have changed or batchSeconds have passed
+    since the first uncommitted change. The database is switched to
+    WAL so readers aren't blocked while a batch is written.
+    """
+    
+    def __init__(self, tdenv, queueSize, batchStations, batchSeconds, errorLogFile=None, quiet=False, metrics=None):
+        super().__init__(name="EDDN writer", daemon=True)
+        self.tdenv = tdenv
+        self.queue = queue.Queue(queueSize)
+        self.metrics = metrics
+        if metrics:
+            metrics.queues['write'] = self.queue
+        self.batchStations = batchStations
+        self.batchSeconds = batchSeconds
+        self.errorLogFile = errorLogFile
+        self.quiet = quiet
+        self.tdb = None
+        # station ID -> (station, CommodityMessage) waiting to be written
+        self.pending = {}
+        # system/station changes made since the last commit
+        self.changes = 0
+        # time.monotonic() by which the current batch must be committed
+        self.deadline = None
+        # item name -> item ID, or None if the item can't be added
+        self.itemIDs = {}
+    
+    def put(self, message):
+        """
+        Queues a decoded message, waiting while the queue is full.
+        Raises RuntimeError if the writer has stopped.
+        """
+        while True:
+            if not self.is_alive():
+                raise RuntimeError("EDDN writer has stopped")
+            try:
+                self.queue.put(message, timeout=1)
+                return
+            except queue.Full:
+                pass
+    
+    def stop(self):
+        """ Writes what's pending and waits for the writer to finish. """
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+    
+    def run(self):
+        # The connection belongs to the thread that opens it.
+        self.tdb = tdb = TradeDB(self.tdenv)
+        self.prepareDB()
+        try:
+            while True:
+                cleanupDb(tdb, self.flush) # Cleanup regularily
+                timeout = None
+                if self.deadline is not None:
+                    timeout = max(self.deadline - time.monotonic(), 0)
                 try:
-                    item = tdb.lookupItem(itemName, createNonExisting=True)
-                except (LookupError, AmbiguityError) as err:
-                    echoLog("Adding {} failed: {}".format(itemName, err.__str__()))
+                    message = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    self.flush()
                     continue
-                
-                if commodity['demandBracket'] == "": demandBracket = -1
-                else: demandBracket = commodity['demandBracket']
-                if commodity['stockBracket'] == "": stockBracket = -1
-                else: stockBracket = commodity['stockBracket']
-                items.append((
-                    station.ID, item.ID, timestamp,
-                    commodity['sellPrice'], commodity['demand'], demandBracket,
-                    commodity['buyPrice'], commodity['stock'], stockBracket
-            ))
-            
-            # Remove old entries
-            tdb.getDB().execute("DELETE FROM StationItem WHERE station_id = {:d}".format(station.ID))
-            # Add the items from the log
-            tdb.getDB().executemany("""
-                    INSERT OR REPLACE INTO StationItem (
-                        station_id, item_id, modified,
-                        demand_price, demand_units, demand_level,
-                        supply_price, supply_units, supply_level
-                    ) VALUES (
-                        ?, ?, IFNULL(?, CURRENT_TIMESTAMP),
-                        ?, ?, ?,
-                        ?, ?, ?
-                    )
-                """, items)
-            tdb.getDB().commit()
-        
+                if message is None:
+                    break
+                try:
+                    self.apply(message)
+                except Exception as error:
+                    self.logError(error)
+                if len(self.pending) + self.changes >= self.batchStations:
+                    self.flush()
+                elif self.deadline is None and (self.pending or self.changes):
+                    self.deadline = time.monotonic() + self.batchSeconds
+        finally:
+            self.flush()
+            tdb.close()
+    
+    def prepareDB(self):
+        db = self.tdb.getDB()
+        db.execute("PRAGMA journal_mode=WAL")
+        # WAL stays consistent without syncing every commit.
+        db.execute("PRAGMA synchronous=NORMAL")
+    
+    def logError(self, error):
+        echoLog(error.__str__())
+        if self.errorLogFile:
+            echoFile(self.errorLogFile, error.__str__())
+    
+    def apply(self, message):
+        if isinstance(message, CommodityMessage):
+            self.applyCommodity(message)
+        elif isinstance(message, DockedMessage):
+            self.applyDocked(message)
+        else:
+            raise TypeError("Unexpected message: {!r}".format(message))
+    
+    def applyCommodity(self, message):
+        tdb = self.tdb
         try:
-            system = tdb.lookupSystem(message['systemName'], exactOnly=True)
-            station = tdb.lookupStation(message['stationName'], system, exactOnly=True)
-            importCommodityToTradeDB(message, station)
-            if not eddnConnectorQuiet:
-                echoLog('- Updated prices for: ' + message['systemName'] + " / " + message['stationName'])
+            system = tdb.lookupSystem(message.systemName, exactOnly=True)
+            station = tdb.lookupStation(message.stationName, system, exactOnly=True)
         except LookupError:
             #exportCommodityToPricesFile(message)
-            #echoLog('- Exported prices for: ' + message['systemName'] + " / " + message['stationName'])
-            if not eddnConnectorQuiet:
-                echoLog('- Ignore prices for unknown station: ' + message['systemName'] + " / " + message['stationName'])
-
-    def parseMessageDocked(message):
-        # Docked message, containing information about the station
-        # Report system and station if the station contains a market
-        if not message.get('StationServices', None):
+            #echoLog('- Exported prices for: ' + message.systemName + " / " + message.stationName)
+            if not self.quiet:
+                echoLog('- Ignore prices for unknown station: ' + message.systemName + " / " + message.stationName)
             return
-        if not "commodities" in message['StationServices']:
-            return
-
-        systemName = message['StarSystem']
-        systemPos = message['StarPos']
-        stationName = message['StationName']
-        stationType = message["StationType"].lower()
-        lsFromStar = int(message["DistFromStarLS"] + 0.5)
-        planetary = "Y" if stationType in ("surfacestation","craterport","crateroutpost",) else "N"
-        maxPadSize = "M" if stationType.startswith("outpost") else "L"
-        if stationType == "fleetcarrier":
-            # Do not parse fleet carrier messages.
+        
+        waiting = self.pending.get(station.ID)
+        if waiting and waiting[1].timestamp > message.timestamp:
+            # We already have newer prices for this station.
             return
-        fleet = "Y" if stationType == "fleetcarrier" else "N"
-        odyssey = "Y" if stationType == "onfootsettlement" else "N"
-
-        stnServices = [x.lower() for x in message.get('StationServices', None)]
-        def getYNfromService(obj, key):
-            return "Y" if key in obj else "N"
-        blackmarket = getYNfromService(stnServices, 'blackmarket')
-        market = getYNfromService(stnServices, 'commodities')
-        shipyard = getYNfromService(stnServices, 'shipyard')
-        outfitting = getYNfromService(stnServices, 'outfitting')
-        rearm = getYNfromService(stnServices, 'rearm')
-        refuel = getYNfromService(stnServices, 'refuel')
-        repair = getYNfromService(stnServices, 'repair')
-
-        timestamp = getTimeStamp(message['timestamp'])
+        self.pending[station.ID] = (station, message)
+    
+    def applyDocked(self, message):
+        tdb = self.tdb
+        x, y, z = message.systemPos
         
         sysNew=sysUpdate=False
         try:
-            system = tdb.lookupSystem(systemName, exactOnly=True)
-            sysUpdate = tdb.updateLocalSystem(system=system,prettyName=systemName,x=systemPos[0],y=systemPos[1],z=systemPos[2])
+            system = tdb.lookupSystem(message.systemName, exactOnly=True)
+            sysUpdate = tdb.updateLocalSystem(system=system,prettyName=message.systemName,x=x,y=y,z=z,commit=False)
         except LookupError:
-            tdb.addLocalSystem(prettyName=systemName,x=systemPos[0],y=systemPos[1],z=systemPos[2])
-            system = tdb.lookupSystem(systemName, exactOnly=True)
+            system = tdb.addLocalSystem(prettyName=message.systemName,x=x,y=y,z=z,commit=False)
             sysNew=True
         
         statNew=statUpdate=False
         try:
-            station = tdb.lookupStation(stationName, system, exactOnly=True)
-            statUpdate = tdb.updateLocalStation(station=station, lsFromStar=None, market=market,
-                blackMarket=blackmarket, shipyard=shipyard, maxPadSize=maxPadSize, outfitting=outfitting,
-                rearm=rearm, refuel=refuel, repair=repair, planetary=planetary, fleet=fleet, odyssey=odyssey
+            station = tdb.lookupStation(message.stationName, system, exactOnly=True)
+            statUpdate = tdb.updateLocalStation(station=station, lsFromStar=None, market=message.market,
+                blackMarket=message.blackMarket, shipyard=message.shipyard, maxPadSize=message.maxPadSize,
+                outfitting=message.outfitting, rearm=message.rearm, refuel=message.refuel, repair=message.repair,
+                planetary=message.planetary, fleet=message.fleet, odyssey=message.odyssey, commit=False
             )
         except LookupError:
-            tdb.addLocalStation( system=system, prettyName=stationName, lsFromStar=lsFromStar, market=market,
-                blackMarket=blackmarket, shipyard=shipyard, maxPadSize=maxPadSize, outfitting=outfitting,
-                rearm=rearm, refuel=refuel, repair=repair, planetary=planetary, fleet=fleet,
-                odyssey=odyssey, modified=timestamp, commit=True
+            station = tdb.addLocalStation( system=system, prettyName=message.stationName, lsFromStar=message.lsFromStar,
+                market=message.market, blackMarket=message.blackMarket, shipyard=message.shipyard,
+                maxPadSize=message.maxPadSize, outfitting=message.outfitting, rearm=message.rearm,
+                refuel=message.refuel, repair=message.repair, planetary=message.planetary, fleet=message.fleet,
+                odyssey=message.odyssey, modified=message.timestamp, commit=False
             )
-            station = tdb.lookupStation(name=stationName, system=system, exactOnly=True)
             statNew=True
         
-        if (sysNew or statNew) and not eddnConnectorQuiet:
+        if sysNew or statNew or sysUpdate or statUpdate:
+            self.changes += 1
+        if (sysNew or statNew) and not self.quiet:
             echoLog("Created {}{} / {}{}.".format(
                 system.name(),
                 " (new)" if sysNew else "",
                 station.name(),
                 " (new)" if statNew else ""
                 ))
-        if (sysUpdate or statUpdate) and not eddnConnectorQuiet:
+        if (sysUpdate or statUpdate) and not self.quiet:
             echoLog("Updated {} / {}.".format(system.name(), station.name()))
-
-    global exitGracefully
-    while not exitGracefully:
+    
+    def itemID(self, itemName):
+        """
+        Returns the ID of the named item, adding it if it's new, or None
+        if it can't be added. Only the first failure for a name is logged.
+        """
         try:
-            subscriber.connect(__relayEDDN)
-            echoLog('Connect to ' + __relayEDDN)
-            echoLog('')
-            echoLog('')
-
-            while not exitGracefully:
-                cleanupDb(tdb) # Cleanup regularily
-                __message   = subscriber.recv()
-
-                if __message == False:
-                    subscriber.disconnect(__relayEDDN)
-                    echoLog('Disconnect from ' + __relayEDDN)
-                    echoLog('')
-                    echoLog('')
-                    break
-
-                __message   = zlib.decompress(__message)
-                if __message == False:
-                    echoLog('Failed to decompress message')
-
-                __json      = simplejson.loads(__message)
-                if __json == False:
-                    echoLog('Failed to parse message as json')
-                
-                # Check authorisation and exclusion
-                if __json['header']['softwareName'] in __excludedSoftwares:
-                    continue
-                if not __json['header']['softwareName'] in __authorisedSoftwares:
-                    continue
+            return self.itemIDs[itemName]
+        except KeyError:
+            pass
+        try:
+            itemID = self.tdb.lookupItem(itemName, createNonExisting=True).ID
+        except (LookupError, AmbiguityError, AttributeError) as err:
+            echoLog("Adding {} failed: {}".format(itemName, err.__str__()))
+            itemID = None
+        self.itemIDs[itemName] = itemID
+        return itemID
+    
+    def flush(self):
+        """ Writes the pending prices and commits everything. """
+        self.deadline = None
+        if not self.pending and not self.changes:
+            return
+        pending, self.pending, self.changes = self.pending, {}, 0
+        
+        items = []
+        for stationID, (station, message) in pending.items():
+            for itemName, *prices in message.prices:
+                itemID = self.itemID(itemName)
+                if itemID is not None:
+                    items.append((stationID, itemID, message.timestamp, *prices))
+        
+        db = self.tdb.getDB()
+        started = time.perf_counter()
+        try:
+            # Remove old entries
+            db.executemany(
+                "DELETE FROM StationItem WHERE station_id = ?",
+                [(stationID,) for stationID in pending]
+            )
+            # Add the items from the messages
+            db.executemany("""
+                    INSERT OR REPLACE INTO StationItem (
+                        station_id, item_id, modified,
+                        demand_price, demand_units, demand_level,
+                        supply_price, supply_units, supply_level
+                    ) VALUES (
+                        ?, ?, IFNULL(?, CURRENT_TIMESTAMP),
+                        ?, ?, ?,
+                        ?, ?, ?
+                    )
+                """, items)
+            db.commit()
+        except Exception as error:
+            db.rollback()
+            self.logError(error)
+            # Forget anything added in memory by the rolled back batch.
+            self.itemIDs.clear()
+            self.tdb.close()
+            self.tdb.load()
+            self.prepareDB()
+            return
+        
+        if self.metrics:
+            self.metrics.committed(len(pending), time.perf_counter() - started)
+        if not self.quiet:
+            for station, message in pending.values():
+                echoLog('- Updated prices for: ' + message.systemName + " / " + message.stationName)
 
-                # Only process messages from the Odyssey version of the game.
-                # Ignore legacay information
-                if not __json['message'].get('odyssey', False):
-                    continue
+"""
+ "  Receiving
+"""
+class Subscriber(object):
+    """
+    Receives messages from an EDDN relay with zmq.asyncio and feeds
+    them to a MessageWriter.
+    
+    Each message is handed to the executor to be inflated and parsed
+    as soon as it arrives, and the results are passed on to the writer
+    in the order they were received. Once queueSize messages are being
+    decoded, or the writer's queue is full, receiving waits and the
+    messages back up at the relay instead.
+    """
+    
+    def __init__(
+            self, writer, relay,
+            authorisedSoftwares, excludedSoftwares, debug=False,
+            executor=None, queueSize=1000, timeout=600.,
+            metrics=None, metricsSeconds=None, errorLogFile=None,
+            ):
+        self.writer = writer
+        self.relay = relay
+        self.decodeArgs = (authorisedSoftwares, excludedSoftwares, debug)
+        self.executor = executor
+        self.queueSize = queueSize
+        self.timeout = timeout
+        self.metrics = metrics or IngestMetrics()
+        self.metricsSeconds = metricsSeconds
+        self.errorLogFile = errorLogFile
+        self.context = zmq.asyncio.Context()
+    
+    def logError(self, error):
+        echoLog(error.__str__())
+        if self.errorLogFile:
+            echoFile(self.errorLogFile, error.__str__())
+    
+    async def run(self):
+        """
+        Receives until cancelled, then waits for the messages already
+        received to reach the writer. Raises RuntimeError if the writer
+        stops.
+        """
+        decoding = asyncio.Queue(self.queueSize)
+        self.metrics.queues['decode'] = decoding
+        receiver = asyncio.current_task()
+        def writerStopped(_):
+            receiver.cancel()
+        forwarder = asyncio.ensure_future(self.forward(decoding))
+        forwarder.add_done_callback(writerStopped)
+        reporter = None
+        if self.metricsSeconds:
+            reporter = asyncio.ensure_future(self.report(self.metricsSeconds))
+        try:
+            await self.receive(decoding)
+        finally:
+            if not forwarder.done():
+                await decoding.join()
+            forwarder.remove_done_callback(writerStopped)
+            error = None
+            if forwarder.done() and not forwarder.cancelled():
+                error = forwarder.exception()
+            forwarder.cancel()
+            if reporter:
+                reporter.cancel()
+            self.context.term()
+            if error:
+                raise error
+    
+    async def receive(self, decoding):
+        loop = asyncio.get_running_loop()
+        metrics = self.metrics
+        while True:
+            subscriber = self.context.socket(zmq.SUB)
+            subscriber.setsockopt(zmq.SUBSCRIBE, b"")
+            subscriber.connect(self.relay)
+            echoLog('Connect to ' + self.relay)
+            retryDelay = 0
+            try:
+                while True:
+                    raw = await asyncio.wait_for(subscriber.recv(), self.timeout)
+                    metrics.received += 1
+                    await decoding.put(loop.run_in_executor(
+                        self.executor, decodeRaw, raw, *self.decodeArgs
+                    ))
+            except asyncio.TimeoutError:
+                echoLog('No messages for {}s'.format(self.timeout))
+            except zmq.ZMQError as e:
+                echoLog('ZMQSocketException: ' + str(e))
+                retryDelay = 5
+            finally:
+                subscriber.close(linger=0)
+                echoLog('Disconnect from ' + self.relay)
+            await asyncio.sleep(retryDelay)
+    
+    async def forward(self, decoding):
+        loop = asyncio.get_running_loop()
+        metrics, writer = self.metrics, self.writer
+        while True:
+            future = await decoding.get()
+            try:
+                decoded, seconds = await future
+            except Exception as error:
+                metrics.errors += 1
+                self.logError(error)
+                decoded = None
+            else:
+                metrics.parsed(decoded, seconds)
+            finally:
+                decoding.task_done()
+            if not decoded:
+                continue
+            if not writer.is_alive():
+                raise RuntimeError("EDDN writer has stopped")
+            try:
+                writer.queue.put_nowait(decoded)
+            except queue.Full:
+                # Wait for the writer without holding up the loop.
+                await loop.run_in_executor(None, writer.put, decoded)
+    
+    async def report(self, seconds):
+        while True:
+            await asyncio.sleep(seconds)
+            echoLog(self.metrics.summary())
+
+async def listen(subscriber):
+    """ Runs the subscriber until SIGINT/SIGTERM. """
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    def stop():
+        print('SIGINT/SIGTERM capturede, exiting gracefully.')
+        task.cancel()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop)
+        except NotImplementedError:
+            # No add_signal_handler on Windows
+            signal.signal(sig, lambda sig, frame: loop.call_soon_threadsafe(stop))
+    try:
+        await subscriber.run()
+    except asyncio.CancelledError:
+        pass
 
-                try:
-                    # Handle commodity v3
-                    if __json['$schemaRef'] == 'https://eddn.edcd.io/schemas/commodity/3' + ('/test' if (__debugEDDN == True) else ''):
-                        parseMessageCommodity(__json['message'])
-                    
-                    # Handle journal entries ("docked" contain required system and station information)
-                    if __json['$schemaRef'] == 'https://eddn.edcd.io/schemas/journal/1' + ('/test' if (__debugEDDN == True) else ''):
-                        if __json['message']['event'] == 'Docked':
-                            parseMessageDocked(__json['message'])
-                
-                except Exception as error:
-                    echoLog(error.__str__())
-                    echoFile(__errorLogFile, error.__str__())
-
-        except zmq.ZMQError as e:
-            echoLog('')
-            echoLog('ZMQSocketException: ' + str(e))
-            subscriber.disconnect(__relayEDDN)
-            echoLog('Disconnect from ' + __relayEDDN)
-            echoLog('')
-            time.sleep(5)
+def main():
+    eddnConnectorQuiet=os.environ.get('EDDN_CONNECTOR_QUIET') or False
+    echoLog('Starting EDDN Subscriber')
+    echoLog('')
+    
+    metrics = IngestMetrics()
+    # The writer gets the TradeDB object only once per runtime
+    writer = MessageWriter(
+        TradeEnv(quiet=1), __queueSize, __batchStations, __batchSeconds,
+        errorLogFile=__errorLogFile, quiet=eddnConnectorQuiet, metrics=metrics,
+    )
+    writer.start()
+    
+    if __decodeProcesses:
+        executor = ProcessPoolExecutor(__decodeWorkers)
+    else:
+        executor = ThreadPoolExecutor(__decodeWorkers)
+    subscriber = Subscriber(
+        writer, __relayEDDN, __authorisedSoftwares, __excludedSoftwares,
+        debug=__debugEDDN, executor=executor, queueSize=__queueSize,
+        timeout=__timeoutEDDN / 1000, metrics=metrics,
+        metricsSeconds=None if eddnConnectorQuiet else __metricsSeconds,
+        errorLogFile=__errorLogFile,
+    )
+    try:
+        asyncio.run(listen(subscriber))
+    finally:
+        executor.shutdown()
+        # Write whatever is still queued.
+        writer.stop()
+        echoLog(metrics.summary())
 
 
 
@@ -0,0 +1,293 @@
+# --------------------------------------------------------------------
+# Copyright (C) Oliver 'kfsone' Smith 2014 <oliver@kfs.org>:
+# Copyright (C) Bernd 'Gazelle' Gollesch 2016, 2017
+# Copyright (C) Jonathan 'eyeonus' Jones 2018, 2019
+#
+# You are free to use, redistribute, or even print and eat a copy of
+# this software so long as you include this copyright notice.
+# I guarantee there is at least one bug neither of us knew about.
+# --------------------------------------------------------------------
+# TradeDangerous :: Modules :: Precomputed jump graph
+
+"""
+JumpGraph is a precomputed table of which systems are within jump
+range of each other, stored in a binary sidecar next to the .db
+(TradeDangerous.jumps) and memory-mapped when TradeDB loads.
+
+For every system, the neighbours within the largest configured tier
+are stored in CSR form (offsets + neighbour indexes + float32
+distances), sorted by distance. Each smaller tier is simply a prefix
+of that list, and its length per system is recorded too.
+
+File layout (all little-endian, each array 8-byte aligned):
+    magic               b'TDJUMPS\\0'
+    headerLen           uint32, length of the JSON header
+    header              {"version", "systems", "tiers", "neighbours"}
+    systemIDs           int64[systems], sorted
+    positions           float64[systems, 3]
+    offsets             int64[systems + 1]
+    tierEnds            int32[tiers, systems]
+    neighbours          int32[neighbours], index into systemIDs
+    distances           float32[neighbours]
+
+The system IDs and positions let TradeDB tell when the sidecar no
+longer matches the System table, in which case it is ignored.
+"""
+
+######################################################################
+# Imports
+
+import json
+import os
+import struct
+
+import numpy
+
+######################################################################
+# Classes
+
+
+class JumpGraph(object):
+    """
+    Memory-mapped neighbour lists for the systems in a TradeDB.
+    
+    Attributes:
+        path
+            Path of the sidecar file,
+        tiers
+            Sorted list of the jump ranges (ly) the graph was built for,
+        maxLy
+            The largest tier; queries beyond this can't be answered,
+        systemIDs, positions, offsets, tierEnds, neighbours, distances
+            The (read-only) arrays described in the module docstring.
+    """
+    
+    magic = b'TDJUMPS\0'
+    version = 1
+    
+    # Default tiers built by "buildcache --jump-tiers" with no value.
+    defaultTiers = (10, 15, 20, 25, 30, 40)
+    
+    # Systems per distance matrix when building.
+    blockSize = 256
+    
+    def __init__(self, path):
+        self.path = path
+        with open(str(path), 'rb') as fh:
+            magic = fh.read(len(self.magic))
+            if magic != self.magic:
+                raise ValueError("{}: not a jump graph".format(path))
+            headerLen, = struct.unpack('<I', fh.read(4))
+            header = json.loads(fh.read(headerLen).decode())
+        if header.get('version') != self.version:
+            raise ValueError("{}: unsupported version".format(path))
+        
+        numSystems = header['systems']
+        self.tiers = header['tiers']
+        self.maxLy = self.tiers[-1]
+        
+        offset = _align(len(self.magic) + 4 + headerLen)
+        arrays = {}
+        for name, dtype, shape in _layout(
+                numSystems, len(self.tiers), header['neighbours']
+                ):
+            count = int(numpy.prod(shape))
+            if count:
+                arrays[name] = numpy.memmap(
+                    str(path), dtype=dtype, mode='r',
+                    offset=offset, shape=shape,
+                )
+            else:
+                arrays[name] = numpy.zeros(shape, dtype=dtype)
+            offset = _align(offset + count * numpy.dtype(dtype).itemsize)
+        
+        self.systemIDs = arrays['systemIDs']
+        self.positions = arrays['positions']
+        self.offsets = arrays['offsets']
+        self.tierEnds = arrays['tierEnds']
+        self.neighbours = arrays['neighbours']
+        self.distances = arrays['distances']
+    
+    def __len__(self):
+        return len(self.systemIDs)
+    
+    def matches(self, systemIDs, positions):
+        """
+        True if the graph was built for exactly these (sorted) system
+        IDs at these positions.
+        """
+        return (
+            numpy.array_equal(self.systemIDs, systemIDs) and
+            numpy.array_equal(self.positions, positions)
+        )
+    
+    def neighboursOf(self, index, ly):
+        """
+        Returns a list of (index, distLy) for the systems within ly of
+        the system at row index, ordered by distance. Distances are
+        recalculated at full precision, the same way as
+        TradeDB.genStellarGrid, so that they agree exactly.
+        
+        ly must not exceed maxLy.
+        """
+        assert ly <= self.maxLy
+        start = int(self.offsets[index])
+        try:
+            tier = self.tiers.index(ly)
+            stop = start + int(self.tierEnds[tier, index])
+        except ValueError:
+            # Allow for float32 rounding; exact distances trim it below.
+            stop = int(self.offsets[index + 1])
+            stop = start + int(numpy.searchsorted(
+                self.distances[start:stop], ly * 1.000001, side='right'
+            ))
+        
+        indexes = numpy.asarray(self.neighbours[start:stop])
+        positions = self.positions
+        delta = positions[indexes] - positions[index]
+        distSq = (
+            delta[:, 0] * delta[:, 0] +
+            delta[:, 1] * delta[:, 1] +
+            delta[:, 2] * delta[:, 2]
+        )
+        order = numpy.argsort(distSq, kind='stable')
+        lySq = ly ** 2
+        # Python's ** 0.5 doesn't always round the same as numpy.sqrt.
+        return [
+            (neighbour, dist ** 0.5)
+            for neighbour, dist in zip(
+                indexes[order].tolist(), distSq[order].tolist()
+            )
+            if dist <= lySq
+        ]
+    
+    @classmethod
+    def build(cls, path, systemIDs, positions, tiers):
+        """
+        Calculates the neighbour lists for the given systems and writes
+        them to path.
+        
+        systemIDs must be sorted and positions the matching (N, 3)
+        array of coordinates.
+        """
+        tiers = sorted(set(float(ly) for ly in tiers))
+        if not tiers or tiers[0] <= 0:
+            raise ValueError("jump tiers must be positive")
+        maxLy = tiers[-1]
+        systemIDs = numpy.ascontiguousarray(systemIDs, dtype=numpy.int64)
+        positions = numpy.ascontiguousarray(positions, dtype=numpy.float64)
+        numSystems = len(systemIDs)
+        
+        # Bucket the systems into a grid of maxLy cubes, so that all the
+        # neighbours of a system are in its own or an adjacent cell.
+        cells = numpy.floor(positions / maxLy).astype(numpy.int64)
+        cellMap = {}
+        for index, cell in enumerate(map(tuple, cells.tolist())):
+            cellMap.setdefault(cell, []).append(index)
+        cellMap = {
+            cell: numpy.array(members, dtype=numpy.int64)
+            for cell, members in cellMap.items()
+        }
+        
+        adjacent = [
+            (dx, dy, dz)
+            for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+        ]
+        lists = [None] * numSystems
+        for (cx, cy, cz), members in cellMap.items():
+            candidates = [
+                cellMap[(cx + dx, cy + dy, cz + dz)]
+                for dx, dy, dz in adjacent
+                if (cx + dx, cy + dy, cz + dz) in cellMap
+            ]
+            candidates = numpy.concatenate(candidates)
+            candPositions = positions[candidates]
+            # Work through the cell in blocks to bound the matrix size.
+            for first in range(0, len(members), cls.blockSize):
+                block = members[first:first + cls.blockSize]
+                delta = candPositions[None, :, :] - positions[block][:, None, :]
+                distSq = (
+                    delta[:, :, 0] * delta[:, :, 0] +
+                    delta[:, :, 1] * delta[:, :, 1] +
+                    delta[:, :, 2] * delta[:, :, 2]
+                )
+                inRange = distSq <= maxLy ** 2
+                inRange &= candidates[None, :] != block[:, None]
+                for row, index in enumerate(block.tolist()):
+                    found = candidates[inRange[row]]
+                    foundSq = distSq[row][inRange[row]]
+                    order = numpy.argsort(foundSq, kind='stable')
+                    lists[index] = (found[order], foundSq[order])
+        
+        counts = numpy.array(
+            [len(found) for found, _ in lists], dtype=numpy.int64
+        )
+        offsets = numpy.zeros(numSystems + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=offsets[1:])
+        if numSystems:
+            neighbours = numpy.concatenate([found for found, _ in lists])
+            distances = numpy.sqrt(
+                numpy.concatenate([foundSq for _, foundSq in lists])
+            )
+        else:
+            neighbours = numpy.zeros(0, dtype=numpy.int64)
+            distances = numpy.zeros(0, dtype=numpy.float64)
+        tierEnds = numpy.array([
+            [
+                numpy.searchsorted(foundSq, ly ** 2, side='right')
+                for _, foundSq in lists
+            ]
+            for ly in tiers
+        ], dtype=numpy.int32).reshape(len(tiers), numSystems)
+        
+        header = json.dumps({
+            'version': cls.version,
+            'systems': numSystems,
+            'tiers': tiers,
+            'neighbours': len(neighbours),
+        }).encode()
+        data = {
+            'systemIDs': systemIDs,
+            'positions': positions,
+            'offsets': offsets,
+            'tierEnds': tierEnds,
+            'neighbours': neighbours,
+            'distances': distances,
+        }
+        
+        # Write to a temporary file so readers never see a partial graph.
+        tmpPath = str(path) + '.tmp'
+        with open(tmpPath, 'wb') as fh:
+            fh.write(cls.magic)
+            fh.write(struct.pack('<I', len(header)))
+            fh.write(header)
+            for name, dtype, shape in _layout(
+                    numSystems, len(tiers), len(neighbours)
+                    ):
+                fh.write(b'\0' * (_align(fh.tell()) - fh.tell()))
+                fh.write(numpy.ascontiguousarray(
+                    data[name], dtype=dtype
+                ).reshape(shape).tobytes())
+        os.replace(tmpPath, str(path))
+        
+        return cls(path)
+
+
+######################################################################
+# Helpers
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _layout(numSystems, numTiers, numNeighbours):
+    """ (name, dtype, shape) of each array, in file order. """
+    return (
+        ('systemIDs', '<i8', (numSystems,)),
+        ('positions', '<f8', (numSystems, 3)),
+        ('offsets', '<i8', (numSystems + 1,)),
+        ('tierEnds', '<i4', (numTiers, numSystems)),
+        ('neighbours', '<i4', (numNeighbours,)),
+        ('distances', '<f4', (numNeighbours,)),
+    )
@@ -0,0 +1,194 @@
+# --------------------------------------------------------------------
+# Copyright (C) Oliver 'kfsone' Smith 2014 <oliver@kfs.org>:
+# Copyright (C) Bernd 'Gazelle' Gollesch 2016, 2017
+# Copyright (C) Jonathan 'eyeonus' Jones 2018, 2019
+#
+# You are free to use, redistribute, or even print and eat a copy of
+# this software so long as you include this copyright notice.
+# I guarantee there is at least one bug neither of us knew about.
+# --------------------------------------------------------------------
+# TradeDangerous :: Modules :: Landmark (ALT) route heuristics
+
+"""
+LandmarkTable holds, for a given maximum jump range, the shortest
+route length (in ly) from a handful of "landmark" systems to every
+other system.
+
+By the triangle inequality, for any landmark L the route length
+between two systems v and t is at least |d(L, t) - d(L, v)|, which is
+usually a much tighter bound than the straight-line distance when
+the jump range is close to the spacing between stars. TradeDB.getRoute
+uses this as its A* heuristic with the "alt" and "bidir" engines.
+
+Avoiding systems only removes jumps, which can only make routes
+longer, so the bounds stay valid for any avoidance list. Likewise a
+table built for a longer jump range is valid for any shorter one.
+
+Tables are built by "trade buildcache --landmarks" and saved next to
+the .db (TradeDangerous.landmarks-<ly>.npz) along with the system IDs
+and positions they were built for.
+"""
+
+######################################################################
+# Imports
+
+import heapq
+
+import numpy
+
+######################################################################
+# Classes
+
+
+class LandmarkTable(object):
+    """
+    Landmark distances for one maximum jump range.
+    
+    Attributes:
+        maxLy
+            The jump range the table was built for,
+        systemIDs, positions
+            The systems the table was built for,
+        landmarks
+            Row numbers (into systemIDs) of the landmark systems,
+        distances
+            (landmarks, systems) array of route lengths from each
+            landmark; inf where a system can't be reached.
+    """
+    
+    # Suffix (formatted with maxLy) of the file beside the .db
+    suffix = '.landmarks-{:g}.npz'
+    
+    defaultCount = 8
+    
+    def __init__(self, maxLy, systemIDs, positions, landmarks, distances):
+        self.maxLy = float(maxLy)
+        self.systemIDs = systemIDs
+        self.positions = positions
+        self.landmarks = landmarks
+        self.distances = distances
+        self.rowByID = {ID: row for row, ID in enumerate(systemIDs.tolist())}
+        # Per-system lists of landmark distances, for the heuristic.
+        self._columns = None
+    
+    def matches(self, systemIDs, positions):
+        return (
+            numpy.array_equal(self.systemIDs, systemIDs) and
+            numpy.array_equal(self.positions, positions)
+        )
+    
+    def save(self, path):
+        with open(str(path), 'wb') as fh:
+            numpy.savez(
+                fh,
+                maxLy=self.maxLy,
+                systemIDs=self.systemIDs,
+                positions=self.positions,
+                landmarks=self.landmarks,
+                distances=self.distances,
+            )
+    
+    @classmethod
+    def load(cls, path):
+        with numpy.load(str(path)) as data:
+            return cls(
+                float(data['maxLy']),
+                data['systemIDs'], data['positions'],
+                data['landmarks'], data['distances'],
+            )
+    
+    @classmethod
+    def build(cls, maxLy, systemIDs, positions, neighbours, count=None):
+        """
+        Chooses landmarks and calculates their distance tables.
+        
+        neighbours(row) must yield (row, distLy) for the systems
+        within one jump of the system at row.
+        
+        The first landmark is the system farthest (by route) from the
+        system nearest the middle of the galaxy; each after that is
+        the system farthest from all the landmarks chosen so far.
+        """
+        count = count or cls.defaultCount
+        numSystems = len(systemIDs)
+        landmarks, tables = [], []
+        if numSystems:
+            middle = positions.mean(axis=0)
+            delta = positions - middle
+            start = int(numpy.argmin((delta * delta).sum(axis=1)))
+            nearest = _routeLengths(start, numSystems, neighbours)
+            # Any system the start can't reach is ignored from here on.
+            reachable = numpy.isfinite(nearest)
+            farthest = numpy.where(reachable, nearest, -1)
+            while len(landmarks) < min(count, int(reachable.sum())):
+                landmark = int(numpy.argmax(farthest))
+                landmarks.append(landmark)
+                table = _routeLengths(landmark, numSystems, neighbours)
+                tables.append(table)
+                if len(landmarks) == 1:
+                    farthest = numpy.where(reachable, table, -1)
+                else:
+                    farthest = numpy.minimum(farthest, table)
+                farthest[landmarks] = -1
+        distances = numpy.array(tables, dtype=numpy.float64).reshape(-1, numSystems)
+        return cls(
+            maxLy, systemIDs, positions,
+            numpy.array(landmarks, dtype=numpy.int64), distances,
+        )
+    
+    def lowerBound(self, target):
+        """
+        Returns a function taking a system ID and returning a lower
+        bound on the route length from that system to target, or
+        None if target isn't in the table.
+        
+        The bound is inf when the system can't reach target at all.
+        """
+        row = self.rowByID.get(target.ID, None)
+        if row is None or not len(self.landmarks):
+            return None
+        if self._columns is None:
+            self._columns = self.distances.T.tolist()
+        columns, rowByID = self._columns, self.rowByID
+        targetCol = columns[row]
+        
+        def bound(systemID):
+            row = rowByID.get(systemID, None)
+            if row is None:
+                return 0.
+            best = 0.
+            # inf - inf is nan, which never compares greater.
+            for dist, targetDist in zip(columns[row], targetCol):
+                diff = targetDist - dist
+                if diff < 0:
+                    diff = -diff
+                if diff > best:
+                    best = diff
+            return best
+        
+        return bound
+
+######################################################################
+# Helpers
+
+
+def _routeLengths(start, numSystems, neighbours):
+    """
+    Dijkstra from the system at row start; returns an array of route
+    lengths to every row, inf where unreachable.
+    """
+    inf = float('inf')
+    dist = [inf] * numSystems
+    dist[start] = 0.
+    openSet = [(0., start)]
+    heappop, heappush = heapq.heappop, heapq.heappush
+    while openSet:
+        curDist, row = heappop(openSet)
+        if curDist > dist[row]:
+            continue
+        for nRow, nDist in neighbours(row):
+            newDist = curDist + nDist
+            if newDist < dist[nRow]:
+                dist[nRow] = newDist
+                heappush(openSet, (newDist, nRow))
+    return numpy.array(dist, dtype=numpy.float64)
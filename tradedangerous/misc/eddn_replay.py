@@ -0,0 +1,151 @@
+#! /usr/bin/env python
+# Records messages from an EDDN relay and replays them from a local
+# zmq PUB socket, as a stand-in relay for testing eddn_connector.
+# Usage:
+#  misc/eddn_replay.py record FILE [--relay URI] [--count N]
+#  misc/eddn_replay.py replay FILE [--bind URI] [--speed X | --rate N]
+#                                  [--loop N] [--warmup SECS]
+# Recordings hold one (inflated) JSON message per line. By default they
+# are replayed with the gaps between their gatewayTimestamps, --speed
+# divides those gaps, --rate sends a fixed number per second instead.
+#
+# e.g. to load-test the connector at ten times the recorded rate:
+#  misc/eddn_replay.py replay eddn.jsonl --speed 10 &
+#  EDDN_RELAY=tcp://127.0.0.1:9500 eddn_connector
+
+import argparse
+import asyncio
+import json
+import time
+import zlib
+from datetime import datetime
+
+import zmq
+import zmq.asyncio
+
+
+def gatewayTime(line):
+    """ Returns the gatewayTimestamp of a recorded message in seconds, or None. """
+    try:
+        stamp = json.loads(line)['header']['gatewayTimestamp']
+    except (ValueError, KeyError, TypeError):
+        return None
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ'):
+        try:
+            return datetime.strptime(stamp, fmt).timestamp()
+        except ValueError:
+            pass
+    return None
+
+
+def loadRecording(path):
+    """
+    Returns the list of (gateway seconds or None, compressed message)
+    in a recording, compressed up front so that compressing doesn't
+    limit the replay rate.
+    """
+    messages = []
+    with open(path, 'r', encoding='utf-8') as fh:
+        for line in fh:
+            line = line.strip()
+            if line:
+                messages.append((gatewayTime(line), zlib.compress(line.encode())))
+    return messages
+
+
+def record(relay, path, count=None):
+    """ Appends messages from the relay to the recording at path. """
+    subscriber = zmq.Context.instance().socket(zmq.SUB)
+    subscriber.setsockopt(zmq.SUBSCRIBE, b"")
+    subscriber.connect(relay)
+    recorded = 0
+    try:
+        with open(path, 'a', encoding='utf-8') as fh:
+            while count is None or recorded < count:
+                fh.write(zlib.decompress(subscriber.recv()).decode() + '\n')
+                recorded += 1
+    finally:
+        subscriber.close(linger=0)
+    return recorded
+
+
+async def replay(publisher, messages, speed=None, rate=None):
+    """
+    Sends the (gateway seconds, compressed message)s on the publisher,
+    spaced by rate per second if given, otherwise at speed times their
+    recorded spacing, or as fast as possible if neither is given.
+    Returns the number sent.
+    """
+    started = time.monotonic()
+    firstTime = next((when for when, _ in messages if when is not None), None)
+    for sent, (when, message) in enumerate(messages):
+        due = None
+        if rate:
+            due = started + sent / rate
+        elif speed and when is not None and firstTime is not None:
+            due = started + (when - firstTime) / speed
+        if due is not None and due > time.monotonic():
+            await asyncio.sleep(due - time.monotonic())
+        await publisher.send(message)
+    return len(messages)
+
+
+async def serve(args, messages):
+    context = zmq.asyncio.Context()
+    publisher = context.socket(zmq.PUB)
+    publisher.bind(args.bind)
+    try:
+        # Give subscribers time to connect: PUB drops what nobody hears.
+        await asyncio.sleep(args.warmup)
+        for _ in range(args.loop):
+            started = time.monotonic()
+            sent = await replay(publisher, messages, speed=args.speed, rate=args.rate)
+            secs = time.monotonic() - started
+            print("sent {:n} messages in {:.1f}s, {:.1f}/s".format(
+                    sent, secs, sent / secs if secs else 0.
+            ))
+    finally:
+        publisher.close(linger=1000)
+        context.term()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Record and replay EDDN messages.'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    recordArgs = commands.add_parser('record', help='Record messages from a relay.')
+    recordArgs.add_argument('file')
+    recordArgs.add_argument('--relay', default='tcp://eddn.edcd.io:9500')
+    recordArgs.add_argument('--count', type=int, help='Stop after this many')
+    
+    replayArgs = commands.add_parser('replay', help='Replay recorded messages.')
+    replayArgs.add_argument('file')
+    replayArgs.add_argument('--bind', default='tcp://127.0.0.1:9500')
+    pacing = replayArgs.add_mutually_exclusive_group()
+    pacing.add_argument('--speed', type=float, default=1.,
+            help='Multiple of the recorded rate (default: 1)')
+    pacing.add_argument('--rate', type=float, help='Messages per second')
+    replayArgs.add_argument('--loop', type=int, default=1,
+            help='Replay the recording this many times')
+    replayArgs.add_argument('--warmup', type=float, default=1.,
+            help='Seconds to wait for subscribers (default: 1)')
+    args = parser.parse_args()
+    
+    if args.command == 'record':
+        try:
+            recorded = record(args.relay, args.file, args.count)
+        except KeyboardInterrupt:
+            return
+        print("recorded {:n} messages".format(recorded))
+    else:
+        messages = loadRecording(args.file)
+        try:
+            asyncio.run(serve(args, messages))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
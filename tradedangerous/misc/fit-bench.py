@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+# Benchmark for the TradeCalc fit functions (run --fit).
+# Usage:
+#  misc/fit-bench.py [--loads N] [--items I] [--capacity T]
+#                    [--credits CR ...] [--fits simple exact fast brute]
+#                    [--seed S]
+# Generates N random station-to-station trades of I items each and fits
+# a load to each for every credit level, reporting each fit's time and
+# how much of the exact fit's profit it found.
+#
+# fastFit and bruteForceFit grow exponentially with the items and the
+# capacity: keep both small when including them, e.g.
+#  misc/fit-bench.py --items 8 --capacity 24 --fits simple exact fast brute
+
+import argparse
+import random
+import time
+
+from tradedangerous import TradeEnv
+from tradedangerous.tradecalc import TradeCalc
+from tradedangerous.tradedb import Trade
+
+
+def make_trades(rng, numItems, capacity):
+    items = []
+    for _ in range(numItems):
+        costCr = rng.randint(50, 10000)
+        gainCr = int(costCr * rng.uniform(0.02, 0.5)) + 1
+        supply = rng.choice((rng.randint(1, capacity), capacity * 10))
+        items.append(Trade(None, costCr, gainCr, supply, 2, 1000, 2, 0, 0))
+    # As TradeCalc.getTrades orders them.
+    items.sort(key=lambda item: (-item.gainCr, item.costCr))
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Benchmark the TradeCalc fit functions.'
+    )
+    parser.add_argument('--loads', type=int, default=200)
+    parser.add_argument('--items', type=int, default=20)
+    parser.add_argument('--capacity', type=int, default=200)
+    parser.add_argument('--credits', type=int, nargs='+',
+            default=[20000, 100000, 500000, 5000000])
+    parser.add_argument('--fits', nargs='+', default=['simple', 'exact'],
+            choices=sorted(TradeCalc.fitFunctions))
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    
+    # The fit functions don't use the loaded prices.
+    calc = TradeCalc.__new__(TradeCalc)
+    calc.tdenv = TradeEnv(quiet=1)
+    fits = [
+        (name, getattr(calc, TradeCalc.fitFunctions[name]))
+        for name in args.fits
+    ]
+    
+    rng = random.Random(args.seed)
+    trades = [
+        make_trades(rng, args.items, args.capacity)
+        for _ in range(args.loads)
+    ]
+    
+    print("{:>10}  {:<8} {:>12} {:>10} {:>8} {:>8}".format(
+        "credits", "fit", "total gain", "vs exact", "worse", "ms/fit",
+    ))
+    for credits in args.credits:
+        results = {}
+        for name, fit in fits:
+            start = time.perf_counter()
+            gains = [
+                fit(items, credits, args.capacity, args.capacity).gainCr
+                for items in trades
+            ]
+            results[name] = (gains, time.perf_counter() - start)
+        best = results.get('exact', results.get('brute'))
+        for name, _ in fits:
+            gains, secs = results[name]
+            if best:
+                ratio = "{:.2%}".format(sum(gains) / max(sum(best[0]), 1))
+                worse = sum(gain < bestGain for gain, bestGain in zip(gains, best[0]))
+            else:
+                ratio, worse = "-", "-"
+            print("{:>10n}  {:<8} {:>12n} {:>10} {:>8} {:>8.3f}".format(
+                credits, name, sum(gains), ratio, worse,
+                secs * 1000 / len(trades),
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+# Benchmark for the System spatial indexes used by TradeDB.querySphere.
+# Usage:
+#  misc/spatial-bench.py [--db TradeDangerous.db] [--systems N]
+#                        [--queries Q] [--radius LY ...]
+# Compares the original pure-Python 32ly stellar grid scan against
+# each of the indexes in tradedangerous.spatial, checking that they all
+# find the same systems, and reports build and per-query times.
+#
+# Without --db, N synthetic systems are generated: a dense "bubble"
+# around the origin plus a sparse spread across the galaxy.
+
+import argparse
+import sqlite3
+import time
+
+import numpy
+
+from tradedangerous.spatial import indexTypes
+
+
+def legacy_grid_build(positions):
+    grid = {}
+    for row, (x, y, z) in enumerate(positions.tolist()):
+        key = (int(x) >> 5, int(y) >> 5, int(z) >> 5)
+        grid.setdefault(key, []).append((row, x, y, z))
+    return grid
+
+
+def legacy_grid_query(grid, center, ly):
+    sysX, sysY, sysZ = center
+    lwrBound = (int(sysX - ly) >> 5, int(sysY - ly) >> 5, int(sysZ - ly) >> 5)
+    uprBound = (int(sysX + ly) >> 5, int(sysY + ly) >> 5, int(sysZ + ly) >> 5)
+    lySq = ly ** 2
+    found = []
+    for x in range(lwrBound[0], uprBound[0]+1):
+        for y in range(lwrBound[1], uprBound[1]+1):
+            for z in range(lwrBound[2], uprBound[2]+1):
+                try:
+                    cell = grid[(x, y, z)]
+                except KeyError:
+                    continue
+                for row, cx, cy, cz in cell:
+                    px, py, pz = cx - sysX, cy - sysY, cz - sysZ
+                    distSq = px*px + py*py + pz*pz
+                    if distSq > lySq:
+                        continue
+                    found.append(row)
+    return found
+
+
+def load_positions(args):
+    if args.db:
+        conn = sqlite3.connect(args.db)
+        rows = conn.execute("SELECT pos_x, pos_y, pos_z FROM System").fetchall()
+        return numpy.array(rows, dtype=numpy.float64).reshape(-1, 3)
+    rng = numpy.random.default_rng(args.seed)
+    bubble = args.systems // 3
+    return numpy.concatenate([
+        rng.normal(0, 250, size=(bubble, 3)),
+        rng.uniform(-40000, 40000, size=(args.systems - bubble, 3)) *
+            (1, 0.05, 1),
+    ])
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Benchmark the System spatial indexes.'
+    )
+    parser.add_argument('--db', help='Take systems from this TradeDangerous.db')
+    parser.add_argument('--systems', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--radius', type=float, nargs='+',
+            default=[10, 25, 50, 100, 250])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    
+    positions = load_positions(args)
+    print("{:n} systems, {} queries per radius".format(
+            len(positions), args.queries
+    ))
+    
+    rng = numpy.random.default_rng(args.seed)
+    # Query around existing systems, as TD does.
+    centers = [
+        tuple(positions[row].tolist())
+        for row in rng.integers(0, len(positions), args.queries)
+    ]
+    
+    indexes = {}
+    grid, secs = timed(legacy_grid_build, positions)
+    print("{:>8} build {:8.3f}s".format('legacy', secs))
+    for name, indexClass in indexTypes.items():
+        indexes[name], secs = timed(indexClass, positions)
+        print("{:>8} build {:8.3f}s".format(name, secs))
+    
+    for radius in args.radius:
+        expected, legacySecs = timed(
+            lambda: [sorted(legacy_grid_query(grid, c, radius)) for c in centers]
+        )
+        found = sum(len(rows) for rows in expected) / len(centers)
+        print("radius {}ly, {:.0f} systems/query".format(radius, found))
+        print("  {:>8} {:10.3f}ms/query".format(
+                'legacy', legacySecs * 1000 / len(centers)
+        ))
+        for name, index in indexes.items():
+            results, secs = timed(
+                lambda: [index.query(c, radius)[0] for c in centers]
+            )
+            if [sorted(rows.tolist()) for rows in results] != expected:
+                raise SystemExit("{} disagrees with legacy grid".format(name))
+            print("  {:>8} {:10.3f}ms/query  x{:.1f}".format(
+                    name, secs * 1000 / len(centers), legacySecs / secs
+            ))
+
+
+if __name__ == "__main__":
+    main()
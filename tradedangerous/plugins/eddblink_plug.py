@@ -7,6 +7,7 @@ import codecs
 import csv
 import datetime
 import json
+import multiprocessing
 import os
 import platform
 import sqlite3
@@ -76,9 +77,15 @@ class ImportPlugin(plugins.ImportPluginBase):
         'fallback':     "Fallback to using EDDB.io if Tromador's mirror isn't working.",
         'progbar':      "Does nothing, only included for backwards compatibility.",
         'solo':         "Don't download crowd-sourced market data. (Implies '-O skipvend', supercedes '-O all', '-O clean', '-O listings'.)",
-        'skipfleet':    "When importing stations, skip fleet carriers."
+        'skipfleet':    "When importing stations, skip fleet carriers.",
+        'workers':      "Number of processes to parse listings with. (Default: one per CPU.)"
     }
     
+    # Rows per executemany when staging dump files for a bulk merge.
+    stageBatchSize = 20000
+    # Approximate bytes of listings parsed per job by importListings.
+    listingsChunkSize = 1 << 22
+    
     def __init__(self, tdb, tdenv):
         super().__init__(tdb, tdenv)
         
@@ -352,6 +359,70 @@ class ImportPlugin(plugins.ImportPluginBase):
         """
         return self.systemIdMap.get(system_id) or system_id
 
+    def stageSystem(self, rows, system_id, name, pos_x, pos_y, pos_z, updated_at):
+        """
+        Adds a System row to the batch for the SystemStage table,
+        flushing the batch once it reaches stageBatchSize.
+        """
+        modified = datetime.datetime.utcfromtimestamp(updated_at).strftime('%Y-%m-%d %H:%M:%S')
+        rows.append((system_id, tradedb.normalizedStr(name), name, pos_x, pos_y, pos_z, modified))
+        if len(rows) >= self.stageBatchSize:
+            self.executemany("INSERT INTO SystemStage VALUES ( ?, ?, ?, ?, ?, ?, ? )", rows)
+            rows.clear()
+    
+    def createSystemStage(self):
+        self.execute("DROP TABLE IF EXISTS temp.SystemStage")
+        self.execute("""CREATE TEMP TABLE SystemStage (
+                        system_id INTEGER, name VARCHAR(40) COLLATE nocase, pretty_name VARCHAR(40),
+                        pos_x DOUBLE, pos_y DOUBLE, pos_z DOUBLE, modified DATETIME
+                    )""")
+    
+    def mergeSystemStage(self, rows):
+        """
+        Merges the SystemStage table into System: new systems are
+        added, and existing ones are updated if the staged data is newer.
+        """
+        tdb, tdenv = self.tdb, self.tdenv
+        
+        if rows:
+            self.executemany("INSERT INTO SystemStage VALUES ( ?, ?, ?, ?, ?, ?, ? )", rows)
+            rows.clear()
+        
+        # Some system names occur multiple times with different IDs; they all
+        # become the system already in the DB, or else the first one seen.
+        self.execute("CREATE INDEX temp.idx_system_stage_name ON SystemStage (name)")
+        remap = self.execute("""SELECT stage.rowid, stage.system_id, COALESCE(
+                                    (SELECT System.system_id FROM System WHERE System.name = stage.name),
+                                    (SELECT first.system_id FROM SystemStage AS first
+                                      WHERE first.name = stage.name ORDER BY first.rowid LIMIT 1)
+                                ) AS new_id
+                                FROM SystemStage AS stage
+                                WHERE new_id != stage.system_id""").fetchall()
+        for _, system_id, new_id in remap:
+            self.addSystemIdMapEntry(new_id, system_id)
+        self.executemany("UPDATE SystemStage SET system_id = ? WHERE rowid = ?",
+                         [(new_id, rowid) for rowid, _, new_id in remap])
+        
+        # Rows are merged in file order, so later lines for the same
+        # system only win if they are newer, as they would one at a time.
+        db = tdb.getDB()
+        changes = db.total_changes
+        self.execute("""INSERT INTO System
+                    ( system_id,name,pretty_name,pos_x,pos_y,pos_z,modified )
+                    SELECT system_id,name,pretty_name,pos_x,pos_y,pos_z,modified
+                    FROM SystemStage WHERE true ORDER BY rowid
+                    ON CONFLICT (system_id) DO UPDATE
+                    SET name = excluded.name,pretty_name = excluded.pretty_name,
+                        pos_x = excluded.pos_x,pos_y = excluded.pos_y,pos_z = excluded.pos_z,
+                        modified = excluded.modified
+                    WHERE excluded.modified > System.modified""")
+        changes = db.total_changes - changes
+        self.execute("DROP TABLE temp.SystemStage")
+        
+        tdenv.DEBUG0("{:n} systems added or updated.", changes)
+        if changes:
+            self.updated['System'] = True
+    
     def importSystems(self):
         """
         Populate the System table using systems_populated.jsonl
@@ -367,48 +438,22 @@ class ImportPlugin(plugins.ImportPluginBase):
         with open(str(self.dataPath / self.sysPopPath), "r", encoding = "utf-8", errors = 'ignore') as f:
             total += (sum(bl.count("\n") for bl in self.blocks(f)))
         
+        self.createSystemStage()
+        rows = []
         with open(str(self.dataPath / self.sysPopPath), "r") as fh:
             prog = pbar.Progress(total, 50)
             for line in fh:
                 prog.increment(1, postfix = lambda value, goal: " " + str(round(value / total * 100)) + "%")
                 system = json.loads(line)
-                system_id = system['id']
-                name = system['name']
-                pos_x = system['x']
-                pos_y = system['y']
-                pos_z = system['z']
-                modified = datetime.datetime.utcfromtimestamp(system['updated_at']).strftime('%Y-%m-%d %H:%M:%S')
-
-                # Check if the system already has an id, and if so, add it to the system id map
-                id = self.execute("SELECT system_id FROM System WHERE name = ?", (tradedb.normalizedStr(name),)).fetchone()
-                if id:
-                    self.addSystemIdMapEntry(id[0], system_id)
-                    system_id = id[0]
-                
-                result = self.execute("SELECT modified FROM System WHERE system_id = ?", (system_id,)).fetchone()
-                if result:
-                    updated = timegm(datetime.datetime.strptime(result[0].split('.')[0], '%Y-%m-%d %H:%M:%S').timetuple())
-                    if system['updated_at'] > updated:
-                        tdenv.DEBUG0("System '{}' has been updated: '{}' vs '{}'", name, modified, result[0])
-                        tdenv.DEBUG1("Updating: {}, {}, {}, {}, {}, {}", system_id, name, pos_x, pos_y, pos_z, modified)
-                        self.execute("""UPDATE System
-                                    SET name = ?,pretty_name = ?,pos_x = ?,pos_y = ?,pos_z = ?,modified = ?
-                                    WHERE system_id = ?""",
-                                    (tradedb.normalizedStr(name), name, pos_x, pos_y, pos_z, modified,
-                                     system_id))
-                        self.updated['System'] = True
-                else:
-                    tdenv.DEBUG0("System '{}' has been added.", name)
-                    tdenv.DEBUG1("Inserting: {}, {}, {}, {}, {}, {}", system_id, name, pos_x, pos_y, pos_z, modified)
-                    self.execute("""INSERT INTO System
-                                ( system_id,name,pretty_name,pos_x,pos_y,pos_z,modified ) VALUES
-                                ( ?, ?, ?, ?, ?, ?, ? ) """,
-                                (system_id, tradedb.normalizedStr(name), name, pos_x, pos_y, pos_z, modified))
-                    self.updated['System'] = True
+                self.stageSystem(rows, system['id'], system['name'],
+                                 system['x'], system['y'], system['z'], system['updated_at'])
             while prog.value < prog.maxValue:
                 prog.increment(1, postfix = lambda value, goal: " " + str(round(value / total * 100)) + "%")
             prog.clear()
         
+        tdenv.NOTE("Import file processing complete, updating database. {}", self.now())
+        self.mergeSystemStage(rows)
+        
         tdenv.NOTE("Finished processing Systems. End time = {}", self.now())
     
     def importAllSystems(self, source):
@@ -426,48 +471,23 @@ class ImportPlugin(plugins.ImportPluginBase):
         with open(str(self.dataPath / source), "r", encoding = "utf-8", errors = 'ignore') as f:
             total += (sum(bl.count("\n") for bl in self.blocks(f)))
         
+        self.createSystemStage()
+        rows = []
         with open(str(self.dataPath / source), "r") as fh:
             sysDict = csv.DictReader(fh)
             prog = pbar.Progress(total, 50)
             for system in sysDict:
                 prog.increment(1, postfix = lambda value, goal: " " + str(round(value / total * 100)) + "%")
-                system_id = system['id']
-                name = system['name']
-                pos_x = system['x']
-                pos_y = system['y']
-                pos_z = system['z']
-                modified = datetime.datetime.utcfromtimestamp(int(system['updated_at'])).strftime('%Y-%m-%d %H:%M:%S')
-
-                # Check if the system already has an id, and if so, add it to the system id map
-                id = self.execute("SELECT system_id FROM System WHERE name = ?", (tradedb.normalizedStr(name),)).fetchone()
-                if id:
-                    self.addSystemIdMapEntry(id[0], system_id)
-                    system_id = id[0]
-                
-                result = self.execute("SELECT modified FROM System WHERE system_id = ?", (system_id,)).fetchone()
-                if result:
-                    updated = timegm(datetime.datetime.strptime(result[0].split('.')[0], '%Y-%m-%d %H:%M:%S').timetuple())
-                    if int(system['updated_at']) > updated:
-                        tdenv.DEBUG0("System '{}' has been updated: '{}' vs '{}'", name, modified, result[0])
-                        tdenv.DEBUG1("Updating: {}, {}, {}, {}, {}, {}", system_id, name, pos_x, pos_y, pos_z, modified)
-                        self.execute("""UPDATE System
-                                    SET name = ?,pretty_name = ?,pos_x = ?,pos_y = ?,pos_z = ?,modified = ?
-                                    WHERE system_id = ?""",
-                                    (tradedb.normalizedStr(name), name, pos_x, pos_y, pos_z, modified,
-                                     system_id))
-                        self.updated['System'] = True
-                else:
-                    tdenv.DEBUG0("System '{}' has been added.", name)
-                    tdenv.DEBUG1("Inserting: {}, {}, {}, {}, {}, {}", system_id, name, pos_x, pos_y, pos_z, modified)
-                    self.execute("""INSERT INTO System
-                                ( system_id,name,pretty_name,pos_x,pos_y,pos_z,modified ) VALUES
-                                ( ?, ?, ?, ?, ?, ? ) """,
-                                (system_id, tradedb.normalizedStr(name), name, pos_x, pos_y, pos_z, modified))
-                    self.updated['System'] = True
+                self.stageSystem(rows, int(system['id']), system['name'],
+                                 float(system['x']), float(system['y']), float(system['z']),
+                                 int(system['updated_at']))
             while prog.value < prog.maxValue:
                 prog.increment(1, postfix = lambda value, goal: " " + str(round(value / total * 100)) + "%")
             prog.clear()
         
+        tdenv.NOTE("Import file processing complete, updating database. {}", self.now())
+        self.mergeSystemStage(rows)
+        
         tdenv.NOTE("Finished processing Systems. End time = {}", self.now())
     
     def purgeSystems(self):
@@ -497,6 +517,49 @@ class ImportPlugin(plugins.ImportPluginBase):
         
         tdenv.NOTE("Finished purging Systems. End time = {}", self.now())
     
+    @staticmethod
+    def fixShipName(ship):
+        """
+        Make sure all the 'Mark N' ship names abbreviate 'Mark' as '<Name> Mk. <Number>'.
+        """
+        # Fix capitalization.
+        ship = ship.replace('MK', 'Mk').replace('mk', 'Mk').replace('mK', 'Mk')
+        # Fix no '.' in abbreviation.
+        if "Mk" in ship and "Mk." not in ship:
+            ship = ship.replace('Mk', 'Mk.')
+        # Fix no trailing space.
+        if "Mk." in ship and "Mk. " not in ship:
+            ship = ship.replace("Mk.", "Mk. ")
+        # Fix no leading space.
+        if "Mk." in ship and " Mk." not in ship:
+            ship = ship.replace("Mk.", " Mk.")
+        return ship
+    
+    def mergeVendorStage(self, vendor, stampColumn, insertStmt):
+        """
+        Replaces the vendor table rows of every staged station whose
+        shipyard/outfitting data is newer than what the DB has.
+        """
+        self.execute("DROP TABLE IF EXISTS temp.{}Stale".format(vendor))
+        self.execute("""CREATE TEMP TABLE {vendor}Stale AS
+                    SELECT stage.station_id, MAX(stage.{stamp}) AS modified
+                    FROM StationStage AS stage
+                    LEFT JOIN (SELECT station_id, MAX(modified) AS modified
+                                FROM {vendor} GROUP BY station_id) AS cur
+                    ON cur.station_id = stage.station_id
+                    WHERE stage.{stamp} IS NOT NULL
+                    GROUP BY stage.station_id
+                    HAVING MAX(stage.{stamp}) > COALESCE(MAX(cur.modified), '')
+                    """.format(vendor = vendor, stamp = stampColumn))
+        stale = self.execute("SELECT COUNT(*) FROM {}Stale".format(vendor)).fetchone()[0]
+        if stale:
+            self.execute("DELETE FROM {vendor} WHERE station_id IN (SELECT station_id FROM {vendor}Stale)"
+                         .format(vendor = vendor))
+            self.execute(insertStmt)
+            self.updated[vendor] = True
+        self.execute("DROP TABLE temp.{}Stale".format(vendor))
+        self.tdenv.DEBUG0("{}: {:n} stations updated.", vendor, stale)
+    
     def importStations(self):
         """
         Populate the Station table using stations.jsonl
@@ -517,8 +580,38 @@ class ImportPlugin(plugins.ImportPluginBase):
         with open(str(self.dataPath / self.stationsPath), "r", encoding = "utf-8", errors = 'ignore') as f:
             total += (sum(bl.count("\n") for bl in self.blocks(f)))
         
-        stationsCreated = 0
-        stationsUpdated = 0
+        # The file is streamed into staging tables, which are then
+        # merged into the real ones with a few set-based statements.
+        for stage in ("StationStage", "ShipVendorStage", "UpgradeVendorStage"):
+            self.execute("DROP TABLE IF EXISTS temp.{}".format(stage))
+        self.execute("""CREATE TEMP TABLE StationStage (
+                        station_id INTEGER, name VARCHAR(40) COLLATE nocase, pretty_name VARCHAR(40),
+                        system_id INTEGER, ls_from_star INTEGER, blackmarket TEXT(1), max_pad_size TEXT(1),
+                        market TEXT(1), shipyard TEXT(1), modified DATETIME, outfitting TEXT(1),
+                        rearm TEXT(1), refuel TEXT(1), repair TEXT(1), planetary TEXT(1), type_id INTEGER,
+                        shipyard_modified DATETIME, outfitting_modified DATETIME
+                    )""")
+        self.execute("""CREATE TEMP TABLE ShipVendorStage (
+                        station_id INTEGER, ship VARCHAR(40) COLLATE nocase, modified DATETIME
+                    )""")
+        self.execute("""CREATE TEMP TABLE UpgradeVendorStage (
+                        station_id INTEGER, upgrade_id INTEGER, modified DATETIME
+                    )""")
+        
+        stationRows, shipRows, upgradeRows = [], [], []
+        
+        def flush():
+            if stationRows:
+                self.executemany("""INSERT INTO StationStage VALUES
+                                ( ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? )""", stationRows)
+            if shipRows:
+                self.executemany("INSERT INTO ShipVendorStage VALUES ( ?, ?, ? )", shipRows)
+            if upgradeRows:
+                self.executemany("INSERT INTO UpgradeVendorStage VALUES ( ?, ?, ? )", upgradeRows)
+            stationRows.clear()
+            shipRows.clear()
+            upgradeRows.clear()
+        
         stationsSkipped = 0
         with open(str(self.dataPath / self.stationsPath), "r") as fh:
             prog = pbar.Progress(total, 50)
@@ -542,139 +635,106 @@ class ImportPlugin(plugins.ImportPluginBase):
                 repair = 'Y' if station['has_repair'] else 'N'
                 planetary = 'Y' if station['is_planetary'] else 'N'
                 type_id = station['type_id'] if station['type_id'] else 0
-
+                
                 # Some systems occure with multiple IDs. Map accordingly
                 system_id = self.mapSystemId(system_id)
-
-                if self.getOption("skipfleet") and type_id == 24:
-                    stationsSkipped = stationsSkipped + 1
-                    continue
                 
-                systemList = self.execute("SELECT System.name FROM System WHERE System.system_id = ?", (system_id,)).fetchone()
-                if systemList:
-                    system = systemList[0].upper()
-                else:
+                if self.getOption("skipfleet") and type_id == 24:
                     stationsSkipped = stationsSkipped + 1
-                    tdenv.WARN("Importing of station {} skipped (Unknown system id {}).", name, system_id)
                     continue
                 
-                result = self.execute("SELECT modified FROM Station WHERE station_id = ?", (station_id,)).fetchone()
-                if result:
-                    updated = timegm(datetime.datetime.strptime(result[0].split('.')[0], '%Y-%m-%d %H:%M:%S').timetuple())
-                    if station['updated_at'] > updated:
-                        tdenv.DEBUG0("{}/{} has been updated: {} vs {}",
-                                    system , name, modified, result[0])
-                        tdenv.DEBUG1("Updating: {}, {}, {}, {}, {}, {}, {},"
-                                              " {}, {}, {}, {}, {}, {}, {}, {}",
-                                    station_id, name, system_id, ls_from_star, blackmarket,
-                                    max_pad_size, market, shipyard, modified, outfitting,
-                                    rearm, refuel, repair, planetary, type_id)
-                        self.execute("""UPDATE Station
-                                    SET name = ?, pretty_name = ?, system_id = ?, ls_from_star = ?, blackmarket = ?,
-                                    max_pad_size = ?, market = ?, shipyard = ?, modified = ?,
-                                    outfitting = ?, rearm = ?, refuel = ?, repair = ?, planetary = ?, type_id = ?
-                                    WHERE station_id = ?""",
-                                    (tradedb.normalizedStr(name), name, system_id, ls_from_star, blackmarket,
-                                     max_pad_size, market, shipyard, modified,
-                                     outfitting, rearm, refuel, repair, planetary, type_id,
-                                     station_id))
-                        stationsUpdated = stationsUpdated + 1
-                        self.updated['Station'] = True
-                else:
-                    tdenv.DEBUG0("{}/{} has been added:", system , name)
-                    tdenv.DEBUG1("Inserting: {}, {}, {}, {}, {}, {}, {},"
-                                              " {}, {}, {}, {}, {}, {}, {}, {}",
-                        station_id, name, system_id, ls_from_star, blackmarket,
-                        max_pad_size, market, shipyard, modified, outfitting,
-                        rearm, refuel, repair, planetary, type_id)
-                    self.execute("""INSERT INTO Station (
-                                station_id,name,pretty_name,system_id,ls_from_star,
-                                blackmarket,max_pad_size,market,shipyard,
-                                modified,outfitting,rearm,refuel,
-                                repair,planetary,type_id ) VALUES
-                                ( ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? ) """,
-                                (station_id, tradedb.normalizedStr(name), name, system_id, ls_from_star,
-                                 blackmarket, max_pad_size, market, shipyard,
-                                 modified, outfitting, rearm, refuel,
-                                 repair, planetary, type_id))
-                    stationsCreated = stationsCreated + 1
-                    self.updated['Station'] = True
-                
-                # Import shipyards into ShipVendors if shipvend is set.
+                # Stage shipyards for ShipVendors if shipvend is set.
+                shipyard_modified = None
                 if station['has_shipyard'] and self.getOption('shipvend'):
-                    if not station['shipyard_updated_at']:
-                        station['shipyard_updated_at'] = station['updated_at']
-                    modified = datetime.datetime.utcfromtimestamp(station['shipyard_updated_at']).strftime('%Y-%m-%d %H:%M:%S')
-                    result = self.execute("SELECT modified FROM ShipVendor WHERE station_id = ?", (station_id,)).fetchone()
-                    if result:
-                        updated = timegm(datetime.datetime.strptime(result[0].split('.')[0], '%Y-%m-%d %H:%M:%S').timetuple())
-                    else:
-                        updated = 0
-                    if station['shipyard_updated_at'] > updated:
-                        self.execute("DELETE FROM ShipVendor WHERE station_id = ?", (station_id,))
-                        tdenv.DEBUG1("{}/{} has shipyard, updating ships sold.", system, name)
-                        for ship in station['selling_ships']:
-                            # Make sure all the 'Mark N' ship names abbreviate 'Mark' as '<Name> Mk. <Number>'.
-                            # Fix capitalization.
-                            ship = ship.replace('MK', 'Mk').replace('mk', 'Mk').replace('mK', 'Mk')
-                            # Fix no '.' in abbreviation.
-                            if "Mk" in ship and "Mk." not in ship:
-                                ship = ship.replace('Mk', 'Mk.')
-                            # Fix no trailing space.
-                            if "Mk." in ship and "Mk. " not in ship:
-                                ship = ship.replace("Mk.", "Mk. ")
-                            # Fix no leading space.
-                            if "Mk." in ship and " Mk." not in ship:
-                                ship = ship.replace("Mk.", " Mk.")
-                            
-                            tdenv.DEBUG2("ship_id:{},station_id:{},modified:{}",
-                                 ship,
-                                 station_id,
-                                 modified)
-                            try:
-                                self.execute("""INSERT INTO ShipVendor
-                                        ( ship_id,station_id,modified ) VALUES
-                                        ( (SELECT Ship.ship_id FROM Ship WHERE Ship.name = ?), ?, ? ) """,
-                                        (ship,
-                                         station_id,
-                                         modified))
-                            except sqlite3.IntegrityError:
-                                continue
-                        self.updated['ShipVendor'] = True
+                    shipyard_modified = datetime.datetime.utcfromtimestamp(
+                        station['shipyard_updated_at'] or station['updated_at']
+                    ).strftime('%Y-%m-%d %H:%M:%S')
+                    for ship in station['selling_ships']:
+                        shipRows.append((station_id, self.fixShipName(ship), shipyard_modified))
                 
-                # Import Outfitters into UpgradeVendors if upvend is set.
+                # Stage outfitters for UpgradeVendors if upvend is set.
+                outfitting_modified = None
                 if station['has_outfitting'] and self.getOption('upvend'):
-                    if not station['outfitting_updated_at']:
-                        station['outfitting_updated_at'] = station['updated_at']
-                    modified = datetime.datetime.utcfromtimestamp(station['outfitting_updated_at']).strftime('%Y-%m-%d %H:%M:%S')
-                    result = self.execute("SELECT modified FROM UpgradeVendor WHERE station_id = ?", (station_id,)).fetchone()
-                    if result:
-                        updated = timegm(datetime.datetime.strptime(result[0].split('.')[0], '%Y-%m-%d %H:%M:%S').timetuple())
-                    else:
-                        updated = 0
-                    if station['outfitting_updated_at'] > updated:
-                        self.execute("DELETE FROM UpgradeVendor WHERE station_id = ?", (station_id,))
-                        tdenv.DEBUG1("{}/{} has outfitting, updating modules sold.", system, name)
-                        for upgrade in station['selling_modules']:
-                            tdenv.DEBUG2("upgrade_id:{},station_id:{},modified:{}",
-                                 upgrade,
-                                 station['id'],
-                                 modified)
-                            try:
-                                self.execute("""INSERT INTO UpgradeVendor
-                                        ( upgrade_id,station_id,cost,modified ) VALUES
-                                        ( ?, ?, (SELECT Upgrade.cost FROM Upgrade WHERE Upgrade.upgrade_id = ?), ? ) """,
-                                        (upgrade,
-                                         station_id,
-                                         upgrade,
-                                         modified))
-                            except sqlite3.IntegrityError:
-                                continue
-                        self.updated['UpgradeVendor'] = True
+                    outfitting_modified = datetime.datetime.utcfromtimestamp(
+                        station['outfitting_updated_at'] or station['updated_at']
+                    ).strftime('%Y-%m-%d %H:%M:%S')
+                    for upgrade in station['selling_modules']:
+                        upgradeRows.append((station_id, upgrade, outfitting_modified))
+                
+                stationRows.append((station_id, tradedb.normalizedStr(name), name, system_id, ls_from_star,
+                                    blackmarket, max_pad_size, market, shipyard,
+                                    modified, outfitting, rearm, refuel,
+                                    repair, planetary, type_id,
+                                    shipyard_modified, outfitting_modified))
+                if len(stationRows) >= self.stageBatchSize:
+                    flush()
+            flush()
             while prog.value < prog.maxValue:
                 prog.increment(1, postfix = lambda value, goal: " " + str(round(value / total * 100)) + "%")
             prog.clear()
         
+        tdenv.NOTE("Import file processing complete, updating database. {}", self.now())
+        
+        unknown = self.execute("""SELECT pretty_name, system_id FROM StationStage
+                                WHERE system_id NOT IN (SELECT system_id FROM System)""").fetchall()
+        for name, system_id in unknown:
+            tdenv.WARN("Importing of station {} skipped (Unknown system id {}).", name, system_id)
+        if unknown:
+            stationsSkipped += len(unknown)
+            self.execute("DELETE FROM StationStage WHERE system_id NOT IN (SELECT system_id FROM System)")
+        
+        # Rows are merged in file order, so later lines for the same
+        # station only win if they are newer, as they would one at a time.
+        db = tdb.getDB()
+        stationCount = self.execute("SELECT COUNT(*) FROM Station").fetchone()[0]
+        changes = db.total_changes
+        self.execute("""INSERT INTO Station (
+                    station_id,name,pretty_name,system_id,ls_from_star,
+                    blackmarket,max_pad_size,market,shipyard,
+                    modified,outfitting,rearm,refuel,
+                    repair,planetary,type_id )
+                    SELECT station_id,name,pretty_name,system_id,ls_from_star,
+                    blackmarket,max_pad_size,market,shipyard,
+                    modified,outfitting,rearm,refuel,
+                    repair,planetary,type_id
+                    FROM StationStage WHERE true ORDER BY rowid
+                    ON CONFLICT (station_id) DO UPDATE
+                    SET name = excluded.name, pretty_name = excluded.pretty_name,
+                    system_id = excluded.system_id, ls_from_star = excluded.ls_from_star,
+                    blackmarket = excluded.blackmarket, max_pad_size = excluded.max_pad_size,
+                    market = excluded.market, shipyard = excluded.shipyard, modified = excluded.modified,
+                    outfitting = excluded.outfitting, rearm = excluded.rearm, refuel = excluded.refuel,
+                    repair = excluded.repair, planetary = excluded.planetary, type_id = excluded.type_id
+                    WHERE excluded.modified > Station.modified""")
+        changes = db.total_changes - changes
+        stationsCreated = self.execute("SELECT COUNT(*) FROM Station").fetchone()[0] - stationCount
+        stationsUpdated = changes - stationsCreated
+        if changes:
+            self.updated['Station'] = True
+        
+        if self.getOption('shipvend'):
+            self.mergeVendorStage("ShipVendor", "shipyard_modified",
+                                """INSERT OR IGNORE INTO ShipVendor
+                                ( ship_id,station_id,modified )
+                                SELECT Ship.ship_id, stage.station_id, stage.modified
+                                FROM ShipVendorStage AS stage
+                                JOIN ShipVendorStale AS stale
+                                    ON stale.station_id = stage.station_id AND stale.modified = stage.modified
+                                JOIN Ship ON Ship.name = stage.ship""")
+        
+        if self.getOption('upvend'):
+            self.mergeVendorStage("UpgradeVendor", "outfitting_modified",
+                                """INSERT OR IGNORE INTO UpgradeVendor
+                                ( upgrade_id,station_id,cost,modified )
+                                SELECT stage.upgrade_id, stage.station_id, Upgrade.cost, stage.modified
+                                FROM UpgradeVendorStage AS stage
+                                JOIN UpgradeVendorStale AS stale
+                                    ON stale.station_id = stage.station_id AND stale.modified = stage.modified
+                                JOIN Upgrade ON Upgrade.upgrade_id = stage.upgrade_id""")
+        
+        for stage in ("StationStage", "ShipVendorStage", "UpgradeVendorStage"):
+            self.execute("DROP TABLE temp.{}".format(stage))
+        
         tdenv.NOTE("Imported {} stations ({} created, {} updated, {} skipped)",
                    stationsCreated + stationsUpdated, stationsCreated, stationsUpdated, stationsSkipped)
         tdenv.NOTE("Finished processing Stations. End time = {}", self.now())
@@ -854,10 +914,30 @@ class ImportPlugin(plugins.ImportPluginBase):
                 print("(commit) Database is locked, waiting for access.", end = "\r")
                 time.sleep(1)
     
+    def listingsWorkers(self):
+        """
+        Number of processes importListings parses with, from the
+        'workers' option; one per CPU by default.
+        """
+        workers = self.getOption('workers')
+        if workers is None or workers is True:
+            return os.cpu_count() or 1
+        try:
+            workers = int(workers)
+        except ValueError:
+            workers = -1
+        if workers < 0:
+            raise PluginException("Invalid value for 'workers' option: {}".format(self.getOption('workers')))
+        return workers or os.cpu_count() or 1
+    
     def importListings(self, listings_file):
         """
         Updates the market data (AKA the StationItem table) using listings.csv
         Writes directly to database.
+        
+        The file is split into chunks at station boundaries which are
+        parsed by a pool of processes, while this process writes the
+        results of each chunk to the database as they arrive.
         """
         tdb, tdenv = self.tdb, self.tdenv
         
@@ -866,113 +946,85 @@ class ImportPlugin(plugins.ImportPluginBase):
             tdenv.NOTE("File not found, aborting: {}", (self.dataPath / listings_file))
             return
         
-        total = 1
-        
         from_live = 0 if listings_file == self.listingsPath else 1
         
-        # Used to check if the listings file is using the fdev_id as a temporary
-        # item_id, but the item is in the DB with a permanent item_id.
-        fdev2item = dict()
-        result = self.execute("SELECT fdev_id,item_id FROM Item ORDER BY fdev_id").fetchall()
-        for item in result:
-            fdev2item[item[0]] = item[1]
-        
-        with open(str(self.dataPath / listings_file), "r", encoding = "utf-8", errors = 'ignore') as f:
-            total += (sum(bl.count("\n") for bl in self.blocks(f)))
-        
-        liveList = []
         liveStmt = """UPDATE StationItem
                     SET from_live = 0
                     WHERE station_id = ?"""
         
-        delList = []
         delStmt = "DELETE from StationItem WHERE station_id = ?"
         
-        listingList = []
         listingStmt = """INSERT OR IGNORE INTO StationItem
                         (station_id, item_id, modified,
                          demand_price, demand_units, demand_level,
                          supply_price, supply_units, supply_level, from_live)
                         VALUES ( ?, ?, ?, ?, ?, ?, ?, ?, ?, ? )"""
         
-        items = []
-        it_result = self.execute("SELECT item_id FROM Item ORDER BY item_id").fetchall()
-        for item in it_result:
-            items.append(item[0])
+        items = tuple(
+            itemID
+            for (itemID,) in self.execute("SELECT item_id FROM Item ORDER BY item_id")
+        )
         
         stationList = {
             stationID
             for (stationID,) in self.execute("SELECT station_id FROM Station")
         }
         
-        with open(str(self.dataPath / listings_file), "r") as fh:
-            prog = pbar.Progress(total, 50)
-            listings = csv.DictReader(fh)
-            
-            cur_station = -1
-            
-            for listing in listings:
-                prog.increment(1, postfix = lambda value, goal: " " + str(round(value / total * 100)) + "%")
-                
-                station_id = int(listing['station_id'])
-                if station_id not in stationList:
-                    continue
-                
-                if station_id != cur_station:
-                    cur_station = station_id
-                    skipStation = False
+        path = str(self.dataPath / listings_file)
+        fieldnames, bounds, total = _listingsChunks(path, self.listingsChunkSize)
+        jobs = [(path, start, stop, fieldnames, items) for start, stop in bounds]
+        workers = min(self.listingsWorkers(), len(jobs))
+        tdenv.DEBUG0("Parsing {:n} chunks with {} workers.", len(jobs), workers)
+        
+        # Whether each station's listings are being imported, in case
+        # a station shows up more than once.
+        importing = {}
+        
+        prog = pbar.Progress(max(total, 1), 50)
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+        try:
+            chunks = pool.imap(_parseListings, jobs) if pool else map(_parseListings, jobs)
+            for size, stations in chunks:
+                liveList, delList, listingList = [], [], []
+                for station_id, collected_at, listings in stations:
+                    if station_id not in stationList:
+                        continue
                     
-                    # Check if listing already exists in DB and needs updated.
-                    # Only need to check the date for the first item at a specific station.
-                    result = self.execute("SELECT modified FROM StationItem WHERE station_id = ?", (station_id,)).fetchone()
-                    if result:
-                        updated = timegm(datetime.datetime.strptime(result[0].split('.')[0], '%Y-%m-%d %H:%M:%S').timetuple())
-                        # When the listings.csv data matches the database, update to make from_live == 0.
-                        if int(listing['collected_at']) == updated and not from_live:
-                            liveList.append((cur_station,))
-                        # Unless the import file data is newer, nothing else needs to be done for this station,
-                        # so the rest of the listings for this station can be skipped.
-                        if int(listing['collected_at']) <= updated:
-                            skipStation = True
-                            continue
-                        
-                        # The data from the import file is newer, so we need to delete the old data for this station.
-                        delList.append((cur_station,))
-                
-                if skipStation:
-                    continue
-                
-                # Since this station is not being skipped, get the data and prepare for insertion into the DB.
-                item_id = int(listing['commodity_id'])
-                # listings.csv includes rare items, which we are ignoring.
-                if item_id not in items:
-                    continue
-                modified = datetime.datetime.utcfromtimestamp(int(listing['collected_at'])).strftime('%Y-%m-%d %H:%M:%S')
-                demand_price = int(listing['sell_price'])
-                demand_units = int(listing['demand'])
-                demand_level = int(listing['demand_bracket']) if listing['demand_bracket'] != '' else -1
-                supply_price = int(listing['buy_price'])
-                supply_units = int(listing['supply'])
-                supply_level = int(listing['supply_bracket']) if listing['supply_bracket'] != '' else -1
+                    if station_id not in importing:
+                        importing[station_id] = True
+                        # Check if listing already exists in DB and needs updated.
+                        # Only need to check the date for the first item at a specific station.
+                        result = self.execute("SELECT modified FROM StationItem WHERE station_id = ?", (station_id,)).fetchone()
+                        if result:
+                            updated = timegm(datetime.datetime.strptime(result[0].split('.')[0], '%Y-%m-%d %H:%M:%S').timetuple())
+                            # When the listings.csv data matches the database, update to make from_live == 0.
+                            if collected_at == updated and not from_live:
+                                liveList.append((station_id,))
+                            # Unless the import file data is newer, nothing else needs to be done for this station,
+                            # so the rest of the listings for this station can be skipped.
+                            if collected_at <= updated:
+                                importing[station_id] = False
+                                continue
+                            
+                            # The data from the import file is newer, so we need to delete the old data for this station.
+                            delList.append((station_id,))
+                    
+                    if importing[station_id]:
+                        listingList.extend(
+                            (station_id,) + listing + (from_live,) for listing in listings
+                        )
                 
-                listingList.append((station_id, item_id, modified,
-                                    demand_price, demand_units, demand_level,
-                                    supply_price, supply_units, supply_level, from_live))
-            
-            while prog.value < prog.maxValue:
-                prog.increment(1, postfix = lambda value, goal: " " + str(round(value / total * 100)) + "%")
-            prog.clear()
-            
-            tdenv.NOTE("Import file processing complete, updating database. {}", self.now())
-            if liveList:
-                tdenv.NOTE("Marking data now in the EDDB listings.csv as no longer 'live'. {}", self.now())
-                self.executemany(liveStmt, liveList)
-            if delList:
-                tdenv.NOTE("Deleting old listing data. {}", self.now())
-                self.executemany(delStmt, delList)
-            if listingList:
-                tdenv.NOTE("Inserting new listing data. {}", self.now())
-                self.executemany(listingStmt, listingList)
+                if liveList:
+                    self.executemany(liveStmt, liveList)
+                if delList:
+                    self.executemany(delStmt, delList)
+                if listingList:
+                    self.executemany(listingStmt, listingList)
+                prog.increment(size, postfix = lambda value, goal: " " + str(round(value / goal * 100)) + "%")
+        finally:
+            if pool:
+                pool.terminate()
+        prog.clear()
         
         self.updated['Listings'] = True
         tdenv.NOTE("Finished processing market data. End time = {}", self.now())
@@ -990,11 +1042,11 @@ class ImportPlugin(plugins.ImportPluginBase):
             pass
         
         # Run 'listings' by default:
-        # If no options, or if only 'progbar', 'force', 'skipvend', and/or 'fallback',
+        # If no options, or if only 'progbar', 'force', 'skipvend', 'workers', and/or 'fallback',
         # have been passed, enable 'listings'.
         default = True
         for option in self.options:
-            if not option in ('force', 'fallback', 'skipvend', 'progbar'):
+            if not option in ('force', 'fallback', 'skipvend', 'progbar', 'workers'):
                 default = False
         if default:
             self.options["listings"] = True
@@ -1160,10 +1212,102 @@ class ImportPlugin(plugins.ImportPluginBase):
         tdb.close()
         
         if self.updated['Listings']:
-            tdenv.NOTE("Regenerating .prices file.")
-            cache.regeneratePricesFile(tdb, tdenv)
+            tdenv.NOTE("Exporting prices.")
+            cache.exportBinaryPrices(tdb, tdenv)
         
         tdenv.NOTE("Import completed.")
         
         # TD doesn't need to do anything, tell it to just quit.
         return False
+
+
+def _listingsChunks(path, chunkSize):
+    """
+    Splits a listings file into byte ranges of roughly chunkSize,
+    each starting with the first listing for a station.
+    
+    Returns (fieldnames, [(start, stop), ...], size).
+    """
+    with open(path, "rb") as fh:
+        header = fh.readline()
+        fieldnames = next(csv.reader([header.decode("utf-8", errors = 'ignore')]), [])
+        size = os.fstat(fh.fileno()).st_size
+        if 'station_id' not in fieldnames:
+            return fieldnames, [], size
+        stationCol = fieldnames.index('station_id')
+        
+        def stationOf(line):
+            fields = line.split(b',')
+            return fields[stationCol] if len(fields) > stationCol else None
+        
+        bounds, start = [], fh.tell()
+        while start < size:
+            stop = start + chunkSize
+            if stop < size:
+                # Skip to the next full line, then on to the next station.
+                fh.seek(stop)
+                fh.readline()
+                stop = fh.tell()
+                station = stationOf(fh.readline())
+                while True:
+                    line = fh.readline()
+                    if not line:
+                        stop = size
+                        break
+                    if stationOf(line) != station:
+                        break
+                    stop = fh.tell()
+            bounds.append((start, min(stop, size)))
+            start = stop
+    return fieldnames, bounds, size
+
+
+def _parseListings(job):
+    """
+    Parses one chunk of a listings file for ImportPlugin.importListings.
+    
+    Returns (size, stations) where stations is a list of
+    (station_id, collected_at, listings) in file order, collected_at
+    being that of the station's first listing, and listings a list of
+    (item_id, modified, demand_price, demand_units, demand_level,
+     supply_price, supply_units, supply_level) for known items.
+    """
+    path, start, stop, fieldnames, items = job
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        data = fh.read(stop - start)
+    
+    col = {name: index for index, name in enumerate(fieldnames)}
+    stationCol, itemCol, collectedCol = col['station_id'], col['commodity_id'], col['collected_at']
+    sellCol, demandCol, demandBracketCol = col['sell_price'], col['demand'], col['demand_bracket']
+    buyCol, supplyCol, supplyBracketCol = col['buy_price'], col['supply'], col['supply_bracket']
+    items = frozenset(items)
+    
+    # Most listings share a handful of timestamps.
+    modifiedAt = {}
+    
+    stations, cur_station, listings = [], None, None
+    for row in csv.reader(data.decode("utf-8", errors = 'ignore').splitlines()):
+        if not row:
+            continue
+        station_id = int(row[stationCol])
+        collected_at = int(row[collectedCol])
+        if station_id != cur_station:
+            cur_station, listings = station_id, []
+            stations.append((station_id, collected_at, listings))
+        
+        # listings.csv includes rare items, which we are ignoring.
+        item_id = int(row[itemCol])
+        if item_id not in items:
+            continue
+        modified = modifiedAt.get(collected_at)
+        if modified is None:
+            modified = modifiedAt[collected_at] = datetime.datetime.utcfromtimestamp(collected_at).strftime('%Y-%m-%d %H:%M:%S')
+        demand_bracket, supply_bracket = row[demandBracketCol], row[supplyBracketCol]
+        listings.append((
+            item_id, modified,
+            int(row[sellCol]), int(row[demandCol]), int(demand_bracket) if demand_bracket != '' else -1,
+            int(row[buyCol]), int(row[supplyCol]), int(supply_bracket) if supply_bracket != '' else -1,
+        ))
+    
+    return stop - start, stations
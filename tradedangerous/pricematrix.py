@@ -0,0 +1,403 @@
+# --------------------------------------------------------------------
+# Copyright (C) Oliver 'kfsone' Smith 2014 <oliver@kfs.org>:
+# Copyright (C) Bernd 'Gazelle' Gollesch 2016, 2017
+# Copyright (C) Jonathan 'eyeonus' Jones 2018, 2019
+#
+# You are free to use, redistribute, or even print and eat a copy of
+# this software so long as you include this copyright notice.
+# I guarantee there is at least one bug neither of us knew about.
+# --------------------------------------------------------------------
+# TradeDangerous :: Modules :: Columnar price store
+
+"""
+PriceMatrix provides a compact, columnar (CSR-style) copy of the
+StationItem table for use by TradeCalc.
+
+Rather than keeping a Python list of tuples for every station, each
+side of the market (what stations are selling and what they are
+buying) is stored as a handful of NumPy arrays sorted by station and
+then by item. A station's prices are the slice
+offsets[row]:offsets[row+1] of those arrays.
+
+Comparing two stations is then a scatter of the source row into a
+dense item vector followed by a gather, difference and mask over the
+destination row.
+
+Classes:
+    
+    PriceSide
+        One side (selling or buying) of the market in CSR form.
+    
+    PriceMatrix
+        Both sides of the market plus the item column index.
+    
+    StationRows
+        Read-only mapping of station ID -> list of price tuples that
+        mimics the TradeCalc.stationsSelling/stationsBuying layout.
+"""
+
+######################################################################
+# Imports
+
+from collections.abc import Mapping
+
+import numpy
+
+######################################################################
+# Classes
+
+
+class PriceSide(object):
+    """
+    One side of the market (selling or buying) in CSR layout.
+    
+    Attributes:
+        stationIDs
+            Sorted array of the station IDs that have at least one price,
+        offsets
+            Array of len(stationIDs)+1 offsets into the column arrays,
+        rowByStation
+            Dictionary of station ID -> row number,
+        items
+            Item column number (see PriceMatrix.itemIDs) of each entry,
+        price, units, level
+            The StationItem values for each entry,
+        modified
+            The unix timestamp of each entry.
+    """
+    
+    __slots__ = (
+        'stationIDs', 'offsets', 'rowByStation',
+        'items', 'price', 'units', 'level', 'modified',
+    )
+    
+    def __init__(self, stations, items, price, units, level, modified):
+        """
+        Builds the CSR layout from parallel arrays, which must already
+        be sorted by station and then by item column.
+        """
+        self.items = numpy.ascontiguousarray(items, dtype=numpy.int32)
+        self.price = numpy.ascontiguousarray(price, dtype=numpy.int32)
+        self.units = numpy.ascontiguousarray(units, dtype=numpy.int32)
+        self.level = numpy.ascontiguousarray(level, dtype=numpy.int8)
+        self.modified = numpy.ascontiguousarray(modified, dtype=numpy.int64)
+        
+        stationIDs, starts = numpy.unique(stations, return_index=True)
+        self.stationIDs = stationIDs.astype(numpy.int64)
+        offsets = numpy.empty(len(stationIDs) + 1, dtype=numpy.int64)
+        offsets[:-1] = starts
+        offsets[-1] = len(self.items)
+        self.offsets = offsets
+        self.rowByStation = {
+            ID: row for row, ID in enumerate(self.stationIDs.tolist())
+        }
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def span(self, stationID):
+        """
+        Returns the (start, stop) range of a station's entries, or
+        None if the station has no prices on this side.
+        """
+        row = self.rowByStation.get(stationID, None)
+        if row is None:
+            return None
+        offsets = self.offsets
+        return int(offsets[row]), int(offsets[row + 1])
+
+
+class StationRows(Mapping):
+    """
+    Read-only dictionary-alike of station ID -> list of
+    (itemID, price, units, level, ageS) tuples.
+    
+    This lets code written against the old defaultdict(list) layout
+    of TradeCalc.stationsSelling/stationsBuying keep working, while
+    the tuples are only materialized for the stations actually asked
+    for.
+    """
+    
+    def __init__(self, matrix, side):
+        self._matrix = matrix
+        self._side = side
+    
+    def __getitem__(self, stationID):
+        span = self._side.span(stationID)
+        if span is None:
+            raise KeyError(stationID)
+        return self._matrix.rowTuples(self._side, *span)
+    
+    def __contains__(self, stationID):
+        return stationID in self._side.rowByStation
+    
+    def __iter__(self):
+        return iter(self._side.rowByStation)
+    
+    def __len__(self):
+        return len(self._side.rowByStation)
+
+
+class PriceMatrix(object):
+    """
+    Columnar copy of the StationItem price data.
+    
+    Attributes:
+        itemIDs
+            Array mapping item column -> item ID,
+        itemCol
+            Dictionary mapping item ID -> item column,
+        selling
+            PriceSide of the items stations are selling (supply),
+        buying
+            PriceSide of the items stations are buying (demand),
+        now
+            The unix timestamp ages are measured against.
+    """
+    
+    # Number of rows to pull from the cursor at a time when loading.
+    fetchSize = 65536
+    
+    def __init__(self, itemIDs, selling, buying, now):
+        self.itemIDs = numpy.ascontiguousarray(itemIDs, dtype=numpy.int64)
+        self.itemCol = {
+            ID: col for col, ID in enumerate(self.itemIDs.tolist())
+        }
+        self.selling = selling
+        self.buying = buying
+        self.now = int(now)
+        self._denseID = None
+        self._denseRow = None
+    
+    @classmethod
+    def fromRows(cls, rows, now, minSupply=1, minDemand=0):
+        """
+        Build a PriceMatrix from an iterable or cursor of
+            (station_id, item_id, timestamp,
+             demand_price, demand_units, demand_level,
+             supply_price, supply_units, supply_level)
+        rows, where timestamp is an integer unix time.
+        
+        Selling entries require supply_price > 0 and at least minSupply
+        units; buying entries require demand_price > 0 and at least
+        minDemand units (or unknown demand, -1).
+        
+        Raises ValueError if a timestamp is missing; use badTimestamp()
+        to find out which row was responsible.
+        """
+        fetch = getattr(rows, 'fetchmany', None)
+        if fetch is None:
+            rows = iter(rows)
+            
+            def fetch(size):
+                return [row for _, row in zip(range(size), rows)]
+        
+        chunks = []
+        while True:
+            block = fetch(cls.fetchSize)
+            if not block:
+                break
+            try:
+                chunks.append(numpy.array(block, dtype=numpy.int64))
+            except TypeError:
+                raise ValueError(cls.badTimestamp(block))
+        if chunks:
+            data = numpy.concatenate(chunks)
+        else:
+            data = numpy.zeros((0, 9), dtype=numpy.int64)
+        
+        return cls.fromColumns(data.T, now, minSupply, minDemand)
+    
+    @classmethod
+    def fromColumns(cls, columns, now, minSupply=1, minDemand=0):
+        """
+        Build a PriceMatrix from the nine columns of the rows fromRows
+        takes, as arrays (e.g. from a PriceSnapshot).
+        """
+        (
+            stnIDs, itmIDs, stamps,
+            dmdCr, dmdUnits, dmdLevel,
+            supCr, supUnits, supLevel,
+        ) = columns
+        
+        itemIDs, itemCols = numpy.unique(itmIDs, return_inverse=True)
+        itemCols = itemCols.reshape(-1)
+        
+        def makeSide(mask, price, units, level):
+            order = numpy.lexsort((itemCols[mask], stnIDs[mask]))
+            return PriceSide(
+                stnIDs[mask][order], itemCols[mask][order],
+                price[mask][order], units[mask][order],
+                level[mask][order], stamps[mask][order],
+            )
+        
+        selling = makeSide(
+            (supCr > 0) & (supUnits >= minSupply),
+            supCr, supUnits, supLevel,
+        )
+        buying = makeSide(
+            (dmdCr > 0) & ((dmdUnits >= minDemand) | (dmdUnits == -1)),
+            dmdCr, dmdUnits, dmdLevel,
+        )
+        
+        return cls(itemIDs, selling, buying, now)
+    
+    @staticmethod
+    def badTimestamp(block):
+        """
+        Returns the (station_id, item_id, timestamp) of the first row
+        in block that has an unusable timestamp, or None.
+        """
+        for row in block:
+            try:
+                int(row[2])
+            except (TypeError, ValueError):
+                return tuple(row[:3])
+        return None
+    
+    @property
+    def stationsSelling(self):
+        """ StationRows view of the selling side. """
+        return StationRows(self, self.selling)
+    
+    @property
+    def stationsBuying(self):
+        """ StationRows view of the buying side. """
+        return StationRows(self, self.buying)
+    
+    def rowTuples(self, side, start, stop):
+        """
+        Returns a station's entries as the list of
+        (itemID, price, units, level, ageS) tuples used by TradeCalc.
+        """
+        return list(zip(
+            self.itemIDs[side.items[start:stop]].tolist(),
+            side.price[start:stop].tolist(),
+            side.units[start:stop].tolist(),
+            side.level[start:stop].tolist(),
+            (self.now - side.modified[start:stop]).tolist(),
+        ))
+    
+    def _sellingPositions(self, srcID):
+        """
+        Scatters the selling row of srcID into a dense vector indexed
+        by item column, holding the entry position or -1.
+        
+        The last source is kept because getBestHops compares one source
+        against many destinations in a row.
+        """
+        if self._denseID == srcID:
+            return self._denseRow
+        span = self.selling.span(srcID)
+        if span is None:
+            return None
+        start, stop = span
+        dense = numpy.full(len(self.itemIDs), -1, dtype=numpy.int64)
+        dense[self.selling.items[start:stop]] = numpy.arange(start, stop)
+        self._denseID, self._denseRow = srcID, dense
+        return dense
+    
+    def compare(self, srcID, dstID, minGainCr=1, maxGainCr=None, maxCostCr=None):
+        """
+        Vectorized comparison of what srcID sells against what dstID
+        buys.
+        
+        Returns None if either station has no prices, otherwise a
+        tuple of (srcPos, dstPos, gainCr) arrays, where srcPos and
+        dstPos are entry positions within the selling/buying sides.
+        Results are ordered by gain descending then cost ascending.
+        """
+        dense = self._sellingPositions(srcID)
+        if dense is None:
+            return None
+        span = self.buying.span(dstID)
+        if span is None:
+            return None
+        start, stop = span
+        
+        srcPos = dense[self.buying.items[start:stop]]
+        dstPos = numpy.flatnonzero(srcPos >= 0) + start
+        srcPos = srcPos[srcPos >= 0]
+        
+        costCr = self.selling.price[srcPos].astype(numpy.int64)
+        gainCr = self.buying.price[dstPos] - costCr
+        mask = gainCr >= minGainCr
+        if maxGainCr:
+            mask &= gainCr <= maxGainCr
+        if maxCostCr is not None:
+            mask &= costCr <= maxCostCr
+        srcPos, dstPos = srcPos[mask], dstPos[mask]
+        costCr, gainCr = costCr[mask], gainCr[mask]
+        
+        order = numpy.lexsort((costCr, -gainCr))
+        return srcPos[order], dstPos[order], gainCr[order]
+    
+    def compareMany(
+            self, srcID, dstIDs,
+            minGainCr=1, maxGainCr=None, maxCostCr=None,
+            ):
+        """
+        Vectorized comparison of what srcID sells against what each of
+        dstIDs buys, in a single pass.
+        
+        The selling row of srcID is broadcast against the concatenated
+        buying rows of every destination.
+        
+        Returns None if srcID sells nothing, otherwise a tuple of
+        (group, srcPos, dstPos, gainCr) arrays, where group is the index
+        into dstIDs that each candidate trade belongs to. Candidates are
+        ordered by group, then gain descending, then cost ascending.
+        """
+        dense = self._sellingPositions(srcID)
+        if dense is None:
+            return None
+        buying = self.buying
+        rowByStation = buying.rowByStation
+        groups, rows = [], []
+        for idx, dstID in enumerate(dstIDs):
+            row = rowByStation.get(dstID, None)
+            if row is not None:
+                groups.append(idx)
+                rows.append(row)
+        rows = numpy.array(rows, dtype=numpy.int64)
+        starts = buying.offsets[rows]
+        lengths = buying.offsets[rows + 1] - starts
+        total = int(lengths.sum())
+        
+        # Expand each [start, stop) span into a flat list of positions.
+        group = numpy.repeat(numpy.array(groups, dtype=numpy.int64), lengths)
+        firstOfSpan = numpy.cumsum(lengths) - lengths
+        dstPos = (
+            numpy.arange(total, dtype=numpy.int64) +
+            numpy.repeat(starts - firstOfSpan, lengths)
+        )
+        
+        srcPos = dense[buying.items[dstPos]]
+        mask = srcPos >= 0
+        group, srcPos, dstPos = group[mask], srcPos[mask], dstPos[mask]
+        
+        costCr = self.selling.price[srcPos].astype(numpy.int64)
+        gainCr = buying.price[dstPos] - costCr
+        mask = gainCr >= minGainCr
+        if maxGainCr:
+            mask &= gainCr <= maxGainCr
+        if maxCostCr is not None:
+            mask &= costCr <= maxCostCr
+        group, srcPos, dstPos = group[mask], srcPos[mask], dstPos[mask]
+        costCr, gainCr = costCr[mask], gainCr[mask]
+        
+        order = numpy.lexsort((costCr, -gainCr, group))
+        return group[order], srcPos[order], dstPos[order], gainCr[order]
+    
+    def hasAffordable(self, stationID, maxCostCr=None):
+        """
+        True if stationID sells at least one item costing at most
+        maxCostCr (or anything at all if maxCostCr is None).
+        """
+        span = self.selling.span(stationID)
+        if span is None:
+            return False
+        start, stop = span
+        if maxCostCr is None:
+            return stop > start
+        return bool((self.selling.price[start:stop] <= maxCostCr).any())
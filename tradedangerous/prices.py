@@ -32,12 +32,17 @@ def dumpPrices(
             stationID=None,     # limits to one station
             file=None,          # file handle to write to
             defaultZero=False,
-            debug=0
+            debug=0,
+            stationIDs=None,    # limits to these stations
+            index=None,         # list to record block sizes in
     ):
     """
         Generate a prices list using data from the DB.
         If stationID is not none, only the specified station is dumped.
         If file is not none, outputs to the given file handle.
+        If index is not none, (None, size) of the header and then
+        (stationID, size) of each station's block are appended to it,
+        with sizes in bytes when encoded as UTF-8.
     """
     
     withTimes  = (elementMask & Element.timestamp)
@@ -77,6 +82,10 @@ def dumpPrices(
     defaultDemandVal = 0 if defaultZero else -1
     if stationID:
         stationWhere = "WHERE stn.station_id = {}".format(stationID)
+    elif stationIDs is not None:
+        stationWhere = "WHERE stn.station_id IN ({})".format(
+            ",".join(str(int(ID)) for ID in stationIDs)
+        )
     else:
         stationWhere = ""
     
@@ -104,7 +113,7 @@ def dumpPrices(
                     ON (si.station_id = stn.station_id
                         AND si.item_id = itm.item_id)
                 {stationWhere}
-         ORDER  BY stn.station_id, cat.name, itm.ui_order
+         ORDER  BY stn.station_id, cat.name, itm.ui_order, itm.item_id
     """
     
     sql = stmt.format(
@@ -123,7 +132,7 @@ def dumpPrices(
     else:
         stationSet = "ALL Systems/Stations"
     
-    file.write(
+    header = (
         "# TradeDangerous prices for {}\n"
         "\n"
         "# REMOVE ITEMS THAT DON'T APPEAR IN THE UI\n"
@@ -166,7 +175,10 @@ def dumpPrices(
         "Demand", "Supply",
         "Timestamp",
     )
-    file.write('#' + output[1:])
+    header += '#' + output[1:]
+    file.write(header)
+    if index is not None:
+        index.append((None, len(header.encode())))
     
     naIQL = "-"
     unkIQL = "?"
@@ -180,6 +192,8 @@ def dumpPrices(
         item, catID, category = items[itemID]
         if stnID != lastStn:
             file.write(output)
+            if index is not None and lastStn is not None:
+                index.append((lastStn, len(output.encode())))
             output = "\n\n@ {} / {}\n".format(system, station)
             lastStn = stnID
             lastCat = None
@@ -222,6 +236,8 @@ def dumpPrices(
                 )
     
     file.write(output)
+    if index is not None and lastStn is not None:
+        index.append((lastStn, len(output.encode())))
 
 if __name__ == "__main__":
     import tradedb
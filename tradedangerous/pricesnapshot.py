@@ -0,0 +1,215 @@
+# --------------------------------------------------------------------
+# Copyright (C) Oliver 'kfsone' Smith 2014 <oliver@kfs.org>:
+# Copyright (C) Bernd 'Gazelle' Gollesch 2016, 2017
+# Copyright (C) Jonathan 'eyeonus' Jones 2018, 2019
+#
+# You are free to use, redistribute, or even print and eat a copy of
+# this software so long as you include this copyright notice.
+# I guarantee there is at least one bug neither of us knew about.
+# --------------------------------------------------------------------
+# TradeDangerous :: Modules :: Price snapshot
+
+"""
+PriceSnapshot is a binary copy of the StationItem prices that
+TradeCalc loads, stored next to the .db (TradeDangerous.pricecache)
+and memory-mapped by later runs instead of querying SQLite.
+
+The snapshot holds every row that could ever be loaded, in the order
+SQLite returned them, with the "modified" times already converted to
+unix timestamps. The maxAge, item and supply/demand filters are all
+applied to the arrays when the snapshot is used, so one snapshot
+serves every combination of them.
+
+It is keyed on the size and modification time of the .db (and its
+-wal file, if any); when those change the snapshot is rebuilt.
+
+File layout (all little-endian, each array 8-byte aligned):
+    magic               b'TDPRICE\\0'
+    headerLen           uint32, length of the JSON header
+    header              {"version", "state", "rows"}
+    one array per column, see PriceSnapshot.columns
+"""
+
+######################################################################
+# Imports
+
+import json
+import os
+import struct
+
+import numpy
+
+######################################################################
+# Classes
+
+
+class PriceSnapshot(object):
+    """
+    Memory-mapped StationItem prices.
+    
+    Attributes:
+        path
+            Path of the snapshot file,
+        state
+            The dbState() the snapshot was taken at,
+        arrays
+            Dictionary of column name -> (read-only) array.
+    """
+    
+    magic = b'TDPRICE\0'
+    version = 1
+    
+    # Suffix of the snapshot that lives beside the .db
+    suffix = '.pricecache'
+    
+    # (name, dtype) in the order TradeCalc's StationItem query returns them.
+    columns = (
+        ('station', '<i8'),
+        ('item', '<i8'),
+        ('modified', '<i8'),
+        ('demandPrice', '<i4'),
+        ('demandUnits', '<i4'),
+        ('demandLevel', '<i4'),
+        ('supplyPrice', '<i4'),
+        ('supplyUnits', '<i4'),
+        ('supplyLevel', '<i4'),
+    )
+    
+    # Number of rows to pull from the cursor at a time when building.
+    fetchSize = 65536
+    
+    def __init__(self, path):
+        self.path = path
+        with open(str(path), 'rb') as fh:
+            magic = fh.read(len(self.magic))
+            if magic != self.magic:
+                raise ValueError("{}: not a price snapshot".format(path))
+            headerLen, = struct.unpack('<I', fh.read(4))
+            header = json.loads(fh.read(headerLen).decode())
+        if header.get('version') != self.version:
+            raise ValueError("{}: unsupported version".format(path))
+        
+        self.state = header['state']
+        numRows = header['rows']
+        offset = _align(len(self.magic) + 4 + headerLen)
+        self.arrays = {}
+        for name, dtype in self.columns:
+            if numRows:
+                self.arrays[name] = numpy.memmap(
+                    str(path), dtype=dtype, mode='r',
+                    offset=offset, shape=(numRows,),
+                )
+            else:
+                self.arrays[name] = numpy.zeros(0, dtype=dtype)
+            offset = _align(offset + numRows * numpy.dtype(dtype).itemsize)
+    
+    def __len__(self):
+        return len(self.arrays['station'])
+    
+    @staticmethod
+    def dbState(dbPath):
+        """
+        Returns the [size, mtime] of the .db and its -wal file (or None),
+        which changes whenever the database does.
+        
+        An empty -wal holds no changes, and is created by any connection
+        to a database in WAL mode, so it counts as None.
+        """
+        state = []
+        for path in (str(dbPath), str(dbPath) + '-wal'):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                st = None
+            if st is None or (path != str(dbPath) and not st.st_size):
+                state.append(None)
+            else:
+                state.append([st.st_size, st.st_mtime_ns])
+        return state
+    
+    def matches(self, state):
+        return self.state == state
+    
+    def select(self, cutoff=None, itemIDs=None):
+        """
+        Returns the list of column arrays (in the order of columns) for
+        the rows modified at or after the unix time cutoff and, if
+        itemIDs is given, for those items only.
+        """
+        arrays = [self.arrays[name] for name, _ in self.columns]
+        mask = None
+        if cutoff is not None:
+            mask = self.arrays['modified'] >= cutoff
+        if itemIDs is not None:
+            wanted = numpy.isin(
+                self.arrays['item'],
+                numpy.fromiter(itemIDs, dtype=numpy.int64),
+            )
+            mask = wanted if mask is None else (mask & wanted)
+        if mask is None:
+            return arrays
+        return [array[mask] for array in arrays]
+    
+    @classmethod
+    def build(cls, path, state, rows):
+        """
+        Writes the snapshot of rows, a cursor over
+            (station_id, item_id, timestamp,
+             demand_price, demand_units, demand_level,
+             supply_price, supply_units, supply_level)
+        taken at the given dbState(), to path.
+        
+        Rows that could never be traded (no demand price and nothing
+        for sale) are left out.
+        
+        Raises ValueError if a timestamp is missing.
+        """
+        chunks = []
+        while True:
+            block = rows.fetchmany(cls.fetchSize)
+            if not block:
+                break
+            try:
+                data = numpy.array(block, dtype=numpy.int64)
+            except TypeError:
+                raise ValueError("missing timestamp")
+            useful = (data[:, 3] > 0) | ((data[:, 6] > 0) & (data[:, 7] > 0))
+            chunks.append(data[useful])
+        if chunks:
+            data = numpy.concatenate(chunks)
+        else:
+            data = numpy.zeros((0, len(cls.columns)), dtype=numpy.int64)
+        
+        header = json.dumps({
+            'version': cls.version,
+            'state': state,
+            'rows': len(data),
+        }).encode()
+        
+        # Write to a temporary file so readers never see a partial snapshot.
+        tmpPath = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with open(tmpPath, 'wb') as fh:
+                fh.write(cls.magic)
+                fh.write(struct.pack('<I', len(header)))
+                fh.write(header)
+                for col, (name, dtype) in enumerate(cls.columns):
+                    fh.write(b'\0' * (_align(fh.tell()) - fh.tell()))
+                    fh.write(numpy.ascontiguousarray(
+                        data[:, col], dtype=dtype
+                    ).tobytes())
+            os.replace(tmpPath, str(path))
+        except OSError:
+            if os.path.exists(tmpPath):
+                os.unlink(tmpPath)
+            raise
+        
+        return cls(path)
+
+
+######################################################################
+# Helpers
+
+
+def _align(offset):
+    return (offset + 7) & ~7
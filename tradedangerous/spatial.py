@@ -0,0 +1,194 @@
+# --------------------------------------------------------------------
+# Copyright (C) Oliver 'kfsone' Smith 2014 <oliver@kfs.org>:
+# Copyright (C) Bernd 'Gazelle' Gollesch 2016, 2017
+# Copyright (C) Jonathan 'eyeonus' Jones 2018, 2019
+#
+# You are free to use, redistribute, or even print and eat a copy of
+# this software so long as you include this copyright notice.
+# I guarantee there is at least one bug neither of us knew about.
+# --------------------------------------------------------------------
+# TradeDangerous :: Modules :: Spatial indexes
+
+"""
+Spatial indexes over star system coordinates, used by
+TradeDB.querySphere to find the systems within a radius of a point.
+
+Each index is built from an (N, 3) array of float64 positions and
+answers query(center, radius) with the row numbers of the points in
+range and their squared distances, as NumPy arrays in no particular
+order. Squared distances are always dx*dx + dy*dy + dz*dz in float64
+so that every index returns exactly the same answer.
+
+Classes:
+    
+    GridIndex
+        Buckets points into fixed-size cubes (the original 32ly
+        "stellar grid") and scans the cubes overlapping the sphere.
+    
+    KDTreeIndex
+        A k-d tree with contiguous leaves; whole subtrees inside the
+        sphere are taken without testing each point.
+
+indexTypes maps the names accepted by TradeEnv.spatialIndex
+(TD_SPATIAL) to the classes.
+"""
+
+######################################################################
+# Imports
+
+import math
+
+import numpy
+
+######################################################################
+# Helpers
+
+
+def _distSq(positions, rows, center):
+    """ Squared distances from center to positions[rows]. """
+    cx, cy, cz = center
+    pos = positions[rows]
+    dx, dy, dz = pos[:, 0] - cx, pos[:, 1] - cy, pos[:, 2] - cz
+    return dx*dx + dy*dy + dz*dz
+
+######################################################################
+# Classes
+
+
+class GridIndex(object):
+    """
+    Divides space into cubes of cellSize ly (32 by default, like the
+    original stellar grid) and keeps the rows of the points in each.
+    """
+    
+    def __init__(self, positions, cellSize=32):
+        self.positions = positions = numpy.asarray(positions, dtype=numpy.float64)
+        self.cellSize = cellSize
+        keys = numpy.floor(positions / cellSize).astype(numpy.int64)
+        # Group rows by cell with a sort rather than a Python loop.
+        order = numpy.lexsort((keys[:, 2], keys[:, 1], keys[:, 0]))
+        keys = keys[order]
+        if len(keys):
+            starts = numpy.flatnonzero(numpy.any(keys[1:] != keys[:-1], axis=1)) + 1
+            starts = numpy.concatenate(([0], starts))
+        else:
+            starts = numpy.zeros(0, dtype=numpy.int64)
+        stops = numpy.append(starts[1:], len(keys))
+        self.cells = {
+            key: order[start:stop]
+            for key, start, stop in zip(
+                map(tuple, keys[starts].tolist()),
+                starts.tolist(), stops.tolist()
+            )
+        }
+    
+    def query(self, center, radius):
+        cells, cellSize = self.cells, self.cellSize
+        lwr = [math.floor((c - radius) / cellSize) for c in center]
+        upr = [math.floor((c + radius) / cellSize) for c in center]
+        found = []
+        for x in range(lwr[0], upr[0] + 1):
+            for y in range(lwr[1], upr[1] + 1):
+                for z in range(lwr[2], upr[2] + 1):
+                    rows = cells.get((x, y, z), None)
+                    if rows is not None:
+                        found.append(rows)
+        if not found:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+        rows = numpy.concatenate(found)
+        distSq = _distSq(self.positions, rows, center)
+        keep = distSq <= radius ** 2
+        return rows[keep], distSq[keep]
+
+
+class KDTreeIndex(object):
+    """
+    k-d tree over the points. The rows are reordered so that every
+    node covers a contiguous range of self.order, and each node keeps
+    its bounding box; nodes are stored in flat lists.
+    """
+    
+    def __init__(self, positions, leafSize=64):
+        self.positions = positions = numpy.asarray(positions, dtype=numpy.float64)
+        order = numpy.arange(len(positions), dtype=numpy.int64)
+        lo, hi, left, right, bmin, bmax = [], [], [], [], [], []
+        
+        def addNode(start, stop):
+            node = len(lo)
+            pts = positions[order[start:stop]]
+            lo.append(start)
+            hi.append(stop)
+            left.append(-1)
+            right.append(-1)
+            bmin.append(pts.min(axis=0).tolist() if len(pts) else [0.] * 3)
+            bmax.append(pts.max(axis=0).tolist() if len(pts) else [0.] * 3)
+            return node
+        
+        stack = [addNode(0, len(positions))] if len(positions) else []
+        while stack:
+            node = stack.pop()
+            start, stop = lo[node], hi[node]
+            if stop - start <= leafSize:
+                continue
+            # Split the widest axis at the median.
+            spans = [mx - mn for mn, mx in zip(bmin[node], bmax[node])]
+            axis = spans.index(max(spans))
+            if spans[axis] <= 0:
+                continue
+            mid = (start + stop) // 2
+            rows = order[start:stop]
+            part = numpy.argpartition(positions[rows, axis], mid - start)
+            order[start:stop] = rows[part]
+            left[node] = addNode(start, mid)
+            right[node] = addNode(mid, stop)
+            stack.append(left[node])
+            stack.append(right[node])
+        
+        self.order = order
+        self.lo, self.hi, self.left, self.right = lo, hi, left, right
+        self.bmin, self.bmax = bmin, bmax
+    
+    def query(self, center, radius):
+        cx, cy, cz = center
+        radiusSq = radius ** 2
+        lo, hi, left, right = self.lo, self.hi, self.left, self.right
+        bmin, bmax = self.bmin, self.bmax
+        inside, check = [], []
+        stack = [0] if lo else []
+        while stack:
+            node = stack.pop()
+            (x0, y0, z0), (x1, y1, z1) = bmin[node], bmax[node]
+            # Nearest point of the box to the center.
+            dx = x0 - cx if cx < x0 else (cx - x1 if cx > x1 else 0.)
+            dy = y0 - cy if cy < y0 else (cy - y1 if cy > y1 else 0.)
+            dz = z0 - cz if cz < z0 else (cz - z1 if cz > z1 else 0.)
+            if dx*dx + dy*dy + dz*dz > radiusSq:
+                continue
+            # Farthest corner of the box from the center.
+            fx = max(cx - x0, x1 - cx)
+            fy = max(cy - y0, y1 - cy)
+            fz = max(cz - z0, z1 - cz)
+            if fx*fx + fy*fy + fz*fz <= radiusSq:
+                inside.append((lo[node], hi[node]))
+            elif left[node] < 0:
+                check.append((lo[node], hi[node]))
+            else:
+                stack.append(left[node])
+                stack.append(right[node])
+        
+        order = self.order
+        # Even "inside" points are re-tested: the box test isn't done
+        # with the same arithmetic, so could differ in the last bit.
+        spans = inside + check
+        if not spans:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+        rows = numpy.concatenate([order[start:stop] for start, stop in spans])
+        distSq = _distSq(self.positions, rows, center)
+        keep = distSq <= radiusSq
+        return rows[keep], distSq[keep]
+
+
+indexTypes = {
+    'grid': GridIndex,
+    'kdtree': KDTreeIndex,
+}
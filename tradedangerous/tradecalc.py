@@ -32,6 +32,9 @@ Classes:
     
     TradeLoad
         Describe a cargo load to be carried on a hop.
+    
+    OutboundTable
+        The best trade from each station to anywhere within reach.
 """
 
 ######################################################################
@@ -39,14 +42,21 @@ Classes:
 
 from collections import defaultdict
 from collections import namedtuple
+from collections import OrderedDict
 from .tradedb import System, Station, Trade, TradeDB, describeAge
 from .tradedb import Destination
+from .pricematrix import PriceMatrix
+from .pricesnapshot import PriceSnapshot
+from .tradeindex import TradeIndex
 from .tradeenv import TradeEnv
 from .tradeexcept import TradeException
 
+import calendar
 import datetime
 import locale
 import math
+import multiprocessing
+import numpy
 import os
 from .misc import progress as pbar
 import re
@@ -86,6 +96,11 @@ class BadTimestampError(TradeException):
 class NoHopsError(TradeException):
     pass
 
+
+class FitBudgetError(Exception):
+    """ Raised within TradeCalc.exactFit when it runs out of time or nodes. """
+    pass
+
 ######################################################################
 # Stuff that passes for classes (but isn't)
 
@@ -497,11 +512,62 @@ class Route(object):
         )
 
 
+class OutboundTable(object):
+    """
+    Station ID -> (best gain per ton, best destination station ID) of
+    the trades from each station to any station within maxJumps jumps
+    of up to maxLyPer ly, or (0, None) if there are none, worked out a
+    station at a time as TradeCalc.bestOutbound asks for them.
+    
+    Whatever only narrows the destinations down (pad sizes, avoided
+    places, ...) is ignored, so no hop of that reach can beat the gain.
+    
+    TradeDB keeps the tables of TradeCalcs that loaded the whole of
+    the market for their next TradeCalc, and refresh() marks the
+    stations whose prices it sees change as stale; the next TradeCalc
+    to use the table updates just the entries they could affect.
+    """
+    
+    def __init__(self, maxJumps, maxLyPer):
+        self.maxJumps, self.maxLyPer = maxJumps, maxLyPer
+        self.best = {}
+        self.stale = set()
+    
+    def __len__(self):
+        return len(self.best)
+    
+    def pricesChanged(self, stationIDs):
+        """ Marks stationIDs as having new prices, or whereabouts. """
+        self.stale.update(stationIDs)
+
+
 class TradeCalc(object):
     """
     Container for accessing trade calculations with common properties.
     """
     
+    # getBestHops won't fork a worker for fewer than this many routes.
+    minRoutesPerWorker = 8
+    
+    # Fit functions by their --fit names.
+    fitFunctions = {
+        'simple': 'simpleFit',
+        'fast': 'fastFit',
+        'brute': 'bruteForceFit',
+        'exact': 'exactFit',
+    }
+    
+    # exactFit returns the best load it has found when it has searched
+    # this many nodes, or for this many seconds.
+    exactFitNodes = 100000
+    exactFitSeconds = 0.25
+    
+    # Number of loads getBestHops remembers, see recallFit.
+    fitCacheSize = 1 << 18
+    # Fits whose load is still the fit, or one as profitable, for any
+    # credits between its cost and the credits it was fitted with.
+    rangedFits = frozenset(('simpleFit', 'bruteForceFit', 'exactFit'))
+    
     def __init__(self, tdb: TradeDB, tdenv: TradeEnv = None, fit = None, items = None):
         """
         Constructs the TradeCalc object and loads sell/buy data.
@@ -525,25 +591,55 @@ class TradeCalc(object):
                 Require at least this much supply to load an item
             tdenv.demand
                 Require at least this much demand to load an item
+            tdenv.fit
+                Name of the fit function to use, see fitFunctions
+            tdenv.priceMatrix
+                Load prices into a columnar PriceMatrix rather than
+                lists of tuples; stationsSelling and stationsBuying
+                become read-only views of the matrix.
+        
+        Prices are read from a PriceSnapshot of the StationItem table,
+        taken whenever the .db changes, unless NO_PRICE_SNAPSHOT is set
+        in the environment.
         """
         if not tdenv:
             tdenv = tdb.tdenv
         self.tdb = tdb
         self.tdenv = tdenv
-        self.defaultFit = fit or self.simpleFit
+        fitName = getattr(tdenv, 'fit', None)
+        if fit:
+            self.defaultFit = fit
+        elif fitName:
+            self.defaultFit = getattr(self, self.fitFunctions[fitName])
+        else:
+            self.defaultFit = self.simpleFit
         if "BRUTE_FIT" in os.environ:
             self.defaultFit = self.bruteForceFit
+        self.fitCache = OrderedDict()
+        self.fitCacheHits = self.fitCacheMisses = 0
+        self._bestGainPerTon = None
+        # OutboundTables by (maxJumps, maxLyPer), see outboundTable.
+        self.outboundTables = {}
         minSupply = self.tdenv.supply or 1
         minDemand = self.tdenv.demand or 0
         
-        db = tdb.getDB()
-        
+        # The .db the prices are from, see tradeIndex.
+        self.pricesState = PriceSnapshot.dbState(tdb.dbPath)
+        with tdb.readDB() as db:
+            self._loadPrices(db, items, minSupply, minDemand)
+    
+    def _loadPrices(self, db, items, minSupply, minDemand):
+        """ Loads the StationItem values, from the snapshot or db. """
+        tdb, tdenv = self.tdb, self.tdenv
         wheres, binds = [], []
+        cutoffStamp, loadItemIDs = None, None
         if tdenv.maxAge:
             maxDays = datetime.timedelta(days = tdenv.maxAge)
             cutoff = datetime.datetime.now() - maxDays
             wheres.append("(modified >= ?)")
             binds.append(str(cutoff.replace(microsecond = 0)))
+            # The same comparison against strftime('%s', modified).
+            cutoffStamp = calendar.timegm(cutoff.replace(microsecond = 0).timetuple())
         
         if tdenv.avoidItems or items:
             avoidItemIDs = set(item.ID for item in tdenv.avoidItems)
@@ -552,30 +648,59 @@ class TradeCalc(object):
             for item in loadItems:
                 ID = item if isinstance(item, int) else item.ID
                 if ID not in avoidItemIDs:
-                    loadItemIDs.add(str(ID))
+                    loadItemIDs.add(ID)
             if not loadItemIDs:
                 raise TradeException("No items to load.")
-            loadItemIDs = ",".join(str(ID) for ID in loadItemIDs)
-            wheres.append("(item_id IN ({}))".format(loadItemIDs))
+            wheres.append("(item_id IN ({}))".format(
+                ",".join(str(ID) for ID in loadItemIDs)
+            ))
+        
+        whereClause = " AND ".join(wheres) or "1"
+        
+        # What TradeDB keeps our OutboundTables by for TradeCalcs that
+        # load the same prices; a maxAge cutoff moves on with time.
+        self.pricesKey = None
+        if cutoffStamp is None:
+            self.pricesKey = (
+                minSupply, minDemand,
+                frozenset(loadItemIDs) if loadItemIDs else None,
+            )
+        
+        self.priceMatrix = None
+        snapshot = None
+        if "NO_PRICE_SNAPSHOT" not in os.environ:
+            snapshot = self._loadPriceSnapshot(db)
+        
+        if snapshot is not None:
+            columns = snapshot.select(cutoffStamp, loadItemIDs)
+            if getattr(tdenv, 'priceMatrix', False):
+                self._setPriceMatrix(PriceMatrix.fromColumns(
+                    columns, int(time.time()), minSupply, minDemand
+                ))
+                return
+            tdenv.DEBUG1("TradeCalc loading StationItem values from snapshot")
+            cur = zip(*(column.tolist() for column in columns))
+        elif getattr(tdenv, 'priceMatrix', False):
+            self._loadPriceMatrix(db, whereClause, binds, minSupply, minDemand)
+            return
         
         demand = self.stationsBuying = defaultdict(list)
         supply = self.stationsSelling = defaultdict(list)
         
-        whereClause = " AND ".join(wheres) or "1"
-        
         lastStnID, stnAppend = 0, None
         dmdCount, supCount = 0, 0
-        stmt = """
-                SELECT  station_id, item_id,
-                        strftime('%s', modified),
-                        demand_price, demand_units, demand_level,
-                        supply_price, supply_units, supply_level
-                  FROM  StationItem
-                 WHERE  {where}
-        """.format(where = whereClause)
-        tdenv.DEBUG1("TradeCalc loading StationItem values")
-        tdenv.DEBUG2("sql: {}, binds: {}", stmt, binds)
-        cur = db.execute(stmt, binds)
+        if snapshot is None:
+            stmt = """
+                    SELECT  station_id, item_id,
+                            strftime('%s', modified),
+                            demand_price, demand_units, demand_level,
+                            supply_price, supply_units, supply_level
+                      FROM  StationItem
+                     WHERE  {where}
+            """.format(where = whereClause)
+            tdenv.DEBUG1("TradeCalc loading StationItem values")
+            tdenv.DEBUG2("sql: {}, binds: {}", stmt, binds)
+            cur = db.execute(stmt, binds)
         now = int(time.time())
         for (stnID, itmID,
                 timestamp,
@@ -602,6 +727,83 @@ class TradeCalc(object):
         
         tdenv.DEBUG0("Loaded {} buys, {} sells".format(dmdCount, supCount))
     
+    def _loadPriceSnapshot(self, db):
+        """
+        Returns the PriceSnapshot for the current state of the DB,
+        taking a new one if need be, or None if that isn't possible.
+        """
+        tdb, tdenv = self.tdb, self.tdenv
+        path = tdb.dbPath.with_suffix(PriceSnapshot.suffix)
+        # Before querying, so a change made meanwhile forces a rebuild.
+        state = PriceSnapshot.dbState(tdb.dbPath)
+        # A long-lived TradeDB (trade serve) keeps the last one mapped.
+        snapshot = tdb.priceSnapshot
+        if snapshot is not None and snapshot.matches(state):
+            tdenv.DEBUG1("Using resident price snapshot")
+            return snapshot
+        tdb.priceSnapshot = None
+        try:
+            snapshot = PriceSnapshot(path)
+            if snapshot.matches(state):
+                tdenv.DEBUG1("Using price snapshot {}", path)
+                tdb.priceSnapshot = snapshot
+                return snapshot
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            tdenv.DEBUG0("Ignoring price snapshot: {}", e)
+        
+        tdenv.DEBUG0("Taking price snapshot {}", path)
+        cur = db.execute("""
+                SELECT  station_id, item_id,
+                        CAST(strftime('%s', modified) AS INTEGER),
+                        demand_price, demand_units, demand_level,
+                        supply_price, supply_units, supply_level
+                  FROM  StationItem
+        """)
+        try:
+            tdb.priceSnapshot = PriceSnapshot.build(path, state, cur)
+            return tdb.priceSnapshot
+        except (OSError, ValueError) as e:
+            # Loading straight from the DB will report bad timestamps.
+            tdenv.DEBUG0("Couldn't take price snapshot: {}", e)
+            return None
+    
+    def _loadPriceMatrix(self, db, whereClause, binds, minSupply, minDemand):
+        """
+        Loads the StationItem values into a PriceMatrix.
+        """
+        tdenv = self.tdenv
+        stmt = """
+                SELECT  station_id, item_id,
+                        CAST(strftime('%s', modified) AS INTEGER),
+                        demand_price, demand_units, demand_level,
+                        supply_price, supply_units, supply_level
+                  FROM  StationItem
+                 WHERE  {where}
+        """.format(where = whereClause)
+        tdenv.DEBUG1("TradeCalc loading StationItem values into matrix")
+        tdenv.DEBUG2("sql: {}, binds: {}", stmt, binds)
+        cur = db.execute(stmt, binds)
+        try:
+            matrix = PriceMatrix.fromRows(
+                cur, int(time.time()), minSupply, minDemand
+            )
+        except ValueError as e:
+            stnID, itmID, timestamp = e.args[0]
+            raise BadTimestampError(self.tdb, stnID, itmID, timestamp)
+        
+        self._setPriceMatrix(matrix)
+    
+    def _setPriceMatrix(self, matrix):
+        self.priceMatrix = matrix
+        self.stationsSelling = matrix.stationsSelling
+        self.stationsBuying = matrix.stationsBuying
+        
+        self.tdenv.DEBUG0("Loaded {} buys, {} sells".format(
+            len(matrix.buying), len(matrix.selling)
+        ))
+    
     def bruteForceFit(self, items, credits, capacity, maxUnits):
         """
         Brute-force generation of all possible combinations of items.
@@ -754,6 +956,140 @@ class TradeCalc(object):
         
         return _fitCombos(0, credits, capacity)
     
+    def exactFit(self, items, credits, capacity, maxUnits):
+        """
+        Branch-and-bound load calculator: finds the most profitable load
+        that fits both the hold and the credits, where simpleFit can come
+        up short once credits run low.
+        
+        Quantities of each item are tried from the most that can be
+        bought down, cutting off any branch that can't beat the best load
+        so far. Its bound is the lesser of two relaxations of what the
+        remaining items could add: filling the hold ignoring credits, and
+        spending the credits (fractionally) ignoring the hold. The bound
+        reached for each (item, credits, capacity) is remembered, and a
+        branch where credits don't limit the hold fill is solved outright.
+        
+        The search starts from simpleFit's load, and gives up after
+        exactFitNodes nodes or exactFitSeconds, returning the best load
+        found by then.
+        """
+        
+        greedy = self.simpleFit(items, credits, capacity, maxUnits)
+        # In gain order, so that filling the hold greedily is optimal.
+        usable = sorted(
+            (item for item in items if item.supply > 0 and 0 < item.costCr <= credits),
+            key = lambda item: (-item.gainCr, item.costCr),
+        )
+        if not usable or capacity <= 0:
+            return greedy
+        
+        numItems = len(usable)
+        costs = [item.costCr for item in usable]
+        gains = [item.gainCr for item in usable]
+        limits = [min(maxUnits, item.supply) for item in usable]
+        byValue = sorted(range(numItems), key = lambda i: gains[i] / costs[i], reverse = True)
+        # Most that one unit of the items from i onwards can cost.
+        maxCosts = costs[:]
+        for i in range(numItems - 2, -1, -1):
+            maxCosts[i] = max(costs[i], maxCosts[i + 1])
+        
+        def fillHold(i, cap):
+            """ (gain, cost, picks) of filling cap from items i on, ignoring credits. """
+            gain = cost = 0
+            picks = []
+            for j in range(i, numItems):
+                if not cap:
+                    break
+                qty = min(limits[j], cap)
+                gain += qty * gains[j]
+                cost += qty * costs[j]
+                cap -= qty
+                picks.append((j, qty))
+            return gain, cost, picks
+        
+        def spendCredits(i, cr, cap):
+            """ Most that cr could gain from items i on, allowing fractions. """
+            gain = 0
+            for j in byValue:
+                if j < i:
+                    continue
+                qty = min(limits[j], cap)
+                if qty * costs[j] >= cr:
+                    return gain + cr * gains[j] // costs[j]
+                gain += qty * gains[j]
+                cr -= qty * costs[j]
+            return gain
+        
+        def bound(i, cr, cap):
+            """ Upper bound on what cr and cap could gain from items i on. """
+            if i >= numItems:
+                return 0
+            return min(fillHold(i, cap)[0], spendCredits(i, cr, cap))
+        
+        bestGain, bestPicks = greedy.gainCr, None
+        picked, bounds = [], {}
+        nodes, nodeLimit = 0, self.exactFitNodes
+        deadline = time.monotonic() + self.exactFitSeconds
+        
+        def search(i, cr, cap, gain):
+            nonlocal nodes, bestGain, bestPicks
+            nodes += 1
+            if nodes > nodeLimit or (not nodes & 255 and time.monotonic() > deadline):
+                raise FitBudgetError(nodes)
+            if gain > bestGain:
+                bestGain, bestPicks = gain, picked[:]
+            
+            while i < numItems and costs[i] > cr:
+                i += 1
+            if i >= numItems or not cap:
+                return
+            # Credits beyond this can't be spent.
+            cr = min(cr, cap * maxCosts[i])
+            
+            state = (i, cr, cap)
+            limit = bounds.get(state)
+            if limit is None:
+                holdGain, holdCost, picks = fillHold(i, cap)
+                if holdCost <= cr:
+                    if gain + holdGain > bestGain:
+                        bestGain, bestPicks = gain + holdGain, picked + picks
+                    bounds[state] = holdGain
+                    return
+                bounds[state] = limit = bound(i, cr, cap)
+            if gain + limit <= bestGain:
+                return
+            
+            # Taking less of this item can't beat what the rest could add.
+            itemCost, itemGain = costs[i], gains[i]
+            maxQty = min(limits[i], cap, cr // itemCost)
+            restBound = bound(i + 1, cr, cap)
+            for qty in range(maxQty, -1, -1):
+                if gain + qty * itemGain + restBound <= bestGain:
+                    break
+                if qty:
+                    picked.append((i, qty))
+                search(i + 1, cr - qty * itemCost, cap - qty, gain + qty * itemGain)
+                if qty:
+                    picked.pop()
+            
+            bounds[state] = bestGain - gain
+        
+        try:
+            search(0, credits, capacity, 0)
+        except FitBudgetError:
+            self.tdenv.DEBUG1("exactFit: gave up after {:n} nodes", nodes)
+        
+        if not bestPicks:
+            return greedy
+        load = tuple((usable[j], qty) for j, qty in bestPicks)
+        return TradeLoad(
+            load,
+            sum(item.gainCr * qty for item, qty in load),
+            sum(item.costCr * qty for item, qty in load),
+            sum(qty for _, qty in load),
+        )
+    
     # Mark's test run, to spare searching back through the forum posts for it.
     # python trade.py run --fr="Orang/Bessel Gateway" --cap=720 --cr=11b --ly=24.73 --empty=37.61 --pad=L --hops=2 --jum=3 --loop --summary -vv --progress
     def simpleFit(self, items, credits, capacity, maxUnits):
@@ -803,11 +1139,16 @@ class TradeCalc(object):
         
         return TradeLoad(load, gainCr, costCr, qty)
     
-    def getTrades(self, srcStation, dstStation, srcSelling = None):
+    def getTrades(self, srcStation, dstStation, srcSelling = None, maxCostCr = None):
         """
         Returns the most profitable trading options from
         one station to another (uni-directional).
+        
+        When using a price matrix, srcSelling is ignored and
+        maxCostCr can be used to exclude unaffordable items.
         """
+        if self.priceMatrix:
+            return self._getMatrixTrades(srcStation, dstStation, maxCostCr)
         if not srcSelling:
             srcSelling = self.stationsSelling.get(srcStation.ID, None)
             if not srcSelling:
@@ -854,6 +1195,467 @@ class TradeCalc(object):
 
         return trading
     
+    def _getMatrixTrades(self, srcStation, dstStation, maxCostCr = None):
+        """
+        PriceMatrix implementation of getTrades.
+        """
+        minGainCr = max(1, self.tdenv.minGainPerTon or 1)
+        maxGainCr = self.tdenv.maxGainPerTon or None
+        if maxGainCr:
+            maxGainCr = max(minGainCr, maxGainCr)
+        found = self.priceMatrix.compare(
+            srcStation.ID, dstStation.ID, minGainCr, maxGainCr, maxCostCr
+        )
+        if found is None:
+            return None
+        return self._matrixTrades(*found)
+    
+    def _matrixTrades(self, srcPos, dstPos, gainCr):
+        """
+        Turns selling/buying entry positions from the price matrix
+        into a list of Trade objects.
+        """
+        matrix = self.priceMatrix
+        selling, buying = matrix.selling, matrix.buying
+        itemIdx = self.tdb.itemByID
+        now = matrix.now
+        return [
+            Trade(
+                itemIdx[itemID], costCr, gain, supply, supplyLevel,
+                demand, demandLevel, now - srcStamp, now - dstStamp,
+            )
+            for (
+                itemID, costCr, gain, supply, supplyLevel,
+                demand, demandLevel, srcStamp, dstStamp,
+            ) in zip(
+                matrix.itemIDs[selling.items[srcPos]].tolist(),
+                selling.price[srcPos].tolist(),
+                gainCr.tolist(),
+                selling.units[srcPos].tolist(),
+                selling.level[srcPos].tolist(),
+                buying.units[dstPos].tolist(),
+                buying.level[dstPos].tolist(),
+                selling.modified[srcPos].tolist(),
+                buying.modified[dstPos].tolist(),
+            )
+        ]
+    
+    def recallFit(self, key, credits, default):
+        """
+        Returns the load remembered by rememberFit for key, which is
+        (srcID, dstID, capacity, maxUnits), if it is the fit for
+        credits, None if there was nothing to trade, or else default.
+        """
+        entry = self.fitCache.get(key, None)
+        if entry is None or not entry[0] <= credits <= entry[1]:
+            self.fitCacheMisses += 1
+            return default
+        self.fitCache.move_to_end(key)
+        self.fitCacheHits += 1
+        load = entry[2]
+        # A copy, so that the caller can score it.
+        return TradeLoad(*load) if load is not None else None
+    
+    def rememberFit(self, key, load, lowCr, highCr):
+        """
+        Remembers load, or None when there was nothing to trade, as the
+        fit for key with any credits from lowCr to highCr.
+        """
+        cache = self.fitCache
+        cache[key] = (lowCr, highCr, load)
+        cache.move_to_end(key)
+        if len(cache) > self.fitCacheSize:
+            cache.popitem(last = False)
+    
+    @staticmethod
+    def holdGain(items, capacity, maxUnits):
+        """
+        Returns the most items could gain filling capacity, regardless
+        of credits.
+        """
+        gainCr = 0
+        for item in sorted(items, key = lambda item: item.gainCr, reverse = True):
+            if capacity <= 0:
+                break
+            qty = max(0, min(maxUnits, item.supply, capacity))
+            gainCr += qty * item.gainCr
+            capacity -= qty
+        return gainCr
+    
+    def maxSellingCost(self, stationID):
+        """ Returns the most that anything stationID sells costs. """
+        if self.priceMatrix:
+            span = self.priceMatrix.selling.span(stationID)
+            if span is None:
+                return 0
+            start, stop = span
+            return int(self.priceMatrix.selling.price[start:stop].max(initial = 0))
+        selling = self.stationsSelling.get(stationID, None)
+        return max((values[1] for values in selling), default = 0) if selling else 0
+    
+    def getBestLoads(
+            self, srcStation, dstStations,
+            credits, capacity, maxUnits, maxCostCr = None
+            ):
+        """
+        Returns a dictionary of dstStation.ID -> TradeLoad with the
+        simpleFit load for each of the destinations that has at least
+        one profitable trade from srcStation.
+        
+        With a price matrix, every destination is compared against the
+        source in a single vectorized pass, and Trade objects are only
+        created for the items that make it into a load.
+        """
+        if not self.priceMatrix:
+            loads = {}
+            for dstStation in dstStations:
+                items = self.getTrades(srcStation, dstStation)
+                if maxCostCr is not None and items:
+                    items = [
+                        trade for trade in items if trade.costCr <= maxCostCr
+                    ]
+                if items:
+                    loads[dstStation.ID] = self.simpleFit(
+                        items, credits, capacity, maxUnits
+                    )
+            return loads
+        
+        minGainCr = max(1, self.tdenv.minGainPerTon or 1)
+        maxGainCr = self.tdenv.maxGainPerTon or None
+        if maxGainCr:
+            maxGainCr = max(minGainCr, maxGainCr)
+        dstIDs = [stn.ID for stn in dstStations]
+        found = self.priceMatrix.compareMany(
+            srcStation.ID, dstIDs, minGainCr, maxGainCr, maxCostCr
+        )
+        if found is None:
+            return {}
+        group, srcPos, dstPos, gainCr = found
+        
+        selling = self.priceMatrix.selling
+        costs = selling.price[srcPos].tolist()
+        supplies = selling.units[srcPos].tolist()
+        gains = gainCr.tolist()
+        
+        # Start/stop offsets of each destination's candidates.
+        bounds = numpy.flatnonzero(numpy.diff(group)) + 1
+        starts = [0] + bounds.tolist()
+        stops = bounds.tolist() + [len(gains)]
+        
+        loads = {}
+        for start, stop in zip(starts, stops):
+            if start >= stop:
+                continue
+            # Same greedy fill as simpleFit, over the sorted candidates.
+            picks, cr, cap = [], credits, capacity
+            gainTtl = costTtl = qtyTtl = 0
+            n = start
+            while n < stop and cr > 0 and cap > 0:
+                costCr = costs[n]
+                maxQty = min(maxUnits, cap, cr // costCr)
+                supply = supplies[n]
+                if maxQty > 0 and supply > 0:
+                    maxQty = min(maxQty, supply)
+                    loadCostCr = maxQty * costCr
+                    picks.append((n, maxQty))
+                    qtyTtl += maxQty
+                    cap -= maxQty
+                    gainTtl += maxQty * gains[n]
+                    costTtl += loadCostCr
+                    cr -= loadCostCr
+                n += 1
+            
+            if picks:
+                idx = [n for n, _ in picks]
+                trades = self._matrixTrades(
+                    srcPos[idx], dstPos[idx], gainCr[idx]
+                )
+                load = tuple(
+                    (trade, qty) for trade, (_, qty) in zip(trades, picks)
+                )
+            else:
+                load = ()
+            dstID = dstIDs[int(group[start])]
+            loads[dstID] = TradeLoad(load, gainTtl, costTtl, qtyTtl)
+        
+        return loads
+    
+    @staticmethod
+    def travelTime(ls : float, jumps: int) -> float:
+        """
+        Rough seconds to fly a hop of jumps jumps to a station ls from
+        its star, which --ls-penalty weighs hops by.
+        """
+        return (
+            ((ls + 300)**0.5) * 2.5 # Travel time in super cruis
+            + jumps * 35            # Travel time per jump
+            + 120                    # Travel time for undocking and docking
+         )
+    
+    def getBestGainPerTon(self):
+        """
+        Returns a dictionary of station ID -> the most per ton that
+        anything the station sells can be sold for elsewhere, which no
+        hop from the station can beat. Worked out on first use.
+        """
+        if self._bestGainPerTon is not None:
+            return self._bestGainPerTon
+        
+        if self.priceMatrix:
+            selling = self.priceMatrix.selling
+            buying = self.priceMatrix.buying
+            bestPrices = numpy.zeros(len(self.priceMatrix.itemIDs), dtype=numpy.int64)
+            numpy.maximum.at(bestPrices, buying.items, buying.price)
+            gains = bestPrices[selling.items] - selling.price
+            if len(gains):
+                gains = numpy.maximum.reduceat(gains, selling.offsets[:-1])
+            bestGains = {
+                stnID: gainCr
+                for stnID, gainCr in zip(selling.stationIDs.tolist(), gains.tolist())
+                if gainCr > 0
+            }
+        else:
+            bestPrices = defaultdict(int)
+            for buying in self.stationsBuying.values():
+                for itemID, priceCr, *_ in buying:
+                    if priceCr > bestPrices[itemID]:
+                        bestPrices[itemID] = priceCr
+            bestGains = {}
+            for stnID, selling in self.stationsSelling.items():
+                gainCr = max((
+                    bestPrices.get(itemID, 0) - costCr
+                    for itemID, costCr, *_ in selling
+                ), default = 0)
+                if gainCr > 0:
+                    bestGains[stnID] = gainCr
+        
+        self._bestGainPerTon = bestGains
+        return bestGains
+    
+    def outboundTable(self, maxJumps, maxLyPer = None):
+        """
+        Returns the OutboundTable of the loaded prices for destinations
+        within maxJumps jumps of up to maxLyPer ly, having updated the
+        entries that stale stations could have changed.
+        """
+        tdb = self.tdb
+        key = (maxJumps, maxLyPer or tdb.maxSystemLinkLy)
+        table = self.outboundTables.get(key, None)
+        if table is None:
+            if self.pricesKey is None:
+                table = OutboundTable(*key)
+            else:
+                table = tdb.outboundTables.get(key + self.pricesKey, None)
+                if table is None:
+                    table = OutboundTable(*key)
+                    tdb.outboundTables[key + self.pricesKey] = table
+            self.outboundTables[key] = table
+        
+        if table.stale:
+            stale, table.stale = table.stale, set()
+            best = table.best
+            for stnID in stale:
+                best.pop(stnID, None)
+            # Those whose best trade was to a stale station are worked
+            # out again, but the others just need comparing with the
+            # stale stations they can reach.
+            for stnID in [
+                    stnID for stnID, (_, dstID) in best.items()
+                    if dstID in stale
+                    ]:
+                del best[stnID]
+            for dstID in stale:
+                station = tdb.stationByID.get(dstID, None)
+                if station is None:
+                    continue
+                # Reach works both ways.
+                for srcID in self._outboundReach(station, table):
+                    entry = best.get(srcID, None)
+                    if entry is not None:
+                        gainCr, _ = self._bestOutbound(srcID, (dstID,))
+                        if gainCr > entry[0]:
+                            best[srcID] = (gainCr, dstID)
+            self.tdenv.DEBUG1("Outbound table: {:n} stale stations", len(stale))
+        
+        return table
+    
+    def _outboundReach(self, station, table):
+        """ IDs of the stations within the reach of table from station. """
+        return [
+            dest.station.ID
+            for dest in self.tdb.getDestinations(
+                station, maxJumps = table.maxJumps, maxLyPer = table.maxLyPer,
+            )
+            if dest.station is not station
+        ]
+    
+    def _bestOutbound(self, srcID, dstIDs):
+        """
+        Returns (gainCr, dstID) for the most per ton to be made taking
+        something from srcID to one of dstIDs, or (0, None).
+        """
+        if self.priceMatrix:
+            found = self.priceMatrix.compareMany(srcID, dstIDs)
+            if found is None or not len(found[3]):
+                return 0, None
+            group, _, _, gainCr = found
+            best = int(numpy.argmax(gainCr))
+            return int(gainCr[best]), dstIDs[group[best]]
+        
+        selling = self.stationsSelling.get(srcID, None)
+        if not selling:
+            return 0, None
+        getCost = {itemID: costCr for itemID, costCr, *_ in selling}.get
+        getBuying = self.stationsBuying.get
+        bestGainCr, bestDstID = 0, None
+        for dstID in dstIDs:
+            for itemID, priceCr, *_ in getBuying(dstID, ()):
+                costCr = getCost(itemID, None)
+                if costCr is not None and priceCr - costCr > bestGainCr:
+                    bestGainCr, bestDstID = priceCr - costCr, dstID
+        return bestGainCr, bestDstID
+    
+    def bestOutbound(self, stationID, maxJumps = None, maxLyPer = None):
+        """
+        Returns (gainCr, dstID) for the most per ton to be made taking
+        something from stationID to a station within maxJumps jumps of
+        up to maxLyPer ly (default: tdenv.maxJumpsPer and maxLyPer),
+        or (0, None) if nothing sells at a profit. See OutboundTable.
+        """
+        if maxJumps is None:
+            maxJumps = self.tdenv.maxJumpsPer
+        table = self.outboundTable(maxJumps, maxLyPer or self.tdenv.maxLyPer)
+        entry = table.best.get(stationID, None)
+        if entry is None:
+            station = self.tdb.stationByID.get(stationID, None)
+            entry = (0, None)
+            if station is not None:
+                entry = self._bestOutbound(
+                    stationID, self._outboundReach(station, table)
+                )
+            table.best[stationID] = entry
+        return entry
+    
+    def tradeIndex(self):
+        """
+        Returns the TradeDB's TradeIndex if it is of the prices loaded
+        and no hop of tdenv.maxJumpsPer jumps of tdenv.maxLyPer ly can
+        leave its radius, otherwise None.
+        """
+        tdenv, tdb = self.tdenv, self.tdb
+        if tdenv.direct or not tdenv.maxJumpsPer:
+            return None
+        index = tdb.getTradeIndex()
+        if index is None or not index.matches(self.pricesState):
+            return None
+        reachLy = tdenv.maxJumpsPer * (tdenv.maxLyPer or tdb.maxSystemLinkLy)
+        if reachLy > index.radiusLy:
+            return None
+        return index
+    
+    def outboundBound(self, stationID):
+        """
+        Returns a gain per ton that no trade from stationID to a station
+        within tdenv.maxJumpsPer jumps can beat: bestOutbound's if it
+        has been worked out, or else the trade index's if there is one
+        for the reach, rather than working it out.
+        """
+        tdenv = self.tdenv
+        table = self.outboundTable(tdenv.maxJumpsPer, tdenv.maxLyPer)
+        entry = table.best.get(stationID, None)
+        if entry is None:
+            index = self.tradeIndex()
+            if index is not None:
+                return index.bestGain(stationID)
+            entry = self.bestOutbound(stationID)
+        return entry[0]
+    
+    def hopScoreBound(self, stationID):
+        """
+        Returns the most that getBestHops could score a hop from
+        stationID, unless heading for a goal system, where hops are
+        scored by distance.
+        
+        Bounded by the best trade within --jumps-per jumps (see
+        outboundBound), or anywhere if there is no such limit.
+        """
+        tdenv = self.tdenv
+        if tdenv.direct or not tdenv.maxJumpsPer:
+            gainCr = self.getBestGainPerTon().get(stationID, 0)
+        else:
+            gainCr = self.outboundBound(stationID)
+        if tdenv.maxGainPerTon:
+            gainCr = min(gainCr, tdenv.maxGainPerTon)
+        score = gainCr * tdenv.capacity
+        if tdenv.lsPenalty:
+            # Hops to stations at the star in the same system score best.
+            lsPenalty = max(min(tdenv.lsPenalty / 100, 1), 0)
+            multiplier = self.travelTime(300, 2) / self.travelTime(0, 0)
+            score *= 1 + (multiplier - 1) * lsPenalty
+        return score
+    
+    def buildTradeIndex(self, radiusLy = None, topK = None):
+        """
+        Works out the TradeIndex of the loaded prices, which have to be
+        all of them and in a price matrix, for radiusLy and topK (see
+        TradeIndex for the defaults) and saves it beside the .db.
+        
+        The stations' systems are shared out between tdenv.workers
+        forked processes, as with getBestHops.
+        """
+        global _indexShardState
+        
+        tdb, tdenv = self.tdb, self.tdenv
+        radiusLy = radiusLy or TradeIndex.defaultRadiusLy
+        topK = topK or TradeIndex.defaultTopK
+        if not self.priceMatrix or self.pricesKey != (1, 0, None):
+            raise TradeException(
+                "The trade index is built from all prices, in a price matrix."
+            )
+        stationByID = tdb.stationByID
+        systems = sorted(set(
+            stationByID[stnID].system
+            for stnID in self.priceMatrix.selling.stationIDs.tolist()
+            if stnID in stationByID
+        ), key = lambda system: system.ID)
+        if systems:
+            # So that the workers share the jump graph or spatial index.
+            next(tdb.genSystemsInRange(systems[0], radiusLy), None)
+        
+        workers = self.hopWorkers(len(systems))
+        tdenv.DEBUG0(
+            "Indexing trades within {}ly of {:n} systems with {} workers",
+            radiusLy, len(systems), workers,
+        )
+        _indexShardState = (self, systems, radiusLy, topK)
+        try:
+            if workers > 1:
+                numShards = workers * 4
+                bounds = [
+                    (len(systems) * i // numShards, len(systems) * (i + 1) // numShards)
+                    for i in range(numShards)
+                ]
+                pool = multiprocessing.get_context('fork').Pool(workers)
+                with pool:
+                    shards = pool.map(_indexShard, bounds)
+            else:
+                shards = [_indexShard((0, len(systems)))]
+        finally:
+            _indexShardState = None
+        
+        stationPairs = sorted(
+            (pair for shard in shards for pair in shard),
+            key = lambda pair: pair[0],
+        )
+        index = TradeIndex.write(
+            tdb.tradeIndexPath, self.pricesState, radiusLy, topK, stationPairs
+        )
+        tdenv.NOTE(
+            "Indexed {:n} trades from {:n} stations to {}",
+            len(index.pairs), len(index), tdb.tradeIndexPath,
+        )
+        return index
+    
     def getBestHops(self, routes, restrictTo = None):
         """
         Given a list of routes, try all available next hops from each
@@ -885,7 +1687,6 @@ class TradeCalc(object):
         capacity = tdenv.capacity
         maxUnits = getattr(tdenv, 'limit') or capacity
         
-        bestToDest = {}
         safetyMargin = 1.0 - tdenv.margin
         unique = tdenv.unique
         loopInt = getattr(tdenv, 'loopInt', 0) or None
@@ -897,7 +1698,6 @@ class TradeCalc(object):
             lsPenalty = 0
         
         goalSystem = tdenv.goalSystem
-        uniquePath = None
         
         restrictStations = set()
         if restrictTo:
@@ -945,131 +1745,224 @@ class TradeCalc(object):
                     odyssey = odyssey,
                 )
         
-        prog = pbar.Progress(len(routes), 25)
-        connections = 0
         getSelling = self.stationsSelling.get
-        for route in routes:
-            if tdenv.progress:
-                prog.increment(1)
-            tdenv.DEBUG1("Route = {}", route.str(lambda x, y : y))
-            
-            srcStation = route.lastStation
-            startCr = credits + int(route.gainCr * safetyMargin)
-            
-            srcSelling = getSelling(srcStation.ID, None)
-            # Filter expensive items iff we do not have a lot of money
-            if startCr < 1e6:
-                srcSelling = tuple(
-                    values for values in srcSelling
-                    if values[1] <= startCr
-                )
-            if not srcSelling:
-                tdenv.DEBUG1("Nothing sold/affordable - next.")
-                continue
-            
-            if goalSystem:
-                origSystem = route.firstSystem
-                srcSystem = srcStation.system
-                srcDistTo = srcSystem.distanceTo
-                goalDistTo = goalSystem.distanceTo
-                origDistTo = origSystem.distanceTo
-                srcGoalDist = srcDistTo(goalSystem)
-                srcOrigDist = srcDistTo(origSystem)
-                origGoalDist = origDistTo(goalSystem)
-            
-            if unique:
-                uniquePath = route.route
-            elif loopInt:
-                uniquePath = route.route[-loopInt:-1]
-            
-            stations = (d for d in station_iterator(srcStation)
-              if (d.station != srcStation) and
-                (d.station.blackMarket == 'Y' if reqBlackMarket else True) and
-                (d.station not in uniquePath if uniquePath else True) and
-                (d.station in restrictStations if restrictStations else True) and
-                (d.station.dataAge and d.station.dataAge <= maxAge if maxAge else True) and
-                (((d.system is not srcSystem) if bool(tdenv.unique) else (d.system is goalSystem or d.distLy < srcGoalDist)) if goalSystem else True)
-            )
-            
-            if tdenv.debug >= 1:
+        priceMatrix = self.priceMatrix
+        batchFit = priceMatrix and fitFunction == self.simpleFit
+        # Routes often reach a station again with close enough credits
+        # that the same loads come out of it, see recallFit.
+        recallFit, rememberFit = self.recallFit, self.rememberFit
+        noFit = object()
+        rangedFit = getattr(fitFunction, '__name__', None) in self.rangedFits
+        greedyFit = batchFit or fitFunction == self.simpleFit
+        
+        def creditRange(trade, startCr, srcMaxCr, items = None):
+            """
+            Returns the (lowest, highest) credits that trade, fitted with
+            startCr from items, is the fit for. Ranged fits stay the fit
+            down to what they cost. Once startCr covers anything the
+            source sells, more credits can't give a trade where there
+            was none, change a greedy load that left enough over to buy
+            any of it, or better a load as profitable as the best fill of
+            the hold.
+            """
+            if trade is None:
+                return 0, (sys.maxsize if startCr >= srcMaxCr else startCr)
+            lowCr = trade.costCr if rangedFit else startCr
+            if startCr >= srcMaxCr:
+                if greedyFit:
+                    if startCr - trade.costCr >= srcMaxCr:
+                        return lowCr, sys.maxsize
+                elif rangedFit and items:
+                    if trade.gainCr >= self.holdGain(items, capacity, maxUnits):
+                        return lowCr, sys.maxsize
+            return lowCr, startCr
+        
+        def expandRoutes(routes, bestToDest, prog):
+            """
+            Try every next hop from each of routes, recording the best
+            candidate for each destination in bestToDest. Returns the
+            number of connections considered.
+            """
+            connections = 0
+            uniquePath = None
+            for route in routes:
+                if prog:
+                    prog.increment(1)
+                tdenv.DEBUG1("Route = {}", route.str(lambda x, y : y))
                 
-                def annotate(dest):
-                    tdenv.DEBUG1(
-                        "destSys {}, destStn {}, jumps {}, distLy {}",
-                        dest.system.dbname,
-                        dest.station.dbname,
-                        "->".join(jump.str() for jump in dest.via),
-                        dest.distLy
-                    )
-                    return True
+                srcStation = route.lastStation
+                startCr = credits + int(route.gainCr * safetyMargin)
                 
-                stations = (d for d in stations if annotate(d))
-            
-            for dest in stations:
-                dstStation = dest.station
-                
-                connections += 1
-                items = self.getTrades(srcStation, dstStation, srcSelling)
-                if not items:
+                # Filter expensive items iff we do not have a lot of money
+                maxCostCr = startCr if startCr < 1e6 else None
+                if priceMatrix:
+                    srcSelling = priceMatrix.hasAffordable(srcStation.ID, maxCostCr)
+                else:
+                    srcSelling = getSelling(srcStation.ID, None)
+                    if srcSelling and maxCostCr is not None:
+                        srcSelling = tuple(
+                            values for values in srcSelling
+                            if values[1] <= maxCostCr
+                        )
+                if not srcSelling:
+                    tdenv.DEBUG1("Nothing sold/affordable - next.")
                     continue
-                trade = fitFunction(items, startCr, capacity, maxUnits)
                 
-                # Calculate total K-lightseconds supercruise time.
-                # This will amortize for the start/end stations
-                dstSys = dest.system
-                if goalSystem and dstSys is not goalSystem:
-                    dstGoalDist = goalDistTo(dstSys)
-                    # Biggest reward for shortening distance to goal
-                    score = 5000 * origGoalDist / dstGoalDist
-                    # bias towards bigger reductions
-                    score += 50 * srcGoalDist / dstGoalDist
-                    # discourage moving back towards origin
-                    if dstSys is not origSystem:
-                        score += 10 * (origDistTo(dstSys) - srcOrigDist)
-                    # Gain per unit pays a small part
-                    score += (trade.gainCr / trade.units) / 25
-                else:
-                    score = trade.gainCr
-                if lsPenalty:
-                    # Simply and continuously penalize larger distances
-                    # Drops smoothly from 1 to 1-lsPenalty
-                    #dropStart = 1 # Start of drop, in kLs
-                    #halfDrop = 5 # Where to drop to 50% of given penalty
-                    #if dstStation.lsFromStar > dropStart * 1000:
-                    #    cruiseKls = dstStation.lsFromStar / 1000
-                    #    multiplier = (1 - lsPenalty) + lsPenalty / (1+((cruiseKls-dropStart)/(halfDrop-dropStart)) ** 2)
-                    #    score *= multiplier
-
-                    # Account for number of jumps and travel time to calculate score based on ~credits gain per time
-                    def travelTime(ls : float, jumps: int) -> float:
-                        return (
-                            ((ls + 300)**0.5) * 2.5 # Travel time in super cruis
-                            + jumps * 35            # Travel time per jump
-                            + 120                    # Travel time for undocking and docking
-                         ) 
-                    scale = travelTime(300, 2) # Scale for 2 jumps and 300 ls -> multiplier = 1
-                    multiplier = scale / travelTime(dstStation.lsFromStar, len(dest.via)-1)
-                    score *= 1 + (multiplier - 1) * lsPenalty
-                trade.score = int(score)
-
+                if goalSystem:
+                    origSystem = route.firstSystem
+                    srcSystem = srcStation.system
+                    srcDistTo = srcSystem.distanceTo
+                    goalDistTo = goalSystem.distanceTo
+                    origDistTo = origSystem.distanceTo
+                    srcGoalDist = srcDistTo(goalSystem)
+                    srcOrigDist = srcDistTo(origSystem)
+                    origGoalDist = origDistTo(goalSystem)
                 
-                dstID = dstStation.ID
-                if dstID in bestToDest:
-                    # See if there is already a candidate for this destination
-                    btd = bestToDest[dstID]
-                    bestRoute = btd[1]
-                    bestScore = btd[5]
-                    # Check if it is a better option than we just produced
-                    bestTradeScore = bestRoute.score + bestScore
-                    newTradeScore = route.score + score
-                    if bestTradeScore > newTradeScore:
-                        continue
-                    if bestTradeScore == newTradeScore and btd[4] <= dest.distLy:
-                        continue
+                if unique:
+                    uniquePath = route.route
+                elif loopInt:
+                    uniquePath = route.route[-loopInt:-1]
                 
-                bestToDest[dstID] = (dstStation, route, trade, dest.via, dest.distLy, score)
+                stations = (d for d in station_iterator(srcStation)
+                  if (d.station != srcStation) and
+                    (d.station.blackMarket == 'Y' if reqBlackMarket else True) and
+                    (d.station not in uniquePath if uniquePath else True) and
+                    (d.station in restrictStations if restrictStations else True) and
+                    (d.station.dataAge and d.station.dataAge <= maxAge if maxAge else True) and
+                    (((d.system is not srcSystem) if bool(tdenv.unique) else (d.system is goalSystem or d.distLy < srcGoalDist)) if goalSystem else True)
+                )
+                
+                if tdenv.debug >= 1:
+                    
+                    def annotate(dest):
+                        tdenv.DEBUG1(
+                            "destSys {}, destStn {}, jumps {}, distLy {}",
+                            dest.system.dbname,
+                            dest.station.dbname,
+                            "->".join(jump.str() for jump in dest.via),
+                            dest.distLy
+                        )
+                        return True
+                    
+                    stations = (d for d in stations if annotate(d))
+                
+                srcID = srcStation.ID
+                srcMaxCr = self.maxSellingCost(srcID)
+                if batchFit:
+                    # Fit every destination not already fitted for this
+                    # source in one pass.
+                    stations = list(stations)
+                    bestLoads, unfitted = {}, []
+                    for dest in stations:
+                        dstID = dest.station.ID
+                        trade = recallFit((srcID, dstID, capacity, maxUnits), startCr, noFit)
+                        if trade is noFit:
+                            unfitted.append(dest.station)
+                        else:
+                            bestLoads[dstID] = trade
+                    if unfitted:
+                        fitted = self.getBestLoads(
+                            srcStation, unfitted,
+                            startCr, capacity, maxUnits, maxCostCr,
+                        )
+                        for dstStation in unfitted:
+                            dstID = dstStation.ID
+                            trade = bestLoads[dstID] = fitted.get(dstID, None)
+                            rememberFit(
+                                (srcID, dstID, capacity, maxUnits), trade,
+                                *creditRange(trade, startCr, srcMaxCr)
+                            )
+                
+                for dest in stations:
+                    dstStation = dest.station
+                    
+                    connections += 1
+                    if batchFit:
+                        trade = bestLoads.get(dstStation.ID, None)
+                    else:
+                        fitKey = (srcID, dstStation.ID, capacity, maxUnits)
+                        trade = recallFit(fitKey, startCr, noFit)
+                        if trade is noFit:
+                            if priceMatrix:
+                                items = self.getTrades(
+                                    srcStation, dstStation, maxCostCr = maxCostCr
+                                )
+                            else:
+                                items = self.getTrades(srcStation, dstStation, srcSelling)
+                            if items:
+                                trade = fitFunction(items, startCr, capacity, maxUnits)
+                            else:
+                                trade = None
+                            rememberFit(
+                                fitKey, trade, *creditRange(trade, startCr, srcMaxCr, items)
+                            )
+                    if trade is None:
+                        continue
+                    
+                    # Calculate total K-lightseconds supercruise time.
+                    # This will amortize for the start/end stations
+                    dstSys = dest.system
+                    if goalSystem and dstSys is not goalSystem:
+                        dstGoalDist = goalDistTo(dstSys)
+                        # Biggest reward for shortening distance to goal
+                        score = 5000 * origGoalDist / dstGoalDist
+                        # bias towards bigger reductions
+                        score += 50 * srcGoalDist / dstGoalDist
+                        # discourage moving back towards origin
+                        if dstSys is not origSystem:
+                            score += 10 * (origDistTo(dstSys) - srcOrigDist)
+                        # Gain per unit pays a small part
+                        score += (trade.gainCr / trade.units) / 25
+                    else:
+                        score = trade.gainCr
+                    if lsPenalty:
+                        # Simply and continuously penalize larger distances
+                        # Drops smoothly from 1 to 1-lsPenalty
+                        #dropStart = 1 # Start of drop, in kLs
+                        #halfDrop = 5 # Where to drop to 50% of given penalty
+                        #if dstStation.lsFromStar > dropStart * 1000:
+                        #    cruiseKls = dstStation.lsFromStar / 1000
+                        #    multiplier = (1 - lsPenalty) + lsPenalty / (1+((cruiseKls-dropStart)/(halfDrop-dropStart)) ** 2)
+                        #    score *= multiplier
+
+                        # Account for number of jumps and travel time to calculate score based on ~credits gain per time
+                        travelTime = self.travelTime
+                        scale = travelTime(300, 2) # Scale for 2 jumps and 300 ls -> multiplier = 1
+                        multiplier = scale / travelTime(dstStation.lsFromStar, len(dest.via)-1)
+                        score *= 1 + (multiplier - 1) * lsPenalty
+                    trade.score = int(score)
+
+                    
+                    dstID = dstStation.ID
+                    if dstID in bestToDest:
+                        # See if there is already a candidate for this destination
+                        btd = bestToDest[dstID]
+                        bestRoute = btd[1]
+                        bestScore = btd[5]
+                        # Check if it is a better option than we just produced
+                        bestTradeScore = bestRoute.score + bestScore
+                        newTradeScore = route.score + score
+                        if bestTradeScore > newTradeScore:
+                            continue
+                        if bestTradeScore == newTradeScore and btd[4] <= dest.distLy:
+                            continue
+                    
+                    bestToDest[dstID] = (dstStation, route, trade, dest.via, dest.distLy, score)
+            
+            return connections
         
-        prog.clear()
+        workers = self.hopWorkers(len(routes))
+        prog = pbar.Progress(len(routes), 25) if tdenv.progress else None
+        if workers > 1:
+            bestToDest, connections = self._forkBestHops(
+                routes, expandRoutes, workers, prog
+            )
+        else:
+            bestToDest = {}
+            connections = expandRoutes(routes, bestToDest, prog)
+        
+        if prog:
+            prog.clear()
         
         if connections == 0:
             raise NoHopsError(
@@ -1081,3 +1974,155 @@ class TradeCalc(object):
             result.append(route.plus(dst, trade, jumps, score))
         
         return result
+    
+    def hopWorkers(self, numRoutes):
+        """
+        Returns the number of processes getBestHops should use to
+        expand numRoutes routes, based on tdenv.workers (0 meaning one
+        per CPU).
+        
+        Workers are forked so that they share the already-loaded price
+        data; where fork isn't available this is always 1.
+        """
+        workers = getattr(self.tdenv, 'workers', None)
+        if workers is None or workers == 1:
+            return 1
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            return 1
+        if workers == 0:
+            workers = os.cpu_count() or 1
+        return max(1, min(workers, numRoutes // self.minRoutesPerWorker))
+    
+    def _forkBestHops(self, routes, expandRoutes, workers, prog):
+        """
+        Splits routes into contiguous shards which are expanded by a
+        pool of forked processes, then reduces the per-shard bestToDest
+        maps in route order so the result matches a serial run.
+        
+        Returns (bestToDest, connections).
+        """
+        global _hopShardState
+        
+        tdb = self.tdb
+        stationByID, systemByID = tdb.stationByID, tdb.systemByID
+        itemByID = tdb.itemByID
+        
+        # Several shards per worker so uneven shards balance out.
+        numRoutes = len(routes)
+        numShards = min(numRoutes, workers * 4)
+        bounds = [
+            (numRoutes * i // numShards, numRoutes * (i + 1) // numShards)
+            for i in range(numShards)
+        ]
+        
+        bestToDest, connections = {}, 0
+        _hopShardState = (routes, expandRoutes)
+        try:
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            with pool:
+                shards = pool.imap(_expandHopShard, bounds)
+                for (start, stop), (shardConns, shardBest) in zip(bounds, shards):
+                    if prog:
+                        prog.increment(stop - start)
+                    connections += shardConns
+                    for (dstID, routeNo, load, via, distLy, score) in shardBest:
+                        route = routes[routeNo]
+                        if dstID in bestToDest:
+                            btd = bestToDest[dstID]
+                            bestTradeScore = btd[1].score + btd[5]
+                            newTradeScore = route.score + score
+                            if bestTradeScore > newTradeScore:
+                                continue
+                            if bestTradeScore == newTradeScore and btd[4] <= distLy:
+                                continue
+                        
+                        items, gainCr, costCr, units, loadScore = load
+                        trade = TradeLoad(
+                            tuple(
+                                (Trade(itemByID[values[0]], *values[1:]), qty)
+                                for values, qty in items
+                            ),
+                            gainCr, costCr, units,
+                        )
+                        trade.score = loadScore
+                        bestToDest[dstID] = (
+                            stationByID[dstID], route, trade,
+                            tuple(systemByID[ID] for ID in via),
+                            distLy, score,
+                        )
+        finally:
+            _hopShardState = None
+        
+        return bestToDest, connections
+
+######################################################################
+# Multi-process hop expansion
+
+# (routes, expandRoutes) of the getBestHops call being sharded; forked
+# workers inherit this rather than having it pickled to them.
+_hopShardState = None
+
+
+def _expandHopShard(bounds):
+    """
+    Worker side of TradeCalc._forkBestHops: expands routes[start:stop]
+    and returns the shard's best hops with objects reduced to IDs.
+    """
+    start, stop = bounds
+    routes, expandRoutes = _hopShardState
+    shard = routes[start:stop]
+    bestToDest = {}
+    connections = expandRoutes(shard, bestToDest, None)
+    routeNo = {id(route): start + i for i, route in enumerate(shard)}
+    
+    def packLoad(trade):
+        return (
+            tuple(
+                ((tr.item.ID,) + tuple(tr[1:]), qty)
+                for tr, qty in trade.items
+            ),
+            trade.gainCr, trade.costCr, trade.units, trade.score,
+        )
+    
+    return connections, [
+        (
+            dstID, routeNo[id(route)], packLoad(trade),
+            tuple(system.ID for system in via), distLy, score,
+        )
+        for dstID, (dst, route, trade, via, distLy, score)
+        in bestToDest.items()
+    ]
+
+######################################################################
+# Multi-process trade indexing
+
+# (calc, systems, radiusLy, topK) of the buildTradeIndex call being
+# sharded, inherited by the forked workers.
+_indexShardState = None
+
+
+def _indexShard(bounds):
+    """
+    Worker side of TradeCalc.buildTradeIndex: returns the (stationID,
+    pairs) of the stations in systems[start:stop].
+    """
+    start, stop = bounds
+    calc, systems, radiusLy, topK = _indexShardState
+    matrix = calc.priceMatrix
+    genSystemsInRange = calc.tdb.genSystemsInRange
+    stationPairs = []
+    for system in systems[start:stop]:
+        near = [
+            (station.ID, distLy)
+            for dstSys, distLy in genSystemsInRange(system, radiusLy, True)
+            for station in dstSys.stations
+        ]
+        for station in system.stations:
+            dstIDs = [dstID for dstID, _ in near if dstID != station.ID]
+            distances = [distLy for dstID, distLy in near if dstID != station.ID]
+            pairs = TradeIndex.findPairs(
+                matrix, station.ID, dstIDs, distances, topK
+            )
+            if len(pairs):
+                stationPairs.append((station.ID, pairs))
+    return stationPairs
@@ -51,14 +51,19 @@ Simplistic use might be:
 # Imports
 
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from pathlib import Path
 from tradedangerous.tradeenv import TradeEnv
 from tradedangerous.tradeexcept import TradeException
-from tradedangerous.cache import buildCache, importDataFromFile
+from tradedangerous.binprices import BinaryPrices
+from tradedangerous.cache import buildCache, importDataFromFile, pricesSource
+from tradedangerous.jumpgraph import JumpGraph
+from tradedangerous.landmarks import LandmarkTable
+from tradedangerous.spatial import indexTypes as spatialIndexTypes
+from tradedangerous.tradeindex import TradeIndex
 from tradedangerous.utils import normalizedStr
 
-from contextlib import closing
+from contextlib import closing, contextmanager
 import heapq
 import itertools
 import locale
@@ -67,6 +72,7 @@ import sqlite3
 import sys
 import os
 import shutil
+import threading
 import numpy
 import numpy.linalg
 
@@ -118,14 +124,6 @@ class SystemNotStationError(TradeException):
 ######################################################################
 
 
-def makeStellarGridKey(x, y, z):
-    """
-    The Stellar Grid is a map of systems based on their Stellar
-    co-ordinates rounded down to 32lys. This makes it much easier
-    to find stars within rectangular volumes.
-    """
-    return (int(x) >> 5, int(y) >> 5, int(z) >> 5)
-
 class System(object):
     """
     Describes a star system which may contain one or more Station objects.
@@ -277,18 +275,22 @@ class Station(object):
         'ID', 'system', 'dbname', 'prettyName',
         'lsFromStar', 'market', 'blackMarket', 'shipyard', 'maxPadSize',
         'outfitting', 'rearm', 'refuel', 'repair', 'planetary','fleet',
-        'odyssey', 'itemCount', 'dataAge',
+        'odyssey', '_itemCount', '_dataAge', '_loadTrading',
     )
     
     def __init__(
             self, ID, system, dbname, prettyName,
             lsFromStar, market, blackMarket, shipyard, maxPadSize,
             outfitting, rearm, refuel, repair, planetary, fleet, odyssey,
-            itemCount=0, dataAge=None,
+            itemCount=0, dataAge=None, loadTrading=None,
             ):
+        """
+        An itemCount of None means it and dataAge haven't been loaded
+        yet, and will be by calling loadTrading([ID]) when first used.
+        """
         self.ID, self.system, self.dbname, self.prettyName = ID, system, dbname, prettyName
         self.lsFromStar = int(lsFromStar)
-        self.market = market if itemCount == 0 else 'Y'
+        self.market = market if not itemCount else 'Y'
         self.blackMarket = blackMarket
         self.shipyard = shipyard
         self.maxPadSize = maxPadSize
@@ -299,10 +301,33 @@ class Station(object):
         self.planetary = planetary
         self.fleet = fleet
         self.odyssey = odyssey
-        self.itemCount = itemCount
-        self.dataAge = dataAge
+        self._itemCount = itemCount
+        self._dataAge = dataAge
+        self._loadTrading = loadTrading
         system.stations.append(self)
     
+    @property
+    def itemCount(self):
+        """ Number of items the station has prices for. """
+        if self._itemCount is None:
+            self._loadTrading([self.ID])
+        return self._itemCount
+    
+    @itemCount.setter
+    def itemCount(self, itemCount):
+        self._itemCount = itemCount
+    
+    @property
+    def dataAge(self):
+        """ Average age in days of the station's prices, or None. """
+        if self._itemCount is None:
+            self._loadTrading([self.ID])
+        return self._dataAge
+    
+    @dataAge.setter
+    def dataAge(self, dataAge):
+        self._dataAge = dataAge
+    
     def name(self, detail=0):
         if detail > 0:
             return '%s/%s' % (self.system.prettyName, self.prettyName)
@@ -560,12 +585,17 @@ class TradeDB(object):
             Number of "profitable trade" items processed
         tradingStationCount
             Number of stations trade data has been loaded for
+        lazyLoad
+            If True, load() leaves the data to be loaded when first
+            used, see lazyAttributes
         tdenv
             The TradeEnv associated with this TradeDB
         sqlPath
             Path() of the .sql file
         pricesPath
             Path() of the .prices file
+        binPricesPath
+            Path() of the binary prices file
         importTables
             List of the .csv files
     
@@ -591,6 +621,39 @@ class TradeDB(object):
     defaultSQL = 'TradeDangerous.sql'
     # File containing text description of prices
     defaultPrices = 'TradeDangerous.prices'
+    # Suffix of the precomputed jump graph that lives beside the .db
+    jumpGraphSuffix = '.jumps'
+    # Suffix of the precomputed trade index that lives beside the .db
+    tradeIndexSuffix = '.trades'
+    # Number of getDestinations system searches to remember
+    destinationCacheSize = 512
+    # The attributes load() populates and the methods that load each;
+    # any that hasn't been loaded yet is loaded when first used. Systems
+    # and Categories are loaded with the Stations and Items they list.
+    lazyAttributes = {
+        'addedByID': ('_loadAdded',),
+        'systemByID': ('_loadSystems', '_loadStations'),
+        'systemByName': ('_loadSystems', '_loadStations'),
+        'stationByID': ('_loadSystems', '_loadStations'),
+        'tradingStationCount': ('_loadStationTrading',),
+        'shipByID': ('_loadShips',),
+        'categoryByID': ('_loadCategories', '_loadItems'),
+        'itemByID': ('_loadCategories', '_loadItems'),
+        'itemByName': ('_loadCategories', '_loadItems'),
+        'itemByFDevID': ('_loadCategories', '_loadItems'),
+        'rareItemByID': ('_loadRareItems',),
+        'rareItemByName': ('_loadRareItems',),
+    }
+    # Seconds a connection waits for another's lock before giving up
+    dbTimeout = 30
+    # Page cache of each connection, in KiB, and how much of the .db
+    # each may memory-map, in bytes
+    dbCacheKiB = 64 * 1024
+    dbMmapBytes = 256 * 1024 * 1024
+    # Most idle read-only connections readDB() keeps for reuse
+    readPoolSize = 4
+    # Most stations loadTrading queries at a time
+    loadTradingBatch = 10000
     # array containing standard tables, csvfilename and tablename
     # WARNING: order is important because of dependencies!
     defaultTables = (
@@ -619,8 +682,10 @@ class TradeDB(object):
             tdenv=None,
             load=True,
             debug=None,
+            lazy=False,
             ):
         self.conn : sqlite3.Connection = None
+        self.readPool, self.readPoolLock = [], threading.Lock()
         self.tradingCount = None
         
         tdenv = tdenv or TradeEnv(debug=(debug or 0))
@@ -644,18 +709,35 @@ class TradeDB(object):
         self.sqlPath = dataPath / Path(tdenv.sqlFilename or TradeDB.defaultSQL)
         pricePath = Path(tdenv.pricesFilename or TradeDB.defaultPrices)
         self.pricesPath = dataPath / pricePath
+        self.binPricesPath = self.pricesPath.with_name(
+            self.pricesPath.name + BinaryPrices.suffix
+        )
         self.importTables = [
             (str(self.csvPath / Path(fn)), tn)
             for fn, tn in TradeDB.defaultTables
         ]
         self.importPaths = {tn: tp for tp, tn in self.importTables}
         
+        self.jumpGraphPath = self.dbPath.with_suffix(TradeDB.jumpGraphSuffix)
+        self.tradeIndexPath = self.dbPath.with_suffix(TradeDB.tradeIndexSuffix)
         self.dbFilename = str(self.dbPath)
         self.sqlFilename = str(self.sqlPath)
         self.pricesFilename = str(self.pricesPath)
         
         self.avgSelling, self.avgBuying = None, None
-        self.tradingStationCount = 0
+        self.lazyLoad = lazy
+        self.jumpGraph, self.jumpGraphLoaded = None, False
+        self.tradeIndex, self.tradeIndexFileID = None, None
+        self.landmarksByLy = {}
+        self.destinationCache = OrderedDict()
+        self.destinationCacheHits = self.destinationCacheMisses = 0
+        # The last PriceSnapshot TradeCalc used, see TradeCalc.
+        self.priceSnapshot = None
+        # OutboundTables by reach and prices, see TradeCalc.outboundTable.
+        self.outboundTables = {}
+        # What the loaded data corresponds to, see refresh().
+        self.dataVersion, self.dataTracked = None, False
+        self.dbFileID = None
         
         if load:
             self.reloadCache()
@@ -681,21 +763,83 @@ class TradeDB(object):
         dZ = (lz - rz)
         return (dX*dX + dY*dY + dZ*dZ) ** 0.5
     
+    def __getattr__(self, name):
+        """ Loads any of lazyAttributes the first time it's used. """
+        loaders = TradeDB.lazyAttributes.get(name, None)
+        if loaders is None:
+            raise AttributeError(name)
+        self.tdenv.DEBUG1("Loading {} on first use", name)
+        for loader in loaders:
+            getattr(self, loader)()
+        return self.__dict__[name]
+    
     ############################################################
     # Access to the underlying database.
     
     def getDB(self) -> sqlite3.Connection:
+        """
+        Returns the connection used to read and write the database,
+        connecting if need be.
+        
+        With tdenv.walMode (--wal or TD_WAL) the database is switched to
+        write-ahead logging, so that readers and a writer in other
+        processes no longer block each other; it stays in WAL mode once
+        switched.
+        """
         if self.conn:
             return self.conn
         self.tdenv.DEBUG1("Connecting to DB")
-        conn = sqlite3.connect(self.dbFilename)
+        conn = sqlite3.connect(self.dbFilename, timeout=self.dbTimeout)
         conn.execute("PRAGMA foreign_keys=ON")
-        #conn.execute("PRAGMA synchronous=OFF")
-        conn.execute("PRAGMA temp_store=MEMORY")
-        conn.create_function('dist2', 6, TradeDB.calculateDistance2)
+        if self.tdenv.walMode:
+            conn.execute("PRAGMA journal_mode=WAL")
+        if conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+            # Only a power loss can lose a commit, never corrupt the db.
+            conn.execute("PRAGMA synchronous=NORMAL")
+        self._tuneDB(conn)
         self.conn = conn
         return conn
     
+    @contextmanager
+    def readDB(self):
+        """
+        Lends a read-only connection to the database for the duration
+        of a with block, for queries that don't want to share getDB()'s
+        transactions:
+            
+            with tdb.readDB() as db:
+                rows = db.execute("SELECT ...").fetchall()
+        
+        Connections are kept in a small pool, and may be used by any
+        thread, one at a time.
+        """
+        with self.readPoolLock:
+            conn = self.readPool.pop() if self.readPool else None
+        if conn is None:
+            self.tdenv.DEBUG1("Connecting to DB read-only")
+            conn = sqlite3.connect(
+                self.dbPath.resolve().as_uri() + "?mode=ro", uri=True,
+                timeout=self.dbTimeout, check_same_thread=False,
+            )
+            self._tuneDB(conn)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self.readPoolLock:
+                if len(self.readPool) < self.readPoolSize:
+                    self.readPool.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+    
+    def _tuneDB(self, conn):
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-{:d}".format(self.dbCacheKiB))
+        conn.execute("PRAGMA mmap_size={:d}".format(self.dbMmapBytes))
+        conn.create_function('dist2', 6, TradeDB.calculateDistance2)
+    
     def query(self, *args):
         """ Perform an SQL query on the DB and return the cursor. """
         return self.getDB().execute(*args)
@@ -723,19 +867,20 @@ class TradeDB(object):
             ]
             
             if not changedPaths:
-                # Do we need to reload the .prices file?
-                if not self.pricesPath.exists():
+                # Do we need to reload the prices?
+                pricesPath = pricesSource(self)
+                if not pricesPath:
                     self.tdenv.DEBUG1("No .prices file to load")
                     return
                 
-                pricesStamp = self.pricesPath.stat().st_mtime
+                pricesStamp = pricesPath.stat().st_mtime
                 if pricesStamp <= dbFileStamp:
                     self.tdenv.DEBUG1("DB Cache is up to date.")
                     return
                 
-                self.tdenv.DEBUG0(".prices has changed: re-importing")
+                self.tdenv.DEBUG0("{} has changed: re-importing", pricesPath.name)
                 importDataFromFile(
-                    self, self.tdenv, self.pricesPath, reset=True
+                    self, self.tdenv, pricesPath, reset=True
                 )
                 return
             
@@ -797,6 +942,11 @@ class TradeDB(object):
         
         self.systemByID, self.systemByName = systemByID, systemByName
         self.tdenv.DEBUG1("Loaded {:n} Systems", len(systemByID))
+        # The jump graph is checked against these on first use.
+        self.jumpGraph, self.jumpGraphLoaded = None, False
+        self.landmarksByLy = {}
+        self.destinationCache.clear()
+        self.outboundTables.clear()
     
     def lookupSystem(self, key, exactOnly=False):
         """
@@ -854,7 +1004,11 @@ class TradeDB(object):
             ID, name, prettyName, x, y, z
         )
         # Invalidate the grid
-        self.stellarGrid = None
+        self.spatialIndex = None
+        self.jumpGraph = None
+        self.landmarksByLy = {}
+        self.destinationCache.clear()
+        self.outboundTables.clear()
         return system
     
     def updateLocalSystem(
@@ -886,6 +1040,10 @@ class TradeDB(object):
         ])
         if commit:
             db.commit()
+        self.jumpGraph = None
+        self.landmarksByLy = {}
+        self.destinationCache.clear()
+        self.outboundTables.clear()
         self.tdenv.NOTE(
             "{} (#{}) updated in {}: {}, {}, {}, {}, {}, {}",
             oldname, system.ID,
@@ -912,6 +1070,10 @@ class TradeDB(object):
             db.commit()
         del self.systemByName[system.dbname]
         del self.systemByID[system.ID]
+        self.jumpGraph = None
+        self.landmarksByLy = {}
+        self.destinationCache.clear()
+        self.outboundTables.clear()
         
         self.tdenv.NOTE(
             "{} (#{}) deleted from {}",
@@ -922,19 +1084,56 @@ class TradeDB(object):
         system.dbname = "DELETED " + system.dbname
         del system
     
-    def __buildStellarGrid(self):
+    def _buildSpatialIndex(self):
         """
-        Divides the galaxy into a fixed-sized grid allowing us to
-        aggregate small numbers of stars by locality.
+        Builds the spatial index (tdenv.spatialIndex, see spatial.py)
+        over the positions of all the loaded systems.
         """
-        stellarGrid = self.stellarGrid = dict()
-        for system in self.systemByID.values():
-            key = makeStellarGridKey(system.posX, system.posY, system.posZ)
-            try:
-                grid = stellarGrid[key]
-            except KeyError:
-                grid = stellarGrid[key] = []
-            grid.append(system)
+        indexType = self.tdenv.spatialIndex or 'kdtree'
+        try:
+            indexClass = spatialIndexTypes[indexType]
+        except KeyError:
+            raise TradeException(
+                "Unknown spatial index '{}' (TD_SPATIAL), expected one of: {}"
+                .format(indexType, ", ".join(spatialIndexTypes))
+            )
+        systems = list(self.systemByID.values())
+        positions = numpy.array(
+            [(system.posX, system.posY, system.posZ) for system in systems],
+            dtype=numpy.float64,
+        ).reshape(-1, 3)
+        self.tdenv.DEBUG1(
+            "Building {} spatial index of {:n} systems",
+            indexType, len(systems),
+        )
+        self.spatialIndex = (indexClass(positions), systems)
+    
+    def querySphere(self, center, radius):
+        """
+        Finds the Systems within a given radius of a point.
+        
+        Args:
+            center:
+                A System, Station or (x, y, z) tuple,
+            radius:
+                The radius of the search in light-years.
+        
+        Returns:
+            A list of (system, distLy) in no particular order. If center
+            is a System (or Station) it will be included, at 0ly.
+        """
+        if self.spatialIndex is None:
+            self._buildSpatialIndex()
+        index, systems = self.spatialIndex
+        
+        if isinstance(center, (System, Station)):
+            center = center.system
+            center = (center.posX, center.posY, center.posZ)
+        rows, distSq = index.query(center, radius)
+        return [
+            (systems[row], dist ** 0.5)
+            for row, dist in zip(rows.tolist(), distSq.tolist())
+        ]
     
     def genStellarGrid(self, system, ly):
         """
@@ -950,31 +1149,12 @@ class TradeDB(object):
             (candidate, distLy)
                 candidate:
                     System that was found,
-                distLySq:
+                distLy:
                     The distance in light-years between system and candidate.
         """
-        if self.stellarGrid is None:
-            self.__buildStellarGrid()
-        
-        sysX, sysY, sysZ = system.posX, system.posY, system.posZ
-        lwrBound = makeStellarGridKey(sysX - ly, sysY - ly, sysZ - ly)
-        uprBound = makeStellarGridKey(sysX + ly, sysY + ly, sysZ + ly)
-        lySq = ly ** 2
-        stellarGrid = self.stellarGrid
-        for x in range(lwrBound[0], uprBound[0]+1): # Mind: range(a, b) is wit a and without b
-            for y in range(lwrBound[1], uprBound[1]+1):
-                for z in range(lwrBound[2], uprBound[2]+1):
-                    try:
-                        grid = stellarGrid[(x, y, z)]
-                    except KeyError:
-                        continue
-                    for candidate in grid:
-                        px, py, pz = candidate.posX - sysX, candidate.posY - sysY, candidate.posZ - sysZ
-                        distSq = px*px + py*py + pz*pz
-                        if distSq > lySq:
-                            continue
-                        if candidate is not system:
-                            yield candidate, distSq ** 0.5
+        for candidate, dist in self.querySphere(system, ly):
+            if candidate is not system:
+                yield candidate, dist
     
     def genSystemsInRange(self, system, ly, includeSelf=False):
         """
@@ -1004,11 +1184,24 @@ class TradeDB(object):
         cachedSystems = cache.systems
         
         if ly > cache.probedLy:
-            # Consult the database for stars we haven't seen.
-            cachedSystems = cache.systems = list(
-                self.genStellarGrid(system, ly)
-            )
-            cachedSystems.sort(key=lambda ent: ent[1])
+            if not self.jumpGraphLoaded:
+                self._loadJumpGraph()
+            jumpRow = None
+            if self.jumpGraph and ly <= self.jumpGraph.maxLy:
+                jumpRow = self.jumpGraphRows.get(system.ID, None)
+            if jumpRow is not None:
+                # Use the precomputed neighbours.
+                jumpSystems = self.jumpGraphSystems
+                cachedSystems = cache.systems = [
+                    (jumpSystems[index], dist)
+                    for index, dist in self.jumpGraph.neighboursOf(jumpRow, ly)
+                ]
+            else:
+                # Consult the database for stars we haven't seen.
+                cachedSystems = cache.systems = list(
+                    self.genStellarGrid(system, ly)
+                )
+                cachedSystems.sort(key=lambda ent: ent[1])
             cache.probedLy = ly
         
         if includeSelf:
@@ -1023,7 +1216,182 @@ class TradeDB(object):
             # No need to be conditional inside the loop
             yield from cachedSystems
     
-    def getRoute(self, origin, dest, maxJumpLy, avoiding=[], stationInterval=0):
+    def _systemArrays(self):
+        """
+        Returns the loaded systems sorted by ID, along with the
+        (systemIDs, positions) arrays JumpGraph uses to describe them.
+        """
+        systems = sorted(self.systemByID.values(), key=lambda system: system.ID)
+        systemIDs = numpy.array(
+            [system.ID for system in systems], dtype=numpy.int64
+        )
+        positions = numpy.array(
+            [(system.posX, system.posY, system.posZ) for system in systems],
+            dtype=numpy.float64,
+        ).reshape(-1, 3)
+        return systems, systemIDs, positions
+    
+    def buildJumpGraph(self, tiers=None):
+        """
+        Precomputes the systems within each of the jump ranges in
+        tiers (defaults to JumpGraph.defaultTiers) and saves them to
+        the jump graph file beside the .db, which genSystemsInRange
+        will use from then on.
+        """
+        tiers = tiers or JumpGraph.defaultTiers
+        systems, systemIDs, positions = self._systemArrays()
+        self.tdenv.DEBUG0(
+            "Building jump graph for {:n} systems, tiers {}",
+            len(systems), tiers,
+        )
+        jumpGraph = JumpGraph.build(
+            self.jumpGraphPath, systemIDs, positions, tiers
+        )
+        self._useJumpGraph(jumpGraph, systems)
+        return jumpGraph
+    
+    def _loadJumpGraph(self):
+        """
+        Memory maps the jump graph file, if there is one. If it no
+        longer matches the loaded systems it is ignored, leaving
+        genSystemsInRange to search the stellar grid, until it is
+        rebuilt with "buildcache --jump-tiers".
+        """
+        self.jumpGraph, self.jumpGraphLoaded = None, True
+        if not self.jumpGraphPath.exists():
+            return
+        try:
+            jumpGraph = JumpGraph(self.jumpGraphPath)
+        except (OSError, ValueError) as e:
+            self.tdenv.WARN("Ignoring jump graph: {}", e)
+            return
+        
+        systems, systemIDs, positions = self._systemArrays()
+        if not jumpGraph.matches(systemIDs, positions):
+            self.tdenv.NOTE(
+                "Systems have changed since the jump graph was built, "
+                "ignoring it. Use \"trade buildcache --jump-tiers={}\" "
+                "to rebuild it.",
+                ",".join("{:g}".format(ly) for ly in jumpGraph.tiers),
+            )
+            return
+        
+        self._useJumpGraph(jumpGraph, systems)
+        self.tdenv.DEBUG1(
+            "Loaded jump graph for {:n} systems, tiers {}",
+            len(systems), jumpGraph.tiers,
+        )
+    
+    def _useJumpGraph(self, jumpGraph, systems):
+        self.jumpGraph, self.jumpGraphLoaded = jumpGraph, True
+        self.jumpGraphSystems = systems
+        self.jumpGraphRows = {
+            system.ID: row for row, system in enumerate(systems)
+        }
+    
+    def getTradeIndex(self):
+        """
+        Returns the TradeIndex file beside the .db, or None if there
+        isn't one (see TradeCalc.buildTradeIndex). It is mapped again
+        whenever the file has been replaced.
+        
+        The index may be of older prices, see TradeIndex.matches.
+        """
+        try:
+            st = self.tradeIndexPath.stat()
+        except FileNotFoundError:
+            self.tradeIndex, self.tradeIndexFileID = None, None
+            return None
+        fileID = (st.st_ino, st.st_mtime_ns)
+        if fileID != self.tradeIndexFileID:
+            self.tradeIndex, self.tradeIndexFileID = None, fileID
+            try:
+                self.tradeIndex = TradeIndex(self.tradeIndexPath)
+            except (OSError, ValueError) as e:
+                self.tdenv.WARN("Ignoring trade index: {}", e)
+        return self.tradeIndex
+    
+    def buildLandmarks(self, maxLy):
+        """
+        Builds the LandmarkTable for jumps of up to maxLy and saves it
+        beside the .db, where getLandmarks will find it.
+        """
+        systems, systemIDs, positions = self._systemArrays()
+        self.tdenv.DEBUG0(
+            "Building route landmarks for {:n} systems, {:g}ly jumps",
+            len(systems), maxLy,
+        )
+        rowByID = {system.ID: row for row, system in enumerate(systems)}
+        
+        def neighbours(row):
+            for nSys, nDist in self.genSystemsInRange(systems[row], maxLy):
+                yield rowByID[nSys.ID], nDist
+        
+        landmarks = LandmarkTable.build(
+            maxLy, systemIDs, positions, neighbours
+        )
+        landmarks.save(self.dbPath.with_suffix(
+            LandmarkTable.suffix.format(maxLy)
+        ))
+        self.landmarksByLy = {}
+        return landmarks
+    
+    def getLandmarks(self, maxLy):
+        """
+        Returns the saved LandmarkTable with the shortest jump range
+        of at least maxLy, or None if "buildcache --landmarks" hasn't
+        built one for the current systems.
+        
+        Longer jumps can only shorten routes, so a table built for a
+        longer range still gives lower bounds, just looser ones.
+        """
+        if maxLy in self.landmarksByLy:
+            return self.landmarksByLy[maxLy]
+        
+        prefix, suffix = LandmarkTable.suffix.split('{:g}')
+        prefix = self.dbPath.stem + prefix
+        candidates = []
+        for path in self.dbPath.parent.glob(prefix + '*' + suffix):
+            try:
+                tableLy = float(path.name[len(prefix):-len(suffix)])
+            except ValueError:
+                continue
+            if tableLy >= maxLy:
+                candidates.append((tableLy, path))
+        
+        landmarks = None
+        systems, systemIDs, positions = self._systemArrays()
+        for tableLy, path in sorted(candidates):
+            try:
+                landmarks = LandmarkTable.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                self.tdenv.WARN("Ignoring {}: {}", path, e)
+                continue
+            if landmarks.matches(systemIDs, positions):
+                break
+            self.tdenv.NOTE(
+                "Systems have changed since the {:g}ly route landmarks "
+                "were built, ignoring them. Use \"trade buildcache "
+                "--landmarks={:g}\" to rebuild them.", tableLy, tableLy
+            )
+            landmarks = None
+        
+        if not landmarks:
+            self.tdenv.NOTE(
+                "No route landmarks for {:g}ly jumps, using straight-line "
+                "distances. Use \"trade buildcache --landmarks={:g}\" "
+                "to build them.", maxLy, maxLy
+            )
+        self.landmarksByLy[maxLy] = landmarks
+        return landmarks
+    
+    # Search strategies accepted by getRoute.
+    routeEngines = ('astar', 'alt', 'bidir')
+    
+    def getRoute(
+            self, origin, dest, maxJumpLy, avoiding=[], stationInterval=0,
+            engine=None,
+            ):
         """
         Find a shortest route between two systems with an additional
         constraint that each system be a maximum of maxJumpLy from
@@ -1040,6 +1408,12 @@ class TradeDB(object):
                 List of systems being avoided
             stationInterval:
                 If non-zero, require a station at least this many jumps,
+            engine:
+                'astar' (default) searches outwards from origin,
+                'alt' uses landmark lower bounds (see getLandmarks) as
+                the A* heuristic, 'bidir' also searches back from dest
+                at the same time (falls back to 'alt' when a
+                stationInterval is given),
             tdenv.padSize:
                 Controls the pad size of stations for refuelling
         
@@ -1073,6 +1447,23 @@ class TradeDB(object):
         if origin == dest:
             return ((origin, 0), (dest, 0))
         
+        engine = engine or 'astar'
+        if engine not in TradeDB.routeEngines:
+            raise ValueError("Unknown route engine: {}".format(engine))
+        heuristic = None
+        if engine != 'astar':
+            landmarks = self.getLandmarks(maxJumpLy)
+            toDest = self._routeBound(landmarks, dest)
+            if toDest(origin) == float("inf"):
+                # The landmarks show there's no route at all.
+                return None
+            if engine == 'bidir' and not stationInterval:
+                return self._getRouteBidirectional(
+                    origin, dest, maxJumpLy, avoiding,
+                    toDest, self._routeBound(landmarks, origin),
+                )
+            heuristic = toDest
+        
         # openSet is the list of nodes we want to visit, which will be
         # used as a priority queue (heapq).
         # Each element is a tuple of the 'priority' (the combination of
@@ -1139,7 +1530,7 @@ class TradeDB(object):
                 if getDist(nSys, defaultDist)[1] <= newDist:
                     continue
                 distances[nSys] = (curSys, newDist)
-                weight = distFn(nSys)
+                weight = heuristic(nSys) if heuristic else distFn(nSys)
                 nID = nSys.ID
                 heappush(openSet, (newDist + weight, newDist, nID, stnDist))
                 if nID == destID:
@@ -1161,6 +1552,100 @@ class TradeDB(object):
         
         return path
     
+    @staticmethod
+    def _routeBound(landmarks, target):
+        """
+        Returns a function giving a lower bound on the route length
+        from a system to target: the larger of the straight-line
+        distance and the landmark bound, if there are landmarks.
+        """
+        straightLine = target.distanceTo
+        landmarkBound = landmarks.lowerBound(target) if landmarks else None
+        if not landmarkBound:
+            return straightLine
+        
+        def bound(system):
+            return max(straightLine(system), landmarkBound(system.ID))
+        
+        return bound
+    
+    def _getRouteBidirectional(
+            self, origin, dest, maxJumpLy, avoiding, toDest, toOrigin,
+            ):
+        """
+        Bidirectional A* for getRoute: searches forward from origin and
+        backward from dest together, using the average of the two
+        lower bounds as the potential so that the searches can stop as
+        soon as their frontiers prove no shorter route exists.
+        """
+        inf = float("inf")
+        potentials = {}
+        
+        def potential(system):
+            try:
+                return potentials[system]
+            except KeyError:
+                pot = potentials[system] = (toDest(system) - toOrigin(system)) / 2
+                return pot
+        
+        fwdDist = {origin: (None, 0)}
+        revDist = {dest: (None, 0)}
+        if avoiding:
+            if dest in avoiding:
+                raise ValueError("Destination is in avoidance list")
+            for avoid in avoiding:
+                if isinstance(avoid, System):
+                    fwdDist[avoid] = revDist[avoid] = (None, -1)
+        
+        fwdOpen = [(potential(origin), 0, origin.ID)]
+        revOpen = [(-potential(dest), 0, dest.ID)]
+        systemsInRange = self.genSystemsInRange
+        heappop = heapq.heappop
+        heappush = heapq.heappush
+        defaultDist = (None, inf)
+        sysByID = self.systemByID
+        bestLy, meeting = inf, None
+        
+        while fwdOpen and revOpen:
+            # Nothing left on either frontier can beat what we've got.
+            if fwdOpen[0][0] + revOpen[0][0] >= bestLy:
+                break
+            # Advance whichever frontier is smaller.
+            if len(fwdOpen) <= len(revOpen):
+                openSet, distances, others, sign = fwdOpen, fwdDist, revDist, 1
+            else:
+                openSet, distances, others, sign = revOpen, revDist, fwdDist, -1
+            _, curDist, curSysID = heappop(openSet)
+            curSys = sysByID[curSysID]
+            if curDist > distances[curSys][1]:
+                continue
+            getDist, getOther = distances.get, others.get
+            for nSys, nDist in systemsInRange(curSys, maxJumpLy):
+                newDist = curDist + nDist
+                if getDist(nSys, defaultDist)[1] <= newDist:
+                    continue
+                distances[nSys] = (curSys, newDist)
+                otherDist = getOther(nSys, defaultDist)[1]
+                if otherDist >= 0 and newDist + otherDist < bestLy:
+                    bestLy, meeting = newDist + otherDist, nSys
+                heappush(openSet, (newDist + sign * potential(nSys), newDist, nSys.ID))
+        
+        if meeting is None:
+            return None
+        
+        path = []
+        system = meeting
+        while system:
+            path.append((system, fwdDist[system][1]))
+            system = fwdDist[system][0]
+        path.reverse()
+        system = revDist[meeting][0]
+        while system:
+            path.append((system, bestLy - revDist[system][1]))
+            system = revDist[system][0]
+        
+        return path
+    
     ############################################################
     # Station data.
     
@@ -1183,7 +1668,7 @@ class TradeDB(object):
         
         stationByID = {}
         systemByID = self.systemByID
-        self.tradingStationCount = 0
+        loadTrading = self._loadStationTrading
         # Fleet Carriers are station type 24.
         # Odyssey settlements are station type 25.
         # Storing as a list allows easy expansion if needed.
@@ -1200,30 +1685,67 @@ class TradeDB(object):
                     ID, systemByID[systemID], name, prettyName,
                     lsFromStar, market, blackMarket, shipyard,
                     maxPadSize, outfitting, rearm, refuel, repair, planetary, isFleet, isOdyssey,
-                    0, None,
+                    None, None, loadTrading,
                 )
                 stationByID[ID] = station
         
-        tradingCount = 0
+        self.stationByID = stationByID
+        self.tdenv.DEBUG1("Loaded {:n} Stations", len(stationByID))
+        self.spatialIndex = None
+    
+    def loadTrading(self, stations):
+        """
+        Loads the itemCount and dataAge of those of stations that
+        haven't been yet, a batch of them per query rather than a
+        query for each when they are first used.
+        """
+        stationIDs = [
+            station.ID for station in stations if station._itemCount is None
+        ]
+        for start in range(0, len(stationIDs), self.loadTradingBatch):
+            self._loadStationTrading(
+                stationIDs[start:start + self.loadTradingBatch]
+            )
+    
+    def _loadStationTrading(self, stationIDs=None):
+        """
+        Sets the itemCount and dataAge of every Station (or just those
+        with the given IDs) from the StationItem table, and updates the
+        tradingStationCount if it has been counted.
+        """
         stmt = """
             SELECT  station_id,
                     COUNT(*) AS item_count,
                     AVG(JULIANDAY('now') - JULIANDAY(modified))
               FROM  StationItem
+              {where}
              GROUP  BY 1
              HAVING item_count > 0
         """
-        with closing(self.query(stmt)) as cur:
-            for ID, itemCount, dataAge in cur:
-                station = stationByID[ID]
-                station.itemCount = itemCount
-                station.dataAge = dataAge
-                tradingCount += 1
-        
-        self.stationByID = stationByID
-        self.tradingStationCount = tradingCount
-        self.tdenv.DEBUG1("Loaded {:n} Stations", len(stationByID))
-        self.stellarGrid = None
+        stationByID = self.stationByID
+        tradingCount = self.__dict__.get('tradingStationCount', None)
+        if stationIDs is None:
+            stations, where = stationByID.values(), ""
+            tradingCount = 0
+        else:
+            stations = [stationByID[ID] for ID in stationIDs if ID in stationByID]
+            where = "WHERE station_id IN ({})".format(
+                ",".join(str(station.ID) for station in stations)
+            )
+            if tradingCount is not None:
+                tradingCount -= sum(1 for station in stations if station._itemCount)
+        for station in stations:
+            station.itemCount, station.dataAge = 0, None
+        if stations:
+            with closing(self.query(stmt.format(where=where))) as cur:
+                for ID, itemCount, dataAge in cur:
+                    station = stationByID[ID]
+                    station.itemCount = itemCount
+                    station.dataAge = dataAge
+                    if tradingCount is not None:
+                        tradingCount += 1
+        if tradingCount is not None:
+            self.tradingStationCount = tradingCount
     
     def addLocalStation(
             self,
@@ -1690,31 +2212,13 @@ class TradeDB(object):
             )
         return system.stations[0]
     
-    def getDestinations(
-            self,
-            origin,
-            maxJumps=None,
-            maxLyPer=None,
-            avoidPlaces=None,
-            maxPadSize=None,
-            maxLsFromStar=0,
-            noPlanet=False,
-            planetary=None,
-            fleet=None,
-            odyssey=None,
-            ):
+    def _getDestinationSystems(self, origSys, maxJumps, maxLyPer, avoidPlaces):
         """
-        Gets a list of the Station destinations that can be reached
-        from this Station within the specified constraints.
-        Limits to stations we are trading with if trading is True.
+        Returns a tuple of DestinationNodes for the systems reachable
+        from origSys in up to maxJumps jumps of maxLyPer, with the
+        shortest path found to each. getDestinations caches these.
         """
         
-        if maxJumps is None:
-            maxJumps = sys.maxsize
-        maxLyPer = maxLyPer or self.maxSystemLinkLy
-        if avoidPlaces is None:
-            avoidPlaces = ()
-        
         # The open list is the list of nodes we should consider next for
         # potential destinations.
         # The path list is a list of the destinations we've found and the
@@ -1722,7 +2226,6 @@ class TradeDB(object):
         # The closed list is the list of nodes we've already been to (so
         # that we don't create loops A->B->C->A->B->C->...)
         
-        origSys = origin.system if isinstance(origin, Station) else origin
         openList = [DestinationNode(origSys, [origSys], 0)]
         # I don't want to have to consult both the pathList
         # AND the avoid list every time I'm considering a
@@ -1772,10 +2275,57 @@ class TradeDB(object):
                     openList.append(destNode)
         
         # Remove the avoid systems (having negative distance)
-        pathList = dict(filter(lambda x: x[1].distLy >= 0, pathList.items()))
+        return tuple(node for node in pathList.values() if node.distLy >= 0)
+    
+    def getDestinations(
+            self,
+            origin,
+            maxJumps=None,
+            maxLyPer=None,
+            avoidPlaces=None,
+            maxPadSize=None,
+            maxLsFromStar=0,
+            noPlanet=False,
+            planetary=None,
+            fleet=None,
+            odyssey=None,
+            ):
+        """
+        Gets a list of the Station destinations that can be reached
+        from this Station within the specified constraints.
+        Limits to stations we are trading with if trading is True.
+        """
+        
+        if maxJumps is None:
+            maxJumps = sys.maxsize
+        maxLyPer = maxLyPer or self.maxSystemLinkLy
+        if avoidPlaces is None:
+            avoidPlaces = ()
+        
+        origSys = origin.system if isinstance(origin, Station) else origin
+        # Only avoided systems change the search; avoided stations are
+        # filtered out below.
+        avoidIDs = frozenset(
+            place.ID for place in avoidPlaces if isinstance(place, System)
+        )
+        key = (origSys.ID, maxJumps, maxLyPer, avoidIDs)
+        cache = self.destinationCache
+        pathList = cache.get(key, None)
+        if pathList is not None:
+            cache.move_to_end(key)
+            self.destinationCacheHits += 1
+        else:
+            self.destinationCacheMisses += 1
+            pathList = self._getDestinationSystems(
+                origSys, maxJumps, maxLyPer, avoidPlaces
+            )
+            cache[key] = pathList
+            if len(cache) > self.destinationCacheSize:
+                cache.popitem(last=False)
+        
         # We have a system-to-system path list, now we need stations to terminate at.
         def path_iter_fn():
-            for node in pathList.values():
+            for node in pathList:
                 for station in node.system.stations:
                     yield node, station
         
@@ -2026,6 +2576,12 @@ class TradeDB(object):
         if self.conn:
             self.conn.close()
         self.conn = None
+        with self.readPoolLock:
+            readPool, self.readPool = self.readPool, []
+        for conn in readPool:
+            conn.close()
+        # data_version is per-connection, and the tracking tables are gone.
+        self.dataVersion, self.dataTracked = None, False
     
     def load(self, maxSystemLinkLy=None):
         """
@@ -2035,25 +2591,400 @@ class TradeDB(object):
                 tdb.load()
                 x = tdb.lookupPlace("Aulin")
                 tdb.load() # x now points to an orphan Aulin
+            Use refresh() to update the existing records instead.
+            
+            With lazyLoad, the data is only dropped here, and each of
+            lazyAttributes is loaded again when it's next used; the
+            itemCount and dataAge of Stations are loaded for just the
+            station used until tradingStationCount is.
         """
         
         self.tdenv.DEBUG1("Loading data")
         
-    
+        # Taken first, so that changes made while loading are seen
+        # by the next refresh().
+        self.dataVersion = self._dataVersion()
+        self.dataTracked = False
+        self.dbFileID = self._dbFileID()
         
-        self._loadAdded()
-        self._loadSystems()
-        self._loadStations()
-        self._loadShips()
-        self._loadCategories()
-        self._loadItems()
-        self._loadRareItems()
+        # Averages are recalculated from the new data on demand.
+        self.avgSelling, self.avgBuying = None, None
+        
+        if self.lazyLoad:
+            for name in TradeDB.lazyAttributes:
+                self.__dict__.pop(name, None)
+        else:
+            self._loadAdded()
+            self._loadSystems()
+            self._loadStations()
+            self._loadStationTrading()
+            self._loadShips()
+            self._loadCategories()
+            self._loadItems()
+            self._loadRareItems()
         
         # Calculate the maximum distance anyone can jump so we can constrain
         # the maximum "link" between any two stars.
         msll = maxSystemLinkLy or self.tdenv.maxSystemLinkLy or 30
         self.maxSystemLinkLy = msll
     
+    ############################################################
+    # Incremental refresh.
+    
+    # Tables whose (ID, modified) refresh() tracks in a temporary
+    # "Loaded<table>" table, to find the rows that have changed.
+    trackedTables = (
+        ('System', 'system_id'),
+        ('Station', 'station_id'),
+    )
+    
+    def _dataVersion(self):
+        """
+        Changes whenever the database is changed, by this connection
+        (total_changes) or any other (PRAGMA data_version).
+        """
+        db = self.getDB()
+        return (db.execute("PRAGMA data_version").fetchone()[0], db.total_changes)
+    
+    def _dbFileID(self):
+        try:
+            st = self.dbPath.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_dev, st.st_ino)
+    
+    def refresh(self):
+        """
+        Brings the loaded data up to date with the database, for
+        long-running processes.
+        
+        Unlike load(), existing System, Station, Item and Category
+        objects are updated in place, so references to them stay valid;
+        only Systems and Stations whose "modified" has changed are
+        re-read. Ships, RareItems and the Added table are small and
+        are simply reloaded.
+        
+        The first call after load() only starts tracking changes, or
+        reloads if the database had already changed. Everything is
+        reloaded if the .db file has been replaced (e.g. by buildcache).
+        
+        Returns True if anything had changed.
+        """
+        if self.conn is not None and self._dbFileID() != self.dbFileID:
+            self.tdenv.DEBUG0("DB file replaced, reloading")
+            self.close()
+        
+        db = self.getDB()
+        version = self._dataVersion()
+        if self.dataTracked and version == self.dataVersion:
+            return False
+        
+        # Read everything from one snapshot of the database, unless
+        # the caller is part way through a transaction of their own.
+        ownTransaction = not db.in_transaction
+        if ownTransaction:
+            db.execute("BEGIN")
+        try:
+            if self.dataTracked:
+                self._refreshLoaded()
+                changed = True
+            else:
+                changed = version != self.dataVersion
+                if changed:
+                    self.load(getattr(self, 'maxSystemLinkLy', None))
+                self._trackLoaded()
+        except Exception:
+            if ownTransaction:
+                db.rollback()
+            self.dataTracked = False
+            raise
+        if ownTransaction:
+            db.commit()
+        
+        # Recording our own changes to the tracking tables.
+        self.dataVersion = (version[0], db.total_changes)
+        return changed
+    
+    def _trackLoaded(self):
+        """ Records the (ID, modified) of the loaded rows. """
+        # Finish a lazy load, so that what's tracked is what's loaded.
+        for name in TradeDB.lazyAttributes:
+            getattr(self, name)
+        db = self.getDB()
+        for table, key in self.trackedTables:
+            db.execute("DROP TABLE IF EXISTS temp.Loaded{}".format(table))
+            db.execute("""
+                CREATE TEMP TABLE Loaded{table} (
+                    {key} INTEGER PRIMARY KEY,
+                    modified DATETIME
+                )
+            """.format(table=table, key=key))
+            db.execute("""
+                INSERT INTO temp.Loaded{table}
+                SELECT {key}, modified FROM main.{table}
+            """.format(table=table, key=key))
+        self._trackPrices()
+        self.dataTracked = True
+    
+    def _trackPrices(self):
+        """
+        Records the newest "modified" and the number of StationItems.
+        """
+        db = self.getDB()
+        self.pricesModified = db.execute(
+            "SELECT IFNULL(MAX(modified), '') FROM StationItem"
+        ).fetchone()[0]
+        self.pricesCount = db.execute(
+            "SELECT COUNT(*) FROM StationItem"
+        ).fetchone()[0]
+    
+    def _changedRows(self, table, key, columns):
+        """
+        Returns the rows (key, columns...) of table that were added or
+        modified since they were last tracked, and the keys of the rows
+        that were deleted; then tracks them as loaded.
+        """
+        db = self.getDB()
+        changed = db.execute("""
+            SELECT  t.{key}, {columns}, t.modified
+              FROM  main.{table} AS t
+                    LEFT OUTER JOIN temp.Loaded{table} AS l USING ({key})
+             WHERE  l.modified IS NOT t.modified
+        """.format(
+            table=table, key=key,
+            columns=", ".join("t." + col for col in columns.split(", "))
+        )).fetchall()
+        deleted = [
+            ID for (ID,) in db.execute("""
+                SELECT  {key}
+                  FROM  temp.Loaded{table}
+                 WHERE  {key} NOT IN (SELECT {key} FROM main.{table})
+            """.format(table=table, key=key))
+        ]
+        db.executemany(
+            "INSERT OR REPLACE INTO temp.Loaded{} VALUES (?, ?)".format(table),
+            ((row[0], row[-1]) for row in changed)
+        )
+        db.executemany(
+            "DELETE FROM temp.Loaded{} WHERE {} = ?".format(table, key),
+            ((ID,) for ID in deleted)
+        )
+        return [row[:-1] for row in changed], deleted
+    
+    def _refreshLoaded(self):
+        self.avgSelling, self.avgBuying = None, None
+        self._loadAdded()
+        self._refreshSystems()
+        self._refreshStations()
+        self._refreshStationTrading()
+        self._loadShips()
+        self._refreshItems()
+        self._loadRareItems()
+    
+    def _refreshSystems(self):
+        changed, deleted = self._changedRows(
+            'System', 'system_id', 'name, pretty_name, pos_x, pos_y, pos_z, added_id'
+        )
+        systemByID, systemByName = self.systemByID, self.systemByName
+        # Positions that systems have appeared at or gone from.
+        moves = []
+        for ID in deleted:
+            system = systemByID.pop(ID, None)
+            if system:
+                if systemByName.get(system.dbname) is system:
+                    del systemByName[system.dbname]
+                moves.append((system.posX, system.posY, system.posZ))
+        for ID, name, prettyName, posX, posY, posZ, addedID in changed:
+            system = systemByID.get(ID, None)
+            if system is None:
+                system = System(ID, name, prettyName, posX, posY, posZ, addedID)
+                systemByID[ID] = system
+                moves.append((posX, posY, posZ))
+            else:
+                if system.dbname != name and systemByName.get(system.dbname) is system:
+                    del systemByName[system.dbname]
+                system.dbname, system.prettyName = name, prettyName
+                system.addedID = addedID or 0
+                if (posX, posY, posZ) != (system.posX, system.posY, system.posZ):
+                    moves.append((system.posX, system.posY, system.posZ))
+                    moves.append((posX, posY, posZ))
+                    system.posX, system.posY, system.posZ = posX, posY, posZ
+                    system.pos = numpy.array([posX, posY, posZ], numpy.float32)
+                    system._rangeCache = None
+            systemByName[name] = system
+        
+        self.tdenv.DEBUG0(
+            "Refreshed {:n} Systems, {:n} deleted", len(changed), len(deleted)
+        )
+        if moves:
+            self._invalidateRanges(moves)
+            self.spatialIndex = None
+            self.jumpGraph, self.jumpGraphLoaded = None, False
+            self.landmarksByLy = {}
+            self.destinationCache.clear()
+            self.outboundTables.clear()
+    
+    def _invalidateRanges(self, positions):
+        """
+        Drops the genSystemsInRange caches that reach any of positions.
+        """
+        positions = numpy.array(positions, dtype=numpy.float64)
+        for system in self.systemByID.values():
+            cache = system._rangeCache
+            if cache is None:
+                continue
+            delta = positions - (system.posX, system.posY, system.posZ)
+            if (delta * delta).sum(axis=1).min() <= cache.probedLy ** 2:
+                system._rangeCache = None
+    
+    def _refreshStations(self):
+        changed, deleted = self._changedRows(
+            'Station', 'station_id',
+            'system_id, name, pretty_name, '
+            'ls_from_star, market, blackmarket, shipyard, '
+            'max_pad_size, outfitting, rearm, refuel, repair, planetary, type_id'
+        )
+        stationByID, systemByID = self.stationByID, self.systemByID
+        for ID in deleted:
+            station = stationByID.pop(ID, None)
+            if station:
+                if station in station.system.stations:
+                    station.system.stations.remove(station)
+                if station.itemCount:
+                    self.tradingStationCount -= 1
+        # Stations gone or moved to another system, see OutboundTable.
+        moved = list(deleted)
+        for (
+            ID, systemID, name, prettyName,
+            lsFromStar, market, blackMarket, shipyard,
+            maxPadSize, outfitting, rearm, refuel, repair, planetary, type_id
+        ) in changed:
+            # See _loadStations.
+            isFleet = 'Y' if int(type_id) == 24 else 'N'
+            isOdyssey = 'Y' if int(type_id) == 25 else 'N'
+            system = systemByID[systemID]
+            station = stationByID.get(ID, None)
+            if station is None:
+                stationByID[ID] = Station(
+                    ID, system, name, prettyName,
+                    lsFromStar, market, blackMarket, shipyard,
+                    maxPadSize, outfitting, rearm, refuel, repair, planetary, isFleet, isOdyssey,
+                    0, None,
+                )
+                continue
+            if station.system is not system:
+                if station in station.system.stations:
+                    station.system.stations.remove(station)
+                station.system = system
+                system.stations.append(station)
+                moved.append(ID)
+            station.dbname, station.prettyName = name, prettyName
+            station.lsFromStar = int(lsFromStar)
+            station.market, station.blackMarket = market, blackMarket
+            station.shipyard, station.maxPadSize = shipyard, maxPadSize
+            station.outfitting, station.rearm = outfitting, rearm
+            station.refuel, station.repair = refuel, repair
+            station.planetary, station.fleet, station.odyssey = planetary, isFleet, isOdyssey
+        for table in self.outboundTables.values():
+            table.pricesChanged(moved)
+        
+        self.tdenv.DEBUG0(
+            "Refreshed {:n} Stations, {:n} deleted", len(changed), len(deleted)
+        )
+    
+    def _refreshStationTrading(self):
+        """
+        Updates itemCount and dataAge for the Stations with prices
+        newer than the newest at the last refresh and, if the number
+        of prices has changed, those whose number of prices has.
+        
+        Prices changed to an older "modified" than that aren't seen
+        unless their number changes, which can leave dataAge stale;
+        scanning all of StationItem for them would cost as much as
+        load()ing.
+        """
+        db = self.getDB()
+        # Not DISTINCT, which would stop SQLite using si_mod_stn_itm.
+        stationIDs = {
+            ID for (ID,) in db.execute("""
+                SELECT  station_id
+                  FROM  StationItem
+                 WHERE  modified > ?
+            """, [self.pricesModified])
+        }
+        count = db.execute("SELECT COUNT(*) FROM StationItem").fetchone()[0]
+        if count != self.pricesCount:
+            counts = dict(db.execute("""
+                SELECT  station_id, COUNT(*)
+                  FROM  StationItem
+                 GROUP  BY 1
+            """))
+            stationIDs.update(
+                ID for ID, station in self.stationByID.items()
+                if counts.get(ID, 0) != station.itemCount
+            )
+        self._loadStationTrading(stationIDs)
+        self._trackPrices()
+        for table in self.outboundTables.values():
+            table.pricesChanged(stationIDs)
+        self.tdenv.DEBUG0("Refreshed prices of {:n} Stations", len(stationIDs))
+    
+    def _refreshItems(self):
+        """
+        Categories and Items are few and have no "modified", so are
+        all compared.
+        """
+        categoryByID = self.categoryByID
+        seen = set()
+        with closing(self.query("SELECT category_id, name FROM Category")) as cur:
+            for ID, name in cur:
+                seen.add(ID)
+                category = categoryByID.get(ID, None)
+                if category is None or category.dbname != name:
+                    # Categories are immutable, so replace renamed ones.
+                    items = category.items if category else []
+                    category = categoryByID[ID] = Category(ID, name, items)
+                    for item in items:
+                        item.category = category
+        for ID in set(categoryByID) - seen:
+            del categoryByID[ID]
+        
+        stmt = """
+            SELECT item_id, name, pretty_name, category_id, avg_price, fdev_id
+              FROM Item
+        """
+        itemByID = self.itemByID
+        seen = set()
+        with closing(self.query(stmt)) as cur:
+            for ID, name, prettyName, categoryID, avgPrice, fdevID in cur:
+                seen.add(ID)
+                category = categoryByID[categoryID]
+                item = itemByID.get(ID, None)
+                if item is None:
+                    item = itemByID[ID] = Item(
+                        ID, name, prettyName, category, avgPrice, fdevID
+                    )
+                    category.items.append(item)
+                    continue
+                if item.category is not category:
+                    if item in item.category.items:
+                        item.category.items.remove(item)
+                    item.category = category
+                    category.items.append(item)
+                item.dbname, item.prettyName = name, prettyName
+                item.avgPrice, item.fdevID = avgPrice, fdevID
+        for ID in set(itemByID) - seen:
+            item = itemByID.pop(ID)
+            if item in item.category.items:
+                item.category.items.remove(item)
+        
+        self.itemByName.clear()
+        self.itemByFDevID.clear()
+        for item in itemByID.values():
+            self.itemByName[item.dbname] = item
+            if item.fdevID:
+                self.itemByFDevID[item.fdevID] = item
+    
     ############################################################
     # General purpose static methods.
     
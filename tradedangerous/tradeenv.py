@@ -34,6 +34,8 @@ class TradeEnv(object):
         'dataDir': os.environ.get('TD_DATA') or os.path.join(os.getcwd(), 'data'),
         'csvDir': os.environ.get('TD_CSV') or os.environ.get('TD_DATA') or os.path.join(os.getcwd(), 'data'),
         'tmpDir': os.environ.get('TD_TMP') or os.path.join(os.getcwd(), 'tmp'),
+        'spatialIndex': os.environ.get('TD_SPATIAL') or 'kdtree',
+        'walMode': bool(os.environ.get('TD_WAL')),
         'templateDir': os.path.join(_ROOT, 'templates'),
         'cwDir': os.getcwd()
     }
@@ -0,0 +1,218 @@
+# --------------------------------------------------------------------
+# Copyright (C) Oliver 'kfsone' Smith 2014 <oliver@kfs.org>:
+# Copyright (C) Bernd 'Gazelle' Gollesch 2016, 2017
+# Copyright (C) Jonathan 'eyeonus' Jones 2018, 2019
+#
+# You are free to use, redistribute, or even print and eat a copy of
+# this software so long as you include this copyright notice.
+# I guarantee there is at least one bug neither of us knew about.
+# --------------------------------------------------------------------
+# TradeDangerous :: Modules :: Precomputed trade index
+
+"""
+TradeIndex is a precomputed table of the most profitable places to
+take what each station sells: for every station, the topK stations
+within radiusLy ly of it that pay the most per ton over its price for
+one of its items, and that item. It is stored in a binary sidecar next
+to the .db (TradeDangerous.trades), built by "buildcache --trade-index"
+and memory-mapped when used.
+
+File layout (all little-endian, each array 8-byte aligned):
+    magic               b'TDTRIDX\\0'
+    headerLen           uint32, length of the JSON header
+    header              {"version", "state", "radiusLy", "topK",
+                         "stations", "pairs"}
+    stationIDs          int64[stations], ascending
+    offsets             int64[stations + 1], stationIDs[n]'s pairs
+                        are pairs[offsets[n]:offsets[n + 1]]
+    pairs               pairType[pairs], by gain descending
+
+The state is the PriceSnapshot.dbState of the .db the index was built
+from; the index only describes the prices in the .db while it matches.
+"""
+
+######################################################################
+# Imports
+
+import json
+import os
+import struct
+
+import numpy
+
+######################################################################
+# Classes
+
+
+class TradeIndex(object):
+    """
+    Memory-mapped top destinations of each station.
+    
+    Attributes:
+        path
+            Path of the sidecar file,
+        state
+            PriceSnapshot.dbState of the .db it was built from,
+        radiusLy
+            How far from each station destinations were looked for,
+        topK
+            The most destinations kept for a station,
+        stationIDs, offsets, pairs
+            The (read-only) arrays described in the module docstring.
+    """
+    
+    magic = b'TDTRIDX\0'
+    version = 1
+    
+    # Defaults for "buildcache --trade-index" with no value.
+    defaultRadiusLy = 40
+    defaultTopK = 10
+    
+    pairType = numpy.dtype([
+        ('dst', '<i8'),
+        ('item', '<i8'),
+        ('gain', '<i8'),
+        ('cost', '<i8'),
+        ('dist', '<f8'),
+    ])
+    
+    def __init__(self, path):
+        self.path = path
+        with open(str(path), 'rb') as fh:
+            magic = fh.read(len(self.magic))
+            if magic != self.magic:
+                raise ValueError("{}: not a trade index".format(path))
+            headerLen, = struct.unpack('<I', fh.read(4))
+            header = json.loads(fh.read(headerLen).decode())
+        if header.get('version') != self.version:
+            raise ValueError("{}: unsupported version".format(path))
+        
+        self.state = header['state']
+        self.radiusLy = header['radiusLy']
+        self.topK = header['topK']
+        numStations, numPairs = header['stations'], header['pairs']
+        offset = _align(len(self.magic) + 4 + headerLen)
+        self.stationIDs = self._map(path, '<i8', offset, numStations)
+        offset = _align(offset + numStations * 8)
+        self.offsets = self._map(path, '<i8', offset, numStations + 1)
+        offset = _align(offset + (numStations + 1) * 8)
+        self.pairs = self._map(path, self.pairType, offset, numPairs)
+    
+    @staticmethod
+    def _map(path, dtype, offset, count):
+        if not count:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(
+            str(path), dtype=dtype, mode='r', offset=offset, shape=(count,),
+        )
+    
+    def __len__(self):
+        return len(self.stationIDs)
+    
+    def matches(self, state):
+        return self.state == state
+    
+    def pairsFrom(self, stationID):
+        """ Returns the pairs of the station, by gain descending. """
+        n = numpy.searchsorted(self.stationIDs, stationID)
+        if n == len(self.stationIDs) or self.stationIDs[n] != stationID:
+            return self.pairs[0:0]
+        return self.pairs[self.offsets[n]:self.offsets[n + 1]]
+    
+    def bestGain(self, stationID):
+        """
+        Returns the most per ton to be made taking something from the
+        station to another within radiusLy, or 0.
+        """
+        pairs = self.pairsFrom(stationID)
+        return int(pairs['gain'][0]) if len(pairs) else 0
+    
+    def sources(self):
+        """ Returns the station ID each of pairs is from. """
+        return numpy.repeat(self.stationIDs, numpy.diff(self.offsets))
+    
+    @classmethod
+    def findPairs(cls, matrix, srcID, dstIDs, distances, topK):
+        """
+        Returns the pairType array of the topK of dstIDs, at distances
+        ly from srcID, paying the most over what srcID sells an item
+        for in the PriceMatrix, by gain descending and then the order
+        of dstIDs.
+        """
+        found = matrix.compareMany(srcID, dstIDs) if len(dstIDs) else None
+        if found is None or not len(found[0]):
+            return numpy.zeros(0, dtype=cls.pairType)
+        group, srcPos, _, gainCr = found
+        # compareMany puts each destination's best trade first.
+        first = numpy.flatnonzero(numpy.diff(group, prepend=-1))
+        group, srcPos, gainCr = group[first], srcPos[first], gainCr[first]
+        order = numpy.argsort(-gainCr, kind='stable')[:topK]
+        group, srcPos = group[order], srcPos[order]
+        
+        pairs = numpy.zeros(len(order), dtype=cls.pairType)
+        pairs['dst'] = numpy.asarray(dstIDs, dtype=numpy.int64)[group]
+        pairs['item'] = matrix.itemIDs[matrix.selling.items[srcPos]]
+        pairs['gain'] = gainCr[order]
+        pairs['cost'] = matrix.selling.price[srcPos]
+        pairs['dist'] = numpy.asarray(distances, dtype=numpy.float64)[group]
+        return pairs
+    
+    @classmethod
+    def write(cls, path, state, radiusLy, topK, stationPairs):
+        """
+        Writes the index of stationPairs, a list of (stationID, pairs)
+        sorted by stationID, to path.
+        """
+        stationPairs = [
+            (stationID, pairs) for stationID, pairs in stationPairs
+            if len(pairs)
+        ]
+        stationIDs = numpy.array(
+            [stationID for stationID, _ in stationPairs], dtype=numpy.int64
+        )
+        counts = [len(pairs) for _, pairs in stationPairs]
+        offsets = numpy.zeros(len(stationIDs) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=offsets[1:])
+        if stationPairs:
+            pairs = numpy.concatenate([pairs for _, pairs in stationPairs])
+        else:
+            pairs = numpy.zeros(0, dtype=cls.pairType)
+        
+        header = json.dumps({
+            'version': cls.version,
+            'state': state,
+            'radiusLy': radiusLy,
+            'topK': topK,
+            'stations': len(stationIDs),
+            'pairs': len(pairs),
+        }).encode()
+        
+        # Write to a temporary file so readers never see a partial index.
+        tmpPath = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with open(tmpPath, 'wb') as fh:
+                fh.write(cls.magic)
+                fh.write(struct.pack('<I', len(header)))
+                fh.write(header)
+                for array in (
+                        stationIDs.astype('<i8'),
+                        offsets.astype('<i8'),
+                        pairs.astype(cls.pairType),
+                        ):
+                    fh.write(b'\0' * (_align(fh.tell()) - fh.tell()))
+                    fh.write(array.tobytes())
+            os.replace(tmpPath, str(path))
+        except OSError:
+            if os.path.exists(tmpPath):
+                os.unlink(tmpPath)
+            raise
+        
+        return cls(path)
+
+
+######################################################################
+# Helpers
+
+
+def _align(offset):
+    return (offset + 7) & ~7